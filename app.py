@@ -4,28 +4,17 @@
 """
 
 import streamlit as st
-import torch
-import pandas as pd
-import numpy as np
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
+import math
 import os
 import sys
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 import time
+# torch、pandas、plotly及项目模块导入较慢，均在首次使用时再导入，缩短冷启动时间
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-# 导入项目模块
-try:
-    from predict import ReactionPredictor
-    from utils import SMILESVocabulary, load_vocab, encode_conditions
-except ImportError as e:
-    st.error(f"导入模块失败: {e}")
-    st.stop()
-
 # 页面配置
 st.set_page_config(
     page_title="消毒副产物预测系统",
@@ -92,52 +81,82 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# 全局变量 - Streamlit Cloud优化
-@st.cache_resource
-def load_model():
-    """加载预训练模型 - 优化版本"""
+def _load_predictor():
+    """在后台线程中加载预测器（不能调用st.*），返回 (predictor, 状态信息)"""
     model_path = "transformer_model.pth"
     vocab_path = "vocabulary.json"
     
-    # 版本兼容性检查
-    st.write(f"🔍 系统信息: Python {sys.version}")
-    st.write(f"🔍 PyTorch版本: {torch.__version__}")
-    st.write(f"🔍 当前目录: {os.getcwd()}")
-    
     if not os.path.exists(model_path):
-        st.error(f"❌ 模型文件不存在: {model_path}")
         return None, "模型文件不存在，请先训练模型"
     
     if not os.path.exists(vocab_path):
-        st.error(f"❌ 词汇表文件不存在: {vocab_path}")
         return None, "词汇表文件不存在，请先训练模型"
     
     try:
-        # 强制使用CPU设备
-        predictor = ReactionPredictor(model_path, vocab_path, device="cpu")
-        st.success("✅ 模型加载成功")
+        from predict import ReactionPredictor, PredictionCache, EncoderCache
+        from inference_metrics import PredictorMetrics
+        
+        # 强制使用CPU设备；预测缓存文件可由多个副本共享（通过环境变量指定共享路径）
+        cache = PredictionCache(os.environ.get("PREDICTION_CACHE_PATH", "prediction_cache.sqlite"))
+        # 编码器缓存使同一输入的多次采样/束搜索跳过重复编码
+        predictor = ReactionPredictor(model_path, vocab_path, device="cpu", cache=cache,
+                                      encoder_cache=EncoderCache(max_bytes=64 * 1024 ** 2), verbose=False,
+                                      metrics=PredictorMetrics())
         return predictor, "模型加载成功"
     except Exception as e:
-        st.error(f"❌ 模型加载失败: {str(e)}")
         return None, f"模型加载失败: {str(e)}"
 
-@st.cache_data
-def cached_predict_product(reactant_smiles, pH, disinfectant, max_length, temperature):
-    """缓存的预测函数 - 提高性能"""
-    # 这个函数会被缓存，相同输入会直接返回缓存结果
+# 全局变量 - Streamlit Cloud优化
+@st.cache_resource
+def start_model_loading() -> Future:
+    """在后台线程中开始加载模型，页面渲染与模型加载同时进行（每个进程只加载一次）"""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader").submit(_load_predictor)
+
+def load_model():
+    """等待后台加载完成，返回 (predictor, 状态信息)"""
+    future = start_model_loading()
+    if not future.done():
+        with st.spinner("⏳ 模型加载中..."):
+            return future.result()
+    return future.result()
+
+DECODING_OPTIONS = {
+    "greedy": "贪心解码",
+    "beam": "束搜索",
+    "top_k": "Top-k采样",
+    "top_p": "Top-p (nucleus)采样"
+}
+
+def build_strategy(decoding_name, temperature, num_candidates):
+    """根据界面参数创建解码策略"""
+    from decoding import BeamSearchDecoder, GreedyDecoder, SamplingDecoder
+    
+    if decoding_name == "beam":
+        return BeamSearchDecoder(beam_size=num_candidates)
+    if decoding_name == "top_k":
+        return SamplingDecoder(num_samples=num_candidates, temperature=temperature, top_k=10)
+    if decoding_name == "top_p":
+        return SamplingDecoder(num_samples=num_candidates, temperature=temperature, top_p=0.9)
+    return GreedyDecoder()
+
+def cached_predict_product(reactant_smiles, pH, disinfectant, max_length, temperature,
+                           decoding_name="greedy", num_candidates=1):
+    """缓存的预测函数 - 提高性能，返回 [(产物SMILES, 对数概率)] 候选列表"""
+    # 确定性解码的结果由预测器的持久化缓存（跨进程、跨重启共享）直接返回
     predictor, _ = load_model()
     if predictor is None:
         raise Exception("模型未加载")
     
-    # 设置线程数以优化性能
+    # 设置线程数以优化性能（模型加载后torch已导入，这里的导入没有额外开销）
+    import torch
     torch.set_num_threads(1)
     
-    return predictor.predict_product(
+    return predictor.predict_candidates(
         reactant_smiles=reactant_smiles,
         pH=pH,
         disinfectant=disinfectant,
-        max_length=max_length,
-        temperature=temperature
+        strategy=build_strategy(decoding_name, temperature, num_candidates),
+        max_length=max_length
     )
 
 # 主界面
@@ -151,17 +170,20 @@ def main():
     </div>
     """, unsafe_allow_html=True)
     
-    # 加载模型 (全局使用)
-    predictor, status_msg = load_model()
+    # 后台加载模型，页面其余部分不必等待加载完成
+    model_loading = start_model_loading()
     
     # 侧边栏
     with st.sidebar:
         st.markdown("## ⚙️ 模型设置")
         
         # 模型状态显示
+        predictor, status_msg = model_loading.result() if model_loading.done() else (None, None)
         model_available = predictor is not None
         
-        if predictor is None:
+        if status_msg is None:
+            st.info("⏳ 模型正在后台加载，可以先填写反应条件")
+        elif predictor is None:
             st.error(status_msg)
             st.markdown("""
             ### 🚀 模型状态
@@ -181,6 +203,34 @@ def main():
             """)
         else:
             st.success(status_msg)
+            
+            if predictor.cache is not None:
+                cache_stats = predictor.cache.stats()
+                st.caption(
+                    f"预测缓存: {cache_stats['entries']} 条，"
+                    f"命中率 {cache_stats['hit_rate']:.1%} "
+                    f"({cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']})"
+                )
+            
+            summary = predictor.metrics.summary() if predictor.metrics is not None else None
+            if summary is not None and summary['requests'] > 0:
+                with st.expander("📈 推理性能指标"):
+                    st.caption(
+                        f"调用 {summary['requests']} 次，平均生成 {summary['mean_generated_tokens']:.1f} 个token，"
+                        f"截断比例 {summary['truncated_rate']:.1%}，"
+                        f"编码器缓存命中率 {summary['encoder_cache_hit_rate']:.1%}"
+                    )
+                    st.table({
+                        "阶段": list(summary['latency_ms']),
+                        "p50 (ms)": [f"{stats['p50']:.1f}" for stats in summary['latency_ms'].values()],
+                        "p95 (ms)": [f"{stats['p95']:.1f}" for stats in summary['latency_ms'].values()]
+                    })
+                    st.download_button(
+                        "下载Prometheus指标",
+                        data=predictor.metrics.to_prometheus(),
+                        file_name="metrics.prom",
+                        mime="text/plain"
+                    )
         
         st.markdown("---")
         
@@ -205,6 +255,23 @@ def main():
             help="生成序列的最大长度"
         )
         
+        decoding_name = st.selectbox(
+            "解码策略",
+            options=list(DECODING_OPTIONS.keys()),
+            format_func=lambda name: DECODING_OPTIONS[name],
+            help="贪心解码只给出一个结果；束搜索和采样可以给出多个候选产物"
+        )
+        
+        num_candidates = 1
+        if decoding_name != "greedy":
+            num_candidates = st.slider(
+                "候选产物数量",
+                min_value=2,
+                max_value=10,
+                value=5,
+                help="束搜索的beam宽度或采样次数"
+            )
+        
         st.markdown("---")
         
         # 模型信息
@@ -300,6 +367,11 @@ def main():
         st.markdown("## 🎯 预测结果")
         
         if submitted:
+            import pandas as pd
+            import plotly.graph_objects as go
+            
+            predictor, status_msg = load_model()
+            model_available = predictor is not None
             if not model_available:
                 st.error("⚠️ 模型未加载，无法进行预测")
                 st.info("请等待模型文件加载完成后重试")
@@ -311,18 +383,19 @@ def main():
             
             # 预测过程动画
             with st.spinner("🔬 模型正在分析反应条件..."):
-                time.sleep(1)  # 模拟处理时间
-                
                 try:
                     # 执行预测 - 使用缓存版本提高性能
                     start_time = time.time()
-                    predicted_smiles = cached_predict_product(
+                    candidates = cached_predict_product(
                         reactant_smiles=reactant_smiles,
                         pH=pH,
                         disinfectant=disinfectant or "chlorine",
                         max_length=max_length,
-                        temperature=temperature
+                        temperature=temperature,
+                        decoding_name=decoding_name,
+                        num_candidates=num_candidates
                     )
+                    predicted_smiles = candidates[0][0]
                     end_time = time.time()
                     prediction_time = end_time - start_time
                     
@@ -352,6 +425,16 @@ def main():
                     result_df = pd.DataFrame(result_data)
                     st.table(result_df)
                     
+                    # 多候选结果
+                    if len(candidates) > 1:
+                        st.markdown("### 🏅 候选产物排名")
+                        candidates_df = pd.DataFrame({
+                            "排名": list(range(1, len(candidates) + 1)),
+                            "产物SMILES": [smiles for smiles, _ in candidates],
+                            "对数概率": [f"{score:.3f}" for _, score in candidates]
+                        })
+                        st.table(candidates_df)
+                    
                     # 分子结构显示区域
                     st.markdown("### 🧬 分子结构")
                     
@@ -438,6 +521,7 @@ pH值: {pH}
 消毒剂: {disinfectant or "chlorine"}
 预测时间: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
 模型温度: {temperature}
+解码策略: {DECODING_OPTIONS[decoding_name]}
 最大长度: {max_length}
 """
                     
@@ -469,6 +553,72 @@ pH值: {pH}
             </div>
             """, unsafe_allow_html=True)
     
+    # 条件扫描：同一反应物在pH×消毒剂网格上的预测，一次批量完成
+    st.markdown("---")
+    st.markdown("## 🗺️ 条件扫描")
+    
+    with st.form("sweep_form"):
+        sweep_col1, sweep_col2, sweep_col3 = st.columns([2, 2, 1])
+        with sweep_col1:
+            sweep_smiles = st.text_input("反应物SMILES", value=default_smiles, key="sweep_smiles")
+            sweep_disinfectants = st.multiselect(
+                "消毒剂类型",
+                options=["chlorine", "chloramine", "ozone"],
+                default=["chlorine", "chloramine", "ozone"]
+            )
+        with sweep_col2:
+            pH_range = st.slider("pH范围", min_value=5.0, max_value=9.0, value=(5.0, 9.0), step=0.1)
+        with sweep_col3:
+            pH_step = st.number_input("pH步长", min_value=0.1, max_value=2.0, value=0.5, step=0.1)
+        sweep_submitted = st.form_submit_button("🗺️ 开始扫描")
+    
+    if sweep_submitted:
+        import plotly.express as px
+        
+        predictor, status_msg = load_model()
+        model_available = predictor is not None
+        if not model_available:
+            st.error("⚠️ 模型未加载，无法进行预测")
+        elif not sweep_smiles.strip() or not sweep_disinfectants:
+            st.error("请输入反应物SMILES并至少选择一种消毒剂!")
+        else:
+            # 向下取整，网格不超过所选的最大pH（容差避免浮点误差少算一个点）
+            num_steps = int(math.floor((pH_range[1] - pH_range[0]) / pH_step + 1e-9)) + 1
+            pH_grid = [round(pH_range[0] + i * pH_step, 2) for i in range(num_steps)]
+            
+            try:
+                with st.spinner(f"🔬 正在预测 {len(pH_grid) * len(sweep_disinfectants)} 个条件组合..."):
+                    start_time = time.time()
+                    sweep_df = predictor.predict_sweep(
+                        sweep_smiles.strip(), pH_grid, sweep_disinfectants,
+                        max_length=max_length, strategy=build_strategy(decoding_name, temperature, num_candidates)
+                    )
+                    sweep_time = time.time() - start_time
+            except Exception as e:
+                st.error(f"扫描过程中出现错误: {str(e)}")
+                st.exception(e)
+            else:
+                st.caption(f"扫描耗时 {sweep_time:.2f}秒")
+                top_df = sweep_df[sweep_df['rank'] == 1]
+                
+                # 产物网格：行为pH，列为消毒剂
+                st.dataframe(top_df.pivot(index='pH', columns='disinfectant', values='product_smiles'),
+                             use_container_width=True)
+                
+                # 得分热图
+                score_grid = top_df.pivot(index='disinfectant', columns='pH', values='log_prob')
+                fig = px.imshow(score_grid, aspect='auto', color_continuous_scale='Viridis',
+                                labels=dict(x="pH", y="消毒剂", color="对数概率"),
+                                title="各条件下最优产物的对数概率")
+                st.plotly_chart(fig, use_container_width=True)
+                
+                st.download_button(
+                    label="📥 下载扫描结果",
+                    data=sweep_df.to_csv(index=False),
+                    file_name=f"condition_sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    mime="text/csv"
+                )
+    
     # 页面底部信息
     st.markdown("---")
     col1, col2, col3 = st.columns(3)
@@ -0,0 +1,163 @@
+"""
+异步预测接口 - ReactionPredictor 的 asyncio 封装
+模型计算在有界线程池中执行，不阻塞事件循环；排队请求过多时施加背压，
+协程被取消时通知正在进行的解码尽快停止
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+
+from decoding import DecodingStrategy
+from predict import ReactionPredictor
+
+
+class PredictorBusyError(Exception):
+    """排队中的请求数已达上限"""
+
+
+class AsyncReactionPredictor:
+    """ReactionPredictor 的异步门面"""
+
+    def __init__(
+        self,
+        predictor: ReactionPredictor,
+        max_workers: int = 1,
+        max_pending: int = 64,
+        block_when_full: bool = False
+    ):
+        """
+        初始化异步预测器
+        Args:
+            predictor: 同步预测器
+            max_workers: 执行模型计算的线程数
+            max_pending: 同时排队或执行中的最大请求数
+            block_when_full: 达到上限时等待空位（True）还是立即抛出 PredictorBusyError（False）
+        """
+        self.predictor = predictor
+        self.max_pending = max_pending
+        self.block_when_full = block_when_full
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="async-predictor")
+        # 信号量需要在事件循环内创建，首次使用时再初始化
+        self._slots: Optional[asyncio.Semaphore] = None
+        # 已获取名额、线程池任务尚未结束的请求数（只在事件循环线程中修改）
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """当前排队或执行中的请求数"""
+        return self._pending
+
+    async def _acquire_slot(self) -> None:
+        """获取一个请求名额，队列已满时等待或拒绝"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        if self._slots.locked() and not self.block_when_full:
+            raise PredictorBusyError(f"预测队列已满（{self.max_pending}），请稍后重试")
+        await self._slots.acquire()
+        self._pending += 1
+
+    def _release_slot(self) -> None:
+        """归还请求名额（在事件循环线程中调用）"""
+        self._pending -= 1
+        self._slots.release()
+
+    async def _run(
+        self,
+        inputs: List[Tuple[str, float, str]],
+        strategy: Optional[DecodingStrategy],
+        max_length: int
+    ) -> List[List[Tuple[str, float]]]:
+        """在线程池中运行批量预测，协程取消时通知解码停止"""
+        await self._acquire_slot()
+        stop_event = threading.Event()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(
+                self.predictor.predict_batch_candidates,
+                inputs, strategy=strategy, max_length=max_length, stop_event=stop_event
+            )
+        except BaseException:
+            self._release_slot()
+            raise
+        # 名额在线程池任务真正结束时才归还：协程被取消后解码可能仍在运行，不能提前让出名额
+        future.add_done_callback(lambda _: self._release_from_thread(loop))
+
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # 线程无法被强制终止，设置信号后解码会在下一步抛出 GenerationCancelled
+            stop_event.set()
+            raise
+
+    def _release_from_thread(self, loop: asyncio.AbstractEventLoop) -> None:
+        """线程池任务结束时的回调，切换到事件循环线程归还名额"""
+        try:
+            loop.call_soon_threadsafe(self._release_slot)
+        except RuntimeError:
+            # 事件循环已关闭，名额随之失效
+            pass
+
+    async def apredict(
+        self,
+        reactant_smiles: str,
+        pH: float,
+        disinfectant: str,
+        max_length: int = 100,
+        strategy: Optional[DecodingStrategy] = None
+    ) -> str:
+        """
+        异步预测反应产物SMILES
+        Args:
+            reactant_smiles: 反应物SMILES字符串
+            pH: 反应pH值
+            disinfectant: 消毒剂类型
+            max_length: 最大生成长度
+            strategy: 解码策略，默认贪心解码
+        Returns:
+            预测的产物SMILES字符串
+        """
+        candidates = await self.apredict_candidates(reactant_smiles, pH, disinfectant, max_length, strategy)
+        return candidates[0][0]
+
+    async def apredict_candidates(
+        self,
+        reactant_smiles: str,
+        pH: float,
+        disinfectant: str,
+        max_length: int = 100,
+        strategy: Optional[DecodingStrategy] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        异步预测多个候选产物
+        Returns:
+            [(产物SMILES, 对数概率)]，按得分从高到低排序
+        """
+        results = await self._run([(reactant_smiles, pH, disinfectant)], strategy, max_length)
+        return results[0]
+
+    async def astream_batch(
+        self,
+        inputs: List[Tuple[str, float, str]],
+        max_length: int = 100,
+        strategy: Optional[DecodingStrategy] = None,
+        chunk_size: int = 32
+    ) -> AsyncIterator[Tuple[int, List[Tuple[str, float]]]]:
+        """
+        分块异步批量预测，每完成一块就按输入顺序逐条产出结果
+        Args:
+            inputs: 输入列表，每个元素为 (reactant_smiles, pH, disinfectant)
+            max_length: 最大生成长度
+            strategy: 解码策略，默认贪心解码
+            chunk_size: 每块的输入数
+        Yields:
+            (输入下标, [(产物SMILES, 对数概率)])
+        """
+        for start in range(0, len(inputs), chunk_size):
+            results = await self._run(inputs[start:start + chunk_size], strategy, max_length)
+            for offset, candidates in enumerate(results):
+                yield start + offset, candidates
+
+    def shutdown(self) -> None:
+        """关闭线程池"""
+        self._executor.shutdown(wait=True)
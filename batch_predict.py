@@ -0,0 +1,220 @@
+"""
+批量预测脚本 - 从CSV/JSONL/Parquet文件分块读取反应条件，批量预测并增量写出结果
+每处理完一块就记录进度，任务中断后重新运行同一命令会从上次停止的位置继续
+用法: python batch_predict.py --input screen.csv --output predictions.csv --chunk-size 4096
+"""
+import argparse
+import json
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from decoding import get_decoding_strategy
+from predict import ReactionPredictor
+
+INPUT_COLUMNS = ('reactant_smiles', 'pH', 'disinfectant')
+OUTPUT_FORMATS = ('.csv', '.jsonl')
+
+
+def _file_format(path: str) -> str:
+    """根据扩展名判断文件格式"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.json', '.ndjson'):
+        extension = '.jsonl'
+    return extension
+
+
+def iter_input_chunks(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """
+    分块读取输入文件，内存中最多保留一块数据
+    Args:
+        path: 输入文件路径（.csv、.jsonl 或 .parquet）
+        chunk_size: 每块的行数
+    Yields:
+        包含 reactant_smiles、pH、disinfectant 列的DataFrame
+    """
+    file_format = _file_format(path)
+    if file_format == '.csv':
+        yield from pd.read_csv(path, usecols=list(INPUT_COLUMNS), chunksize=chunk_size)
+    elif file_format == '.jsonl':
+        for chunk in pd.read_json(path, lines=True, chunksize=chunk_size):
+            yield chunk[list(INPUT_COLUMNS)]
+    elif file_format == '.parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("读取Parquet文件需要安装pyarrow: pip install pyarrow")
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=list(INPUT_COLUMNS)):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"不支持的输入格式: {path}（支持 .csv、.jsonl、.parquet）")
+
+
+def _progress_path(output_path: str) -> str:
+    return output_path + ".progress.json"
+
+
+def _load_progress(input_path: str, output_path: str) -> Dict:
+    """读取进度文件；输出文件或进度不存在时从头开始"""
+    progress_path = _progress_path(output_path)
+    if os.path.exists(progress_path) and os.path.exists(output_path):
+        with open(progress_path, 'r', encoding='utf-8') as f:
+            progress = json.load(f)
+        if progress.get('input') != os.path.abspath(input_path):
+            raise ValueError(f"进度文件 {progress_path} 属于另一个输入文件: {progress.get('input')}")
+        return progress
+    return {'input': os.path.abspath(input_path), 'rows_done': 0, 'output_bytes': 0}
+
+
+def _save_progress(output_path: str, progress: Dict) -> None:
+    """原子地写入进度文件，避免中断时留下损坏的进度"""
+    progress_path = _progress_path(output_path)
+    temp_path = progress_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(progress, f)
+    os.replace(temp_path, progress_path)
+
+
+def predict_rows(
+    predictor: ReactionPredictor,
+    inputs: List[Tuple[str, float, str]],
+    **kwargs
+) -> List[Tuple[str, Optional[float], str]]:
+    """
+    预测一块输入，模型拒绝的行（如超长的反应物）记录错误信息而不中断整个任务
+    Args:
+        predictor: 预测器
+        inputs: 输入列表，每个元素为 (reactant_smiles, pH, disinfectant)
+        **kwargs: 传给 ReactionPredictor.predict_batch_with_errors 的解码参数
+    Returns:
+        每行的 (产物SMILES, 对数概率, 错误信息)；出错的行产物为空字符串、对数概率为None
+    """
+    return [
+        ('', None, str(result)) if isinstance(result, ValueError) else (result[0][0], result[0][1], '')
+        for result in predictor.predict_batch_with_errors(inputs, **kwargs)
+    ]
+
+
+def run_batch_prediction(
+    predictor: ReactionPredictor,
+    input_path: str,
+    output_path: str,
+    chunk_size: int = 4096,
+    batch_size: int = 64,
+    max_length: int = 100,
+    strategy_name: str = 'greedy',
+    num_workers: Optional[int] = None
+) -> int:
+    """
+    流式批量预测
+    Args:
+        predictor: 预测器
+        input_path: 输入文件路径
+        output_path: 输出文件路径（.csv 或 .jsonl）
+        chunk_size: 每块读取的行数，每块完成后记录一次进度
+        batch_size: 每次送入模型的最大输入数
+        max_length: 最大生成长度
+        strategy_name: 解码策略名称
+        num_workers: CPU工作进程数（见 ReactionPredictor.predict_batch）
+    Returns:
+        本次运行新处理的行数（包括预测出错、product_smiles为空并在error列记录原因的行）
+    """
+    output_format = _file_format(output_path)
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的输出格式: {output_path}（支持 .csv、.jsonl）")
+
+    progress = _load_progress(input_path, output_path)
+    rows_done = progress['rows_done']
+    if rows_done > 0:
+        print(f"从第 {rows_done} 行继续预测")
+
+    strategy = get_decoding_strategy(strategy_name)
+    seen_rows = 0
+    new_rows = 0
+
+    # 截掉上次中断时已写出但未记录进度的部分，保证每行只输出一次
+    with open(output_path, 'a+', encoding='utf-8', newline='') as output_file:
+        output_file.truncate(progress['output_bytes'])
+        output_file.seek(progress['output_bytes'])
+
+        for chunk in iter_input_chunks(input_path, chunk_size):
+            chunk_start = seen_rows
+            seen_rows += len(chunk)
+            if seen_rows <= rows_done:
+                continue
+            chunk = chunk.iloc[max(rows_done - chunk_start, 0):]
+
+            inputs = [
+                (str(reactant), float(pH), str(disinfectant))
+                for reactant, pH, disinfectant in zip(chunk['reactant_smiles'], chunk['pH'], chunk['disinfectant'])
+            ]
+            rows = predict_rows(
+                predictor, inputs, strategy=strategy, max_length=max_length, batch_size=batch_size,
+                num_workers=num_workers
+            )
+            num_errors = sum(1 for _, _, error in rows if error)
+            if num_errors:
+                print(f"本块有 {num_errors} 行预测出错，已在error列记录")
+
+            results = chunk.copy()
+            results['product_smiles'] = [product for product, _, _ in rows]
+            results['log_prob'] = [log_prob for _, log_prob, _ in rows]
+            results['error'] = [error for _, _, error in rows]
+
+            if output_format == '.csv':
+                results.to_csv(output_file, header=output_file.tell() == 0, index=False)
+            else:
+                lines = results.to_json(orient='records', lines=True, force_ascii=False)
+                output_file.write(lines if lines.endswith('\n') else lines + '\n')
+            output_file.flush()
+            os.fsync(output_file.fileno())
+
+            rows_done = seen_rows
+            new_rows += len(results)
+            progress.update(rows_done=rows_done, output_bytes=output_file.tell())
+            _save_progress(output_path, progress)
+            print(f"已完成 {rows_done} 行")
+
+    return new_rows
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="从CSV/JSONL/Parquet文件批量预测消毒副产物（支持断点续跑）")
+    parser.add_argument("--input", required=True, help="输入文件（需包含 reactant_smiles、pH、disinfectant 列）")
+    parser.add_argument("--output", required=True, help="输出文件（.csv 或 .jsonl）")
+    parser.add_argument("--model", default="transformer_model.pth", help="模型路径")
+    parser.add_argument("--vocab", default="vocabulary.json", help="词汇表路径")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="每块读取的行数")
+    parser.add_argument("--batch-size", type=int, default=64, help="每次送入模型的最大输入数")
+    parser.add_argument("--max-length", type=int, default=100, help="最大生成长度")
+    parser.add_argument("--strategy", default="greedy", help="解码策略（greedy/beam）")
+    parser.add_argument("--num-workers", type=int, default=None, help="CPU工作进程数")
+    parser.add_argument("--device", default=None, help="计算设备")
+    parser.add_argument("--precision", default=None, help="推理精度（fp32/bf16）")
+    parser.add_argument("--quantized", action="store_true", help="使用动态int8量化模型")
+    parser.add_argument("--backend", default="eager", choices=["eager", "torchscript"],
+                        help="推理后端（torchscript需要 torchscript_export.py 导出的模型文件）")
+    parser.add_argument("--fast-path", action="store_true",
+                        help="batch优先布局的编码器快速路径（融合注意力+嵌套张量，仅eager后端）")
+    args = parser.parse_args()
+
+    predictor = ReactionPredictor(
+        args.model, args.vocab, device=args.device, precision=args.precision, quantized=args.quantized,
+        backend=args.backend, fast_path=args.fast_path
+    )
+    try:
+        new_rows = run_batch_prediction(
+            predictor, args.input, args.output,
+            chunk_size=args.chunk_size, batch_size=args.batch_size, max_length=args.max_length,
+            strategy_name=args.strategy, num_workers=args.num_workers
+        )
+    finally:
+        predictor.close()
+    print(f"预测完成，本次处理 {new_rows} 行，结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
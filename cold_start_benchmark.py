@@ -0,0 +1,106 @@
+"""
+冷启动基准测试 - 在全新的Python进程中测量导入、模型加载和首次预测的耗时
+每次运行都启动独立子进程，结果反映新副本实际的启动时间
+用法: python cold_start_benchmark.py --runs 5 --backend eager
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+# 子进程中执行的测量代码
+_CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[4])
+from predict import ReactionPredictor
+imported = time.perf_counter()
+predictor = ReactionPredictor(sys.argv[1], sys.argv[2], device='cpu', backend=sys.argv[3], verbose=False)
+loaded = time.perf_counter()
+predictor.predict_product('CCO', 7.0, 'chlorine')
+predicted = time.perf_counter()
+print(json.dumps({
+    'import_s': imported - start,
+    'load_s': loaded - imported,
+    'first_predict_s': predicted - loaded,
+    'total_s': predicted - start
+}))
+"""
+
+STAGES = ('import_s', 'load_s', 'first_predict_s', 'total_s')
+
+
+def run_cold_start(model_path: str, vocab_path: str, backend: str = 'eager') -> Dict[str, float]:
+    """
+    在新进程中完成一次冷启动
+    Returns:
+        各阶段耗时（秒），另含包括解释器启动在内的进程总耗时 process_s
+    """
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", _CHILD_SCRIPT, model_path, vocab_path, backend,
+         os.path.dirname(os.path.abspath(__file__))],
+        check=True, capture_output=True, text=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process_s'] = time.perf_counter() - start
+    return result
+
+
+def benchmark_cold_start(
+    model_path: str,
+    vocab_path: str,
+    runs: int = 5,
+    backend: str = 'eager'
+) -> Dict[str, Dict[str, float]]:
+    """
+    重复冷启动并统计各阶段耗时
+    Args:
+        model_path: 模型路径
+        vocab_path: 词汇表路径
+        runs: 重复次数
+        backend: 推理后端（eager/torchscript）
+    Returns:
+        {阶段: {'median', 'min', 'max'}}
+    """
+    results: List[Dict[str, float]] = [run_cold_start(model_path, vocab_path, backend) for _ in range(runs)]
+    return {
+        stage: {
+            'median': statistics.median(result[stage] for result in results),
+            'min': min(result[stage] for result in results),
+            'max': max(result[stage] for result in results)
+        }
+        for stage in STAGES + ('process_s',)
+    }
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="测量预测器冷启动时间")
+    parser.add_argument("--model", default="transformer_model.pth", help="模型路径")
+    parser.add_argument("--vocab", default="vocabulary.json", help="词汇表路径")
+    parser.add_argument("--runs", type=int, default=5, help="重复次数")
+    parser.add_argument("--backend", default="eager", choices=["eager", "torchscript"], help="推理后端")
+    parser.add_argument("--output", default=None, help="结果保存路径（JSON）")
+    args = parser.parse_args()
+
+    report = benchmark_cold_start(args.model, args.vocab, args.runs, args.backend)
+
+    print("=" * 60)
+    print(f"冷启动耗时（{args.runs} 次，后端: {args.backend}）")
+    print("=" * 60)
+    for stage, stats in report.items():
+        print(f"{stage}: 中位数 {stats['median']:.3f}s，最小 {stats['min']:.3f}s，最大 {stats['max']:.3f}s")
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+"""
+解码策略模块
+提供贪心、束搜索以及top-k/top-p采样解码，所有策略都在批次维度上并行，
+并基于 ReactionTransformer 的增量解码缓存逐步生成
+"""
+import threading
+import torch
+import torch.nn.functional as F
+from typing import Callable, Dict, List, Optional, Tuple
+
+from model import ReactionTransformer
+
+# 候选结果：(生成的token索引列表（不含<sos>/<eos>）, 对数概率)
+Hypothesis = Tuple[List[int], float]
+
+
+class GenerationCancelled(Exception):
+    """解码过程中收到取消信号"""
+
+
+def _check_cancelled(stop_event: Optional[threading.Event]) -> None:
+    """每个解码步检查取消信号"""
+    if stop_event is not None and stop_event.is_set():
+        raise GenerationCancelled("解码已取消")
+
+
+class DecodingStrategy:
+    """解码策略基类"""
+
+    # 相同输入是否总是得到相同结果（决定结果能否被缓存）
+    deterministic = True
+
+    def describe(self) -> Dict:
+        """
+        返回策略名称及参数（用于缓存键和报告）
+        Returns:
+            参数字典
+        """
+        return {'strategy': type(self).__name__, **vars(self)}
+
+    def decode(
+        self,
+        model: ReactionTransformer,
+        memory: torch.Tensor,
+        memory_padding_mask: Optional[torch.Tensor],
+        sos_idx: int,
+        eos_idx: int,
+        max_length: int,
+        stop_event: Optional[threading.Event] = None
+    ) -> List[List[Hypothesis]]:
+        """
+        对一批编码结果进行解码
+        Args:
+            model: 模型
+            memory: 编码器输出 [src_len+1, batch_size, d_model]
+            memory_padding_mask: memory padding掩码 [batch_size, src_len+1]
+            sos_idx: 开始标记索引
+            eos_idx: 结束标记索引
+            max_length: 最大生成长度
+            stop_event: 取消信号，设置后在下一个解码步抛出 GenerationCancelled
+        Returns:
+            每个输入的候选列表，按得分从高到低排序
+        """
+        raise NotImplementedError
+
+
+def top_k_filter(logits: torch.Tensor, top_k: int) -> torch.Tensor:
+    """
+    只保留概率最高的k个token，其余logits置为-inf
+    Args:
+        logits: [batch_size, vocab_size]
+        top_k: 保留的token数
+    Returns:
+        过滤后的logits
+    """
+    top_k = min(top_k, logits.size(-1))
+    threshold = torch.topk(logits, top_k, dim=-1).values[:, -1:]
+    return logits.masked_fill(logits < threshold, float('-inf'))
+
+
+def top_p_filter(logits: torch.Tensor, top_p: float) -> torch.Tensor:
+    """
+    nucleus过滤：保留累计概率达到top_p的最小token集合
+    Args:
+        logits: [batch_size, vocab_size]
+        top_p: 累计概率阈值 (0, 1]
+    Returns:
+        过滤后的logits
+    """
+    sorted_logits, sorted_indices = torch.sort(logits, descending=True, dim=-1)
+    cumulative_probs = torch.cumsum(F.softmax(sorted_logits, dim=-1), dim=-1)
+
+    # 移除累计概率超过阈值的token（至少保留概率最高的一个）
+    sorted_remove = cumulative_probs > top_p
+    sorted_remove[:, 1:] = sorted_remove[:, :-1].clone()
+    sorted_remove[:, 0] = False
+
+    remove = sorted_remove.scatter(1, sorted_indices, sorted_remove)
+    return logits.masked_fill(remove, float('-inf'))
+
+
+def _decode_rows(
+    model: ReactionTransformer,
+    memory: torch.Tensor,
+    memory_padding_mask: Optional[torch.Tensor],
+    sos_idx: int,
+    eos_idx: int,
+    max_length: int,
+    num_per_input: int,
+    select: Callable[[torch.Tensor], torch.Tensor],
+    stop_event: Optional[threading.Event] = None
+) -> List[List[Hypothesis]]:
+    """
+    逐行独立解码（贪心/采样共用）：所有行同步解码，生成结束符的行立即移出活动集合
+    Args:
+        num_per_input: 每个输入解码的行数
+        select: 根据logits [rows, vocab_size] 选择下一个token [rows] 的函数
+        stop_event: 取消信号
+    Returns:
+        每个输入的候选列表
+    """
+    batch_size = memory.size(1)
+    num_rows = batch_size * num_per_input
+    device = memory.device
+
+    cache = model.init_decoder_cache(memory, memory_padding_mask)
+    if num_per_input > 1:
+        # 交叉注意力的key/value只计算一次，再按行复制
+        cache.index_select(torch.arange(batch_size, device=device).repeat_interleave(num_per_input))
+
+    generated = torch.full((num_rows, max_length), eos_idx, dtype=torch.long, device=device)
+    lengths = torch.zeros(num_rows, dtype=torch.long, device=device)
+    scores = torch.zeros(num_rows, device=device)
+    # 仍在解码的行在全部行中的下标
+    active = torch.arange(num_rows, device=device)
+    tokens = torch.full((num_rows,), sos_idx, dtype=torch.long, device=device)
+
+    for step in range(max_length):
+        _check_cancelled(stop_event)
+        logits = model.decode_step(tokens, cache).float()
+        tokens = select(logits)
+
+        # 累计模型给出的对数概率
+        log_probs = F.log_softmax(logits, dim=-1)
+        scores[active] += log_probs.gather(1, tokens.unsqueeze(1)).squeeze(1)
+
+        finished = tokens == eos_idx
+        generated[active, step] = tokens
+        lengths[active] += (~finished).long()
+
+        # 移除已结束的行
+        if finished.any():
+            keep = torch.nonzero(~finished).squeeze(1)
+            if keep.numel() == 0:
+                break
+            cache.index_select(keep)
+            active = active[keep]
+            tokens = tokens[keep]
+
+    rows = generated.cpu().tolist()
+    lengths_list = lengths.cpu().tolist()
+    scores_list = scores.cpu().tolist()
+
+    results = []
+    for i in range(batch_size):
+        hypotheses = {}
+        for row in range(i * num_per_input, (i + 1) * num_per_input):
+            # 相同序列只保留一份
+            hypotheses[tuple(rows[row][:lengths_list[row]])] = scores_list[row]
+        ranked = sorted(hypotheses.items(), key=lambda item: item[1], reverse=True)
+        results.append([(list(token_ids), score) for token_ids, score in ranked])
+
+    return results
+
+
+class GreedyDecoder(DecodingStrategy):
+    """贪心解码：每步选择概率最高的token"""
+
+    def decode(self, model, memory, memory_padding_mask, sos_idx, eos_idx, max_length, stop_event=None):
+        return _decode_rows(
+            model, memory, memory_padding_mask, sos_idx, eos_idx, max_length,
+            num_per_input=1,
+            select=lambda logits: torch.argmax(logits, dim=-1),
+            stop_event=stop_event
+        )
+
+
+class SamplingDecoder(DecodingStrategy):
+    """温度采样解码，可选top-k与top-p（nucleus）过滤"""
+
+    # 即使固定种子，单条输入的结果也取决于同批次的其他输入，因此不缓存
+    deterministic = False
+
+    def __init__(
+        self,
+        num_samples: int = 1,
+        temperature: float = 1.0,
+        top_k: Optional[int] = None,
+        top_p: Optional[float] = None,
+        seed: Optional[int] = None
+    ):
+        """
+        初始化采样解码器
+        Args:
+            num_samples: 每个输入的采样次数（去重后作为候选）
+            temperature: 采样温度（越高越随机）
+            top_k: 只在概率最高的k个token中采样
+            top_p: 只在累计概率达到top_p的token中采样
+            seed: 随机种子，便于复现
+        """
+        if temperature <= 0:
+            raise ValueError("temperature必须大于0")
+        if top_p is not None and not 0.0 < top_p <= 1.0:
+            raise ValueError("top_p必须在(0, 1]范围内")
+
+        self.num_samples = num_samples
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.seed = seed
+
+    def decode(self, model, memory, memory_padding_mask, sos_idx, eos_idx, max_length, stop_event=None):
+        generator = None
+        if self.seed is not None:
+            generator = torch.Generator(device=memory.device)
+            generator.manual_seed(self.seed)
+
+        def select(logits: torch.Tensor) -> torch.Tensor:
+            logits = logits / self.temperature
+            if self.top_k is not None:
+                logits = top_k_filter(logits, self.top_k)
+            if self.top_p is not None:
+                logits = top_p_filter(logits, self.top_p)
+            probs = F.softmax(logits, dim=-1)
+            return torch.multinomial(probs, 1, generator=generator).squeeze(1)
+
+        return _decode_rows(
+            model, memory, memory_padding_mask, sos_idx, eos_idx, max_length,
+            num_per_input=self.num_samples,
+            select=select,
+            stop_event=stop_event
+        )
+
+
+class BeamSearchDecoder(DecodingStrategy):
+    """束搜索解码：所有输入的所有beam合并为一个批次，每步只需一次前向计算"""
+
+    def __init__(self, beam_size: int = 5, num_return: Optional[int] = None, length_penalty: float = 1.0):
+        """
+        初始化束搜索解码器
+        Args:
+            beam_size: beam宽度
+            num_return: 每个输入返回的候选数（默认等于beam_size）
+            length_penalty: 长度惩罚指数，排序得分为 log_prob / length**length_penalty
+        """
+        self.beam_size = beam_size
+        self.num_return = min(num_return or beam_size, beam_size)
+        self.length_penalty = length_penalty
+
+    def _normalize(self, score: float, length: int) -> float:
+        """按长度惩罚归一化得分"""
+        return score / (max(length, 1) ** self.length_penalty)
+
+    def decode(self, model, memory, memory_padding_mask, sos_idx, eos_idx, max_length, stop_event=None):
+        batch_size = memory.size(1)
+        beam_size = self.beam_size
+        device = memory.device
+
+        cache = model.init_decoder_cache(memory, memory_padding_mask)
+        cache.index_select(torch.arange(batch_size, device=device).repeat_interleave(beam_size))
+
+        # 每个输入已完成的候选：(token列表, 对数概率, 归一化得分)
+        finished: List[List[Tuple[List[int], float, float]]] = [[] for _ in range(batch_size)]
+        # 仍在搜索的输入在原批次中的下标
+        active = list(range(batch_size))
+
+        # 初始只有第一个beam有效，避免重复候选
+        scores = torch.full((batch_size, beam_size), float('-inf'), device=device)
+        scores[:, 0] = 0.0
+        sequences = torch.empty((batch_size * beam_size, 0), dtype=torch.long, device=device)
+        tokens = torch.full((batch_size * beam_size,), sos_idx, dtype=torch.long, device=device)
+
+        for _ in range(max_length):
+            _check_cancelled(stop_event)
+            log_probs = F.log_softmax(model.decode_step(tokens, cache).float(), dim=-1)
+            vocab_size = log_probs.size(-1)
+
+            # 每个输入的所有 beam×token 候选一起取top-2k（保证去掉<eos>后仍有足够候选）
+            candidates = (scores.view(-1, 1) + log_probs).view(len(active), beam_size * vocab_size)
+            top_scores, top_ids = candidates.topk(min(2 * beam_size, candidates.size(1)), dim=-1)
+            top_beams = (top_ids // vocab_size).tolist()
+            top_tokens = (top_ids % vocab_size).tolist()
+            top_scores = top_scores.tolist()
+
+            next_rows, next_tokens, next_scores, next_active = [], [], [], []
+            for a, original in enumerate(active):
+                selected = []
+                for score, beam, token in zip(top_scores[a], top_beams[a], top_tokens[a]):
+                    if score == float('-inf'):
+                        break
+                    row = a * beam_size + beam
+                    if token == eos_idx:
+                        token_ids = sequences[row].tolist()
+                        finished[original].append(
+                            (token_ids, score, self._normalize(score, len(token_ids) + 1))
+                        )
+                    else:
+                        selected.append((row, token, score))
+                        if len(selected) == beam_size:
+                            break
+
+                # 已有足够的完成候选，该输入结束搜索
+                if len(finished[original]) >= beam_size or not selected:
+                    continue
+
+                # 候选不足beam_size时用无效beam补齐
+                while len(selected) < beam_size:
+                    selected.append((selected[0][0], selected[0][1], float('-inf')))
+
+                next_active.append(original)
+                for row, token, score in selected:
+                    next_rows.append(row)
+                    next_tokens.append(token)
+                    next_scores.append(score)
+
+            active = next_active
+            if not active:
+                break
+
+            rows = torch.tensor(next_rows, dtype=torch.long, device=device)
+            tokens = torch.tensor(next_tokens, dtype=torch.long, device=device)
+            cache.index_select(rows)
+            sequences = torch.cat([sequences[rows], tokens.unsqueeze(1)], dim=1)
+            scores = torch.tensor(next_scores, device=device).view(-1, beam_size)
+
+        # 达到最大长度仍未结束的beam也作为候选
+        if active:
+            sequences_list = sequences.tolist()
+            for a, original in enumerate(active):
+                for beam in range(beam_size):
+                    score = scores[a, beam].item()
+                    if score != float('-inf'):
+                        token_ids = sequences_list[a * beam_size + beam]
+                        finished[original].append(
+                            (token_ids, score, self._normalize(score, len(token_ids)))
+                        )
+
+        results = []
+        for hypotheses in finished:
+            ranked = sorted(hypotheses, key=lambda item: item[2], reverse=True)[:self.num_return]
+            results.append([(token_ids, score) for token_ids, score, _ in ranked])
+
+        return results
+
+
+def get_decoding_strategy(name: str = 'greedy', **kwargs) -> DecodingStrategy:
+    """
+    按名称创建解码策略
+    Args:
+        name: 'greedy', 'beam', 'sampling', 'top_k' 或 'top_p'
+        **kwargs: 传给对应解码器的参数
+    Returns:
+        解码策略实例
+    """
+    if name == 'greedy':
+        return GreedyDecoder()
+    if name == 'beam':
+        return BeamSearchDecoder(**kwargs)
+    if name in ('sampling', 'top_k', 'top_p'):
+        return SamplingDecoder(**kwargs)
+    raise ValueError(f"未知的解码策略: {name}")
@@ -0,0 +1,267 @@
+"""
+推理基准测试 - 测量 ReactionPredictor 在不同模型配置、输入长度、批量大小、线程数和解码策略下的延迟与吞吐量
+模型使用随机权重（只影响速度，不影响结果的可比性），报告为JSON格式，可在不同提交之间对比
+用法: python inference_benchmark.py --output bench.json
+      python inference_benchmark.py --output bench_new.json --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+from typing import Dict, List, Sequence
+
+import torch
+
+from decoding import get_decoding_strategy
+from inference_metrics import percentile
+from model import ReactionTransformer
+from predict import ReactionPredictor
+from utils import load_vocab
+
+# 待测的模型配置（default 与 train.py 训练的模型相同）
+MODEL_CONFIGS = {
+    'small': {
+        'd_model': 128, 'nhead': 4, 'num_encoder_layers': 2, 'num_decoder_layers': 2,
+        'dim_feedforward': 512, 'dropout': 0.1, 'condition_dim': 4, 'max_len': 200
+    },
+    'default': {
+        'd_model': 256, 'nhead': 8, 'num_encoder_layers': 4, 'num_decoder_layers': 4,
+        'dim_feedforward': 1024, 'dropout': 0.1, 'condition_dim': 4, 'max_len': 200
+    },
+    'large': {
+        'd_model': 512, 'nhead': 8, 'num_encoder_layers': 6, 'num_decoder_layers': 6,
+        'dim_feedforward': 2048, 'dropout': 0.1, 'condition_dim': 4, 'max_len': 200
+    }
+}
+
+DISINFECTANTS = ("chlorine", "chloramine", "ozone")
+
+# 报告中唯一标识一个测试用例的字段，用于对比两份报告
+CASE_KEYS = ('config', 'mode', 'input_length', 'batch_size', 'threads', 'strategy')
+
+
+def make_inputs(input_length: int, count: int) -> List[tuple]:
+    """
+    生成指定长度的反应物输入（醚链SMILES，截断后仍是合法分子）
+    Args:
+        input_length: 反应物SMILES字符数
+        count: 输入个数
+    Returns:
+        [(reactant_smiles, pH, disinfectant)]
+    """
+    reactant = ("CCO" * input_length)[:input_length]
+    return [(reactant, 5.0 + (i % 5), DISINFECTANTS[i % len(DISINFECTANTS)]) for i in range(count)]
+
+
+def save_random_checkpoint(config_name: str, vocab_size: int, output_path: str, seed: int = 0) -> None:
+    """按 train.py 的checkpoint格式保存随机权重模型"""
+    torch.manual_seed(seed)
+    model_config = MODEL_CONFIGS[config_name]
+    model = ReactionTransformer(vocab_size=vocab_size, **model_config)
+    torch.save({
+        'model_state_dict': model.state_dict(),
+        'vocab_size': vocab_size,
+        'model_config': model_config,
+        'precision': 'fp32'
+    }, output_path)
+
+
+def _time_calls(run, runs: int, warmup: int) -> List[float]:
+    """预热后重复调用，返回每次调用的耗时（毫秒）"""
+    for _ in range(warmup):
+        run()
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def _summarize(latencies: List[float], sequences_per_call: int) -> Dict[str, float]:
+    total_s = sum(latencies) / 1000
+    return {
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': sum(latencies) / len(latencies),
+        'seq_per_s': sequences_per_call * len(latencies) / total_s if total_s > 0 else 0.0
+    }
+
+
+def run_benchmark(
+    vocab_path: str = "vocabulary.json",
+    configs: Sequence[str] = ('small', 'default'),
+    input_lengths: Sequence[int] = (8, 32, 64),
+    batch_sizes: Sequence[int] = (1, 8, 32),
+    threads: Sequence[int] = (1, 4),
+    strategies: Sequence[str] = ('greedy', 'beam'),
+    max_length: int = 50,
+    runs: int = 20,
+    warmup: int = 3,
+    device: str = 'cpu',
+    fast_path: bool = False
+) -> Dict:
+    """
+    运行基准测试
+    Args:
+        vocab_path: 词汇表路径（决定模型词表大小）
+        configs: MODEL_CONFIGS 中的配置名
+        input_lengths: 反应物SMILES长度
+        batch_sizes: predict_batch 的输入个数；批量大小为1的用例测量 predict_product
+        threads: torch线程数
+        strategies: 解码策略名称
+        max_length: 最大生成长度
+        runs: 每个用例的计时次数
+        warmup: 每个用例的预热次数
+        device: 计算设备
+        fast_path: 是否使用batch优先布局的编码器快速路径
+    Returns:
+        报告字典：meta（运行环境与参数）和 results（每个用例的延迟分位数与吞吐量）
+    """
+    vocab = load_vocab(vocab_path, verbose=False)
+    original_threads = torch.get_num_threads()
+    results = []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for config_name in configs:
+            model_path = os.path.join(temp_dir, f"{config_name}.pth")
+            save_random_checkpoint(config_name, vocab.vocab_size, model_path)
+            predictor = ReactionPredictor(model_path, vocab_path, device=device, verbose=False, fast_path=fast_path)
+
+            for num_threads in threads:
+                torch.set_num_threads(num_threads)
+                for strategy_name in strategies:
+                    strategy = get_decoding_strategy(strategy_name)
+                    for input_length in input_lengths:
+                        for batch_size in batch_sizes:
+                            inputs = make_inputs(input_length, batch_size)
+                            if batch_size == 1:
+                                mode = 'predict_product'
+                                run = lambda: predictor.predict_product(
+                                    *inputs[0], max_length=max_length, strategy=strategy
+                                )
+                            else:
+                                mode = 'predict_batch'
+                                run = lambda: predictor.predict_batch(
+                                    inputs, max_length=max_length, batch_size=batch_size, strategy=strategy
+                                )
+                            result = {
+                                'config': config_name,
+                                'mode': mode,
+                                'input_length': input_length,
+                                'batch_size': batch_size,
+                                'threads': num_threads,
+                                'strategy': strategy_name,
+                                'runs': runs
+                            }
+                            result.update(_summarize(_time_calls(run, runs, warmup), batch_size))
+                            results.append(result)
+
+    torch.set_num_threads(original_threads)
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'torch_version': torch.__version__,
+            'python_version': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'device': device,
+            'fast_path': fast_path,
+            'max_length': max_length,
+            'warmup': warmup,
+            'model_configs': {name: MODEL_CONFIGS[name] for name in configs}
+        },
+        'results': results
+    }
+
+
+def compare_reports(baseline: Dict, current: Dict) -> List[Dict]:
+    """
+    对比两份报告中相同用例的p50延迟和吞吐量
+    Args:
+        baseline: 基准报告
+        current: 当前报告
+    Returns:
+        每个共同用例的对比结果，change为相对变化（负的延迟变化/正的吞吐量变化表示变快）
+    """
+    baseline_results = {tuple(result[key] for key in CASE_KEYS): result for result in baseline['results']}
+    comparison = []
+    for result in current['results']:
+        case = tuple(result[key] for key in CASE_KEYS)
+        if case not in baseline_results:
+            continue
+        old = baseline_results[case]
+        comparison.append({
+            **dict(zip(CASE_KEYS, case)),
+            'p50_ms_change': result['p50_ms'] / old['p50_ms'] - 1 if old['p50_ms'] > 0 else 0.0,
+            'seq_per_s_change': result['seq_per_s'] / old['seq_per_s'] - 1 if old['seq_per_s'] > 0 else 0.0
+        })
+    return comparison
+
+
+def _parse_list(value: str, cast=str) -> List:
+    return [cast(item) for item in value.split(',') if item]
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="ReactionPredictor 推理延迟/吞吐量基准测试")
+    parser.add_argument("--vocab", default="vocabulary.json", help="词汇表路径")
+    parser.add_argument("--configs", default="small,default", help=f"模型配置（可选: {','.join(MODEL_CONFIGS)}）")
+    parser.add_argument("--input-lengths", default="8,32,64", help="反应物SMILES长度")
+    parser.add_argument("--batch-sizes", default="1,8,32", help="批量大小（1表示单条预测）")
+    parser.add_argument("--threads", default="1,4", help="torch线程数")
+    parser.add_argument("--strategies", default="greedy,beam", help="解码策略")
+    parser.add_argument("--max-length", type=int, default=50, help="最大生成长度")
+    parser.add_argument("--runs", type=int, default=20, help="每个用例的计时次数")
+    parser.add_argument("--warmup", type=int, default=3, help="每个用例的预热次数")
+    parser.add_argument("--device", default="cpu", help="计算设备")
+    parser.add_argument("--fast-path", action="store_true", help="使用batch优先布局的编码器快速路径")
+    parser.add_argument("--output", default="inference_benchmark.json", help="报告保存路径（JSON）")
+    parser.add_argument("--compare", default=None, help="与之对比的基准报告路径")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        vocab_path=args.vocab,
+        configs=_parse_list(args.configs),
+        input_lengths=_parse_list(args.input_lengths, int),
+        batch_sizes=_parse_list(args.batch_sizes, int),
+        threads=_parse_list(args.threads, int),
+        strategies=_parse_list(args.strategies),
+        max_length=args.max_length,
+        runs=args.runs,
+        warmup=args.warmup,
+        device=args.device,
+        fast_path=args.fast_path
+    )
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    print("=" * 60)
+    print("推理基准测试结果")
+    print("=" * 60)
+    for result in report['results']:
+        print(f"{result['config']:>8} {result['mode']:>15} 长度 {result['input_length']:>3} "
+              f"批量 {result['batch_size']:>3} 线程 {result['threads']:>2} {result['strategy']:>6}: "
+              f"p50 {result['p50_ms']:.1f}ms，p95 {result['p95_ms']:.1f}ms，p99 {result['p99_ms']:.1f}ms，"
+              f"{result['seq_per_s']:.1f} 序列/秒")
+    print(f"报告已保存到: {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print("\n与基准报告对比（p50延迟变化 / 吞吐量变化）:")
+        for item in compare_reports(baseline, report):
+            print(f"{item['config']:>8} {item['mode']:>15} 长度 {item['input_length']:>3} "
+                  f"批量 {item['batch_size']:>3} 线程 {item['threads']:>2} {item['strategy']:>6}: "
+                  f"{item['p50_ms_change']:+.1%} / {item['seq_per_s_change']:+.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+推理指标 - 记录 ReactionPredictor 每次调用的分阶段耗时、生成token数、到达<eos>的步数和缓存命中，
+汇总为直方图并导出为Prometheus文本格式
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Deque, Dict, Iterator, List, Optional, Sequence
+
+import torch
+
+# 一次预测调用依次经过的阶段
+STAGES = ('cache_lookup', 'tokenize', 'encode', 'decode', 'detokenize')
+
+# 耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# token数/解码步数直方图的桶上界
+TOKEN_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """累积计数直方图（与Prometheus histogram语义一致）"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[int]:
+        """每个桶上界（含 +Inf）对应的累计计数"""
+        total = 0
+        cumulative = []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def quantile(self, q: float) -> float:
+        """
+        按桶内线性插值估计分位数（与Prometheus histogram_quantile相同的估计方法）
+        Args:
+            q: 分位点 [0, 1]
+        Returns:
+            估计值，落在 +Inf 桶时返回最大的有限上界
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        lower = 0.0
+        previous = 0
+        for bound, cumulative in zip(self.buckets, self.cumulative_counts()):
+            if cumulative >= rank:
+                in_bucket = cumulative - previous
+                return lower + (bound - lower) * ((rank - previous) / in_bucket if in_bucket else 0.0)
+            lower, previous = bound, cumulative
+        return self.buckets[-1]
+
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """
+    计算原始样本的分位数（最近秩法），用于负载测试和基准测试的延迟统计
+    Args:
+        values: 样本值
+        q: 分位数（0-100）
+    Returns:
+        分位数值，没有样本时返回0
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class CallStats:
+    """一次预测调用的统计（多进程推理时由各工作进程分别收集后合并）"""
+
+    def __init__(self, device: Optional[torch.device] = None):
+        """
+        Args:
+            device: 计算设备；CUDA下每个阶段结束时同步，使异步执行的kernel计入所属阶段
+        """
+        self.synchronize = device is not None and device.type == 'cuda'
+        self.stages = {stage: 0.0 for stage in STAGES}
+        self.generated_tokens: List[int] = []
+        self.steps_to_eos: List[int] = []
+        self.truncated = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.encoder_cache_hits = 0
+        self.encoder_cache_misses = 0
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """累计某个阶段的耗时"""
+        start = time.perf_counter()
+        yield
+        if self.synchronize:
+            torch.cuda.synchronize()
+        self.stages[name] += time.perf_counter() - start
+
+    def record_hypotheses(self, hypotheses: List[List[tuple]], max_length: int) -> None:
+        """
+        记录每个输入最优候选的生成长度
+        Args:
+            hypotheses: 解码策略返回的候选列表
+            max_length: 最大生成长度（生成长度达到该值表示被截断，没有生成<eos>）
+        """
+        for items in hypotheses:
+            num_tokens = len(items[0][0])
+            self.generated_tokens.append(num_tokens)
+            if num_tokens >= max_length:
+                self.truncated += 1
+                self.steps_to_eos.append(max_length)
+            else:
+                self.steps_to_eos.append(num_tokens + 1)
+
+    def merge(self, other: "CallStats") -> None:
+        """合并另一份统计（工作进程的阶段耗时相加，为各进程耗时之和）"""
+        for stage, value in other.stages.items():
+            self.stages[stage] += value
+        self.generated_tokens.extend(other.generated_tokens)
+        self.steps_to_eos.extend(other.steps_to_eos)
+        for name in ('truncated', 'cache_hits', 'cache_misses', 'encoder_cache_hits', 'encoder_cache_misses'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+def stage_timer(stats: Optional[CallStats], name: str):
+    """未开启统计时返回空上下文，不产生计时开销"""
+    return stats.stage(name) if stats is not None else nullcontext()
+
+
+class PredictorMetrics:
+    """预测器指标汇总（线程安全），可在多个调用线程间共享"""
+
+    def __init__(self, recent_calls: int = 100):
+        """
+        Args:
+            recent_calls: 保留最近多少次调用的明细
+        """
+        self._lock = threading.Lock()
+        self.recent: Deque[Dict] = deque(maxlen=recent_calls)
+        self.reset()
+
+    def reset(self) -> None:
+        """清空所有统计"""
+        with self._lock:
+            self.stage_seconds = {stage: Histogram(LATENCY_BUCKETS) for stage in STAGES}
+            self.request_seconds = Histogram(LATENCY_BUCKETS)
+            self.generated_tokens = Histogram(TOKEN_BUCKETS)
+            self.steps_to_eos = Histogram(TOKEN_BUCKETS)
+            self.counters = {
+                'requests': 0,
+                'inputs': 0,
+                'truncated': 0,
+                'cache_hits': 0,
+                'cache_misses': 0,
+                'encoder_cache_hits': 0,
+                'encoder_cache_misses': 0
+            }
+            self.recent.clear()
+
+    def observe(self, stats: CallStats, num_inputs: int, total_seconds: float) -> None:
+        """
+        记录一次调用
+        Args:
+            stats: 调用统计
+            num_inputs: 输入个数
+            total_seconds: 调用总耗时
+        """
+        with self._lock:
+            for stage, value in stats.stages.items():
+                self.stage_seconds[stage].observe(value)
+            self.request_seconds.observe(total_seconds)
+            for value in stats.generated_tokens:
+                self.generated_tokens.observe(value)
+            for value in stats.steps_to_eos:
+                self.steps_to_eos.observe(value)
+
+            self.counters['requests'] += 1
+            self.counters['inputs'] += num_inputs
+            for name in ('truncated', 'cache_hits', 'cache_misses', 'encoder_cache_hits', 'encoder_cache_misses'):
+                self.counters[name] += getattr(stats, name)
+
+            self.recent.append({
+                'timestamp': time.time(),
+                'inputs': num_inputs,
+                'total_s': total_seconds,
+                **{f'{stage}_s': value for stage, value in stats.stages.items()},
+                'generated_tokens': sum(stats.generated_tokens),
+                'max_steps_to_eos': max(stats.steps_to_eos, default=0),
+                'truncated': stats.truncated,
+                'cache_hits': stats.cache_hits,
+                'encoder_cache_hits': stats.encoder_cache_hits
+            })
+
+    def summary(self) -> Dict:
+        """
+        汇总统计（用于界面展示）
+        Returns:
+            调用次数、各阶段与总耗时的p50/p95（毫秒）、平均生成token数、截断比例和缓存命中率
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            cache_lookups = counters['cache_hits'] + counters['cache_misses']
+            encoder_lookups = counters['encoder_cache_hits'] + counters['encoder_cache_misses']
+            return {
+                'requests': counters['requests'],
+                'inputs': counters['inputs'],
+                'latency_ms': {
+                    name: {
+                        'p50': histogram.quantile(0.5) * 1000,
+                        'p95': histogram.quantile(0.95) * 1000,
+                        'mean': histogram.mean() * 1000
+                    }
+                    for name, histogram in [('total', self.request_seconds)] + list(self.stage_seconds.items())
+                },
+                'mean_generated_tokens': self.generated_tokens.mean(),
+                'mean_steps_to_eos': self.steps_to_eos.mean(),
+                'truncated_rate': counters['truncated'] / max(self.generated_tokens.count, 1),
+                'cache_hit_rate': counters['cache_hits'] / cache_lookups if cache_lookups else 0.0,
+                'encoder_cache_hit_rate': (counters['encoder_cache_hits'] / encoder_lookups
+                                           if encoder_lookups else 0.0)
+            }
+
+    def to_prometheus(self, prefix: str = "reaction_predictor") -> str:
+        """
+        导出为Prometheus文本格式（text/plain; version=0.0.4）
+        Args:
+            prefix: 指标名前缀
+        Returns:
+            指标文本
+        """
+        lines: List[str] = []
+
+        def histogram_lines(name: str, help_text: str, histograms: Dict[str, Histogram], label: str = ''):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for label_value, histogram in histograms.items():
+                labels = f'{label}="{label_value}",' if label else ''
+                bounds = [_format_number(bound) for bound in histogram.buckets] + ['+Inf']
+                for bound, cumulative in zip(bounds, histogram.cumulative_counts()):
+                    lines.append(f'{prefix}_{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+                suffix = f'{{{labels[:-1]}}}' if labels else ''
+                lines.append(f"{prefix}_{name}_sum{suffix} {_format_number(histogram.sum)}")
+                lines.append(f"{prefix}_{name}_count{suffix} {histogram.count}")
+
+        with self._lock:
+            histogram_lines('stage_seconds', "Time spent in each prediction stage per call.",
+                            self.stage_seconds, label='stage')
+            histogram_lines('request_seconds', "Total time per prediction call.", {'': self.request_seconds})
+            histogram_lines('generated_tokens', "Tokens generated for the best candidate of each input.",
+                            {'': self.generated_tokens})
+            histogram_lines('steps_to_eos', "Decode steps until <eos> (max_length if truncated) per input.",
+                            {'': self.steps_to_eos})
+
+            counter_help = {
+                'requests': "Prediction calls.",
+                'inputs': "Inputs predicted.",
+                'truncated': "Inputs whose best candidate reached max_length without <eos>.",
+                'cache_hits': "Prediction cache hits.",
+                'cache_misses': "Prediction cache misses.",
+                'encoder_cache_hits': "Encoder cache hits.",
+                'encoder_cache_misses': "Encoder cache misses."
+            }
+            for name, value in self.counters.items():
+                lines.append(f"# HELP {prefix}_{name}_total {counter_help[name]}")
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _format_number(value: float) -> str:
+    """整数值不带小数点，其余使用repr，保证输出稳定"""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
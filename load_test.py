@@ -0,0 +1,117 @@
+"""
+负载生成脚本 - 向推理服务并发发送预测请求，统计吞吐量和延迟分位数
+用法: python load_test.py --url http://127.0.0.1:8000/predict --concurrency 16 --requests 500
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.request
+from typing import Dict, List
+
+from inference_metrics import percentile
+
+# 与 predict.evaluate_on_examples 相同的示例分子
+EXAMPLE_REACTANTS = ["CCO", "c1ccc(cc1)O", "CC(C)O", "Nc1ccccc1", "c1ccccc1", "CC(=O)O"]
+DISINFECTANTS = ["chlorine", "chloramine", "ozone"]
+
+
+def run_load_test(
+    url: str,
+    concurrency: int = 16,
+    num_requests: int = 200,
+    max_length: int = 100,
+    seed: int = 0
+) -> Dict[str, float]:
+    """
+    并发发送预测请求
+    Args:
+        url: 预测接口地址
+        concurrency: 并发客户端数
+        num_requests: 总请求数
+        max_length: 最大生成长度
+        seed: 随机种子（决定请求内容）
+    Returns:
+        统计结果（吞吐量、延迟分位数、错误数）
+    """
+    rng = random.Random(seed)
+    payloads = [
+        {
+            'reactant_smiles': rng.choice(EXAMPLE_REACTANTS),
+            'pH': round(rng.uniform(5.0, 9.0), 1),
+            'disinfectant': rng.choice(DISINFECTANTS),
+            'max_length': max_length
+        }
+        for _ in range(num_requests)
+    ]
+
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    next_index = [0]
+
+    def worker():
+        nonlocal errors
+        while True:
+            with lock:
+                if next_index[0] >= len(payloads):
+                    return
+                payload = payloads[next_index[0]]
+                next_index[0] += 1
+
+            request = urllib.request.Request(
+                url, data=json.dumps(payload).encode('utf-8'),
+                headers={'Content-Type': 'application/json'}
+            )
+            start_time = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=120) as response:
+                    response.read()
+                elapsed = time.perf_counter() - start_time
+                with lock:
+                    latencies.append(elapsed * 1000)
+            except Exception:
+                with lock:
+                    errors += 1
+
+    start_time = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total_time = time.perf_counter() - start_time
+
+    return {
+        'requests': num_requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'total_time_s': total_time,
+        'throughput_rps': len(latencies) / total_time if total_time > 0 else 0.0,
+        'latency_p50_ms': percentile(latencies, 50),
+        'latency_p95_ms': percentile(latencies, 95),
+        'latency_p99_ms': percentile(latencies, 99)
+    }
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="推理服务负载测试")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/predict", help="预测接口地址")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发客户端数")
+    parser.add_argument("--requests", type=int, default=200, help="总请求数")
+    parser.add_argument("--max-length", type=int, default=100, help="最大生成长度")
+    args = parser.parse_args()
+
+    results = run_load_test(args.url, args.concurrency, args.requests, args.max_length)
+
+    print("=" * 60)
+    print("负载测试结果")
+    print("=" * 60)
+    for key, value in results.items():
+        print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,12 @@ ReactionTransformer 模型定义
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 import math
-from typing import Optional, Tuple
+import inspect
+import pickle
+import warnings
+from typing import List, Optional, Tuple
 
 class PositionalEncoding(nn.Module):
     """位置编码模块"""
@@ -30,25 +34,28 @@ class PositionalEncoding(nn.Module):
         
         pe[:, 0::2] = torch.sin(position * div_term)
         pe[:, 1::2] = torch.cos(position * div_term)
-        pe = pe.unsqueeze(0).transpose(0, 1)
+        pe = pe.unsqueeze(1)  # [max_len, 1, d_model]，保持连续内存
         
         # 注册为buffer，不参与梯度更新
         self.register_buffer('pe', pe)
+        self.max_len = max_len
     
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def forward(self, x: torch.Tensor, offset: int = 0, batch_first: bool = False) -> torch.Tensor:
         """
         前向传播
         Args:
-            x: 输入张量 [seq_len, batch_size, d_model]
+            x: 输入张量 [seq_len, batch_size, d_model]（batch_first时为 [batch_size, seq_len, d_model]）
+            offset: 起始位置（增量解码时为已生成的token数）
+            batch_first: 输入是否为batch优先布局
         Returns:
             添加位置编码后的张量
         """
-        # 获取序列长度和批次大小
-        seq_len, batch_size = x.size(0), x.size(1)
-        # 提取对应长度的位置编码并扩展到匹配批次大小
-        pe_tensor = torch.as_tensor(self.pe)  # 显式转换为tensor类型
-        pe_slice = pe_tensor[:seq_len, :].expand(-1, batch_size, -1)
-        return x + pe_slice 
+        seq_len = x.size(1) if batch_first else x.size(0)
+        if offset + seq_len > self.max_len:
+            raise ValueError(f"序列位置 {offset + seq_len} 超出位置编码的最大长度 {self.max_len}")
+        # 切片是buffer的视图，批次维度通过广播相加，不复制位置编码
+        pe_slice = self.pe[offset:offset + seq_len]
+        return x + (pe_slice.transpose(0, 1) if batch_first else pe_slice)
 
 
 class ConditionEncoder(nn.Module):
@@ -83,6 +90,52 @@ class ConditionEncoder(nn.Module):
         return self.condition_mlp(conditions)
 
 
+def _split_heads(x: torch.Tensor, nhead: int) -> torch.Tensor:
+    """[batch_size, seq_len, d_model] -> [batch_size, nhead, seq_len, head_dim]"""
+    batch_size, seq_len, d_model = x.shape
+    return x.view(batch_size, seq_len, nhead, d_model // nhead).transpose(1, 2)
+
+
+def _merge_heads(x: torch.Tensor) -> torch.Tensor:
+    """[batch_size, nhead, seq_len, head_dim] -> [batch_size, seq_len, d_model]"""
+    batch_size, nhead, seq_len, head_dim = x.shape
+    return x.transpose(1, 2).reshape(batch_size, seq_len, nhead * head_dim)
+
+
+class DecoderCache:
+    """增量解码缓存：保存每层自注意力的key/value以及交叉注意力对memory的投影"""
+    
+    def __init__(
+        self,
+        cross_kv: List[Tuple[torch.Tensor, torch.Tensor]],
+        memory_key_padding_mask: Optional[torch.Tensor] = None
+    ):
+        """
+        初始化解码缓存
+        Args:
+            cross_kv: 每层交叉注意力的 (key, value)，形状 [batch_size, nhead, src_len+1, head_dim]
+            memory_key_padding_mask: 编码器输出padding掩码 [batch_size, src_len+1]
+        """
+        self.cross_kv = cross_kv
+        self.self_kv: List[Optional[Tuple[torch.Tensor, torch.Tensor]]] = [None] * len(cross_kv)
+        self.memory_key_padding_mask = memory_key_padding_mask
+        # 已处理的目标token数，同时作为下一个token的位置编码下标
+        self.step = 0
+    
+    def index_select(self, indices: torch.Tensor) -> None:
+        """
+        按批次下标原地筛选/重排缓存（用于移除已结束的序列或重排beam）
+        Args:
+            indices: 保留的批次下标 [new_batch_size]
+        """
+        self.cross_kv = [(k.index_select(0, indices), v.index_select(0, indices))
+                         for k, v in self.cross_kv]
+        self.self_kv = [None if kv is None else (kv[0].index_select(0, indices), kv[1].index_select(0, indices))
+                        for kv in self.self_kv]
+        if self.memory_key_padding_mask is not None:
+            self.memory_key_padding_mask = self.memory_key_padding_mask.index_select(0, indices)
+
+
 class ReactionTransformer(nn.Module):
     """反应路径预测Transformer模型"""
     
@@ -96,7 +149,8 @@ class ReactionTransformer(nn.Module):
         dim_feedforward: int = 1024,
         dropout: float = 0.1,
         condition_dim: int = 4,  # pH + 3个消毒剂类型
-        max_len: int = 200
+        max_len: int = 200,
+        batch_first: bool = False
     ):
         """
         初始化ReactionTransformer模型
@@ -110,11 +164,18 @@ class ReactionTransformer(nn.Module):
             dropout: dropout率
             condition_dim: 条件向量维度
             max_len: 最大序列长度
+            batch_first: Transformer主体是否使用batch优先布局。推理时编码器可以走PyTorch的融合注意力
+                         快速路径，并用嵌套张量跳过padding位置的计算；两种布局的参数完全相同，
+                         可以互相加载checkpoint。encode等方法的输入输出形状不受影响
         """
         super().__init__()
         
         self.d_model = d_model
         self.vocab_size = vocab_size
+        self.max_len = max_len
+        self.batch_first = batch_first
+        # 模型内部布局中序列所在的维度
+        self._seq_dim = 1 if batch_first else 0
         
         # 词嵌入层
         self.src_embedding = nn.Embedding(vocab_size, d_model)
@@ -134,15 +195,60 @@ class ReactionTransformer(nn.Module):
             num_decoder_layers=num_decoder_layers,
             dim_feedforward=dim_feedforward,
             dropout=dropout,
-            batch_first=False  # 使用seq_len优先的格式
+            batch_first=batch_first
         )
         
         # 输出投影层
         self.output_projection = nn.Linear(d_model, vocab_size)
         
+        # 预先分配的因果掩码（True表示不能注意），按需切片；不保存到checkpoint，旧checkpoint可直接加载
+        self.register_buffer(
+            'causal_mask_buffer',
+            torch.triu(torch.ones(max_len, max_len, dtype=torch.bool), diagonal=1),
+            persistent=False
+        )
+        
+        # 激活检查点（仅训练时生效，不属于模型配置，不保存到checkpoint）
+        self.gradient_checkpointing = False
+        
         # 初始化参数
         self._init_weights()
     
+    def set_gradient_checkpointing(self, enabled: bool = True) -> None:
+        """
+        开启/关闭编码器和解码器各层的激活检查点：前向时不保存层内中间激活，
+        反向时重新计算，以约一次额外前向的计算量换取显著更低的激活内存
+        Args:
+            enabled: 是否开启
+        """
+        self.gradient_checkpointing = enabled
+    
+    def causal_mask(self, size: int) -> torch.Tensor:
+        """
+        获取解码器因果掩码（预分配buffer的视图，与 utils.create_causal_mask(size) 相同，已位于模型所在设备）
+        Args:
+            size: 目标序列长度
+        Returns:
+            [size, size] 布尔掩码
+        """
+        if size > self.max_len:
+            raise ValueError(f"目标序列长度 {size} 超出模型最大长度 {self.max_len}")
+        return self.causal_mask_buffer[:size, :size]
+    
+    def _embed(self, tokens: torch.Tensor, embedding: nn.Embedding) -> torch.Tensor:
+        """
+        词嵌入和位置编码
+        Args:
+            tokens: token序列 [batch_size, seq_len]
+            embedding: 词嵌入层
+        Returns:
+            模型内部布局的嵌入（seq优先为 [seq_len, batch_size, d_model]，batch优先为 [batch_size, seq_len, d_model]）
+        """
+        if not self.batch_first:
+            tokens = tokens.transpose(0, 1)
+        emb = embedding(tokens) * math.sqrt(self.d_model)
+        return self.pos_encoder(emb, batch_first=self.batch_first)
+    
     def _init_weights(self):
         """初始化模型参数"""
         for p in self.parameters():
@@ -171,25 +277,21 @@ class ReactionTransformer(nn.Module):
             tgt_key_padding_mask: 目标序列padding掩码
         Returns:
             输出logits [batch_size, tgt_len, vocab_size]
+        注意: 解码器不屏蔽memory中的padding位置（与训练时一致）。batch优先布局在推理模式下
+        padding位置的编码器输出为0，因此含padding批次的结果与seq优先布局不同；推理请使用 encode + decode_step
         """
-        # 转置为 [seq_len, batch_size] 格式
-        src = src.transpose(0, 1)
-        tgt = tgt.transpose(0, 1)
-        
-        # 词嵌入
-        src_emb = self.src_embedding(src) * math.sqrt(self.d_model)
-        tgt_emb = self.tgt_embedding(tgt) * math.sqrt(self.d_model)
+        self._check_source_length(src.size(1))
         
-        # 添加位置编码
-        src_emb = self.pos_encoder(src_emb)
-        tgt_emb = self.pos_encoder(tgt_emb)
+        # 词嵌入和位置编码（转换为模型内部布局）
+        src_emb = self._embed(src, self.src_embedding)
+        tgt_emb = self._embed(tgt, self.tgt_embedding)
         
         # 编码反应条件
         condition_emb = self.condition_encoder(conditions)  # [batch_size, d_model]
-        condition_emb = condition_emb.unsqueeze(0)  # [1, batch_size, d_model]
+        condition_emb = condition_emb.unsqueeze(self._seq_dim)
         
         # 将条件向量加到源序列的第一个位置
-        src_emb = torch.cat([condition_emb, src_emb], dim=0)
+        src_emb = torch.cat([condition_emb, src_emb], dim=self._seq_dim)
         
         # 调整掩码尺寸（为条件向量添加一个位置）
         if src_key_padding_mask is not None:
@@ -199,19 +301,51 @@ class ReactionTransformer(nn.Module):
             src_key_padding_mask = torch.cat([condition_padding, src_key_padding_mask], dim=1)
         
         # Transformer前向传播
-        output = self.transformer(
-            src_emb, tgt_emb,
-            src_mask=src_mask,
-            tgt_mask=tgt_mask,
-            src_key_padding_mask=src_key_padding_mask,
-            tgt_key_padding_mask=tgt_key_padding_mask
-        )
+        if self.gradient_checkpointing and self.training:
+            output = self._checkpointed_transformer(
+                src_emb, tgt_emb, src_mask, tgt_mask, src_key_padding_mask, tgt_key_padding_mask
+            )
+        else:
+            output = self.transformer(
+                src_emb, tgt_emb,
+                src_mask=src_mask,
+                tgt_mask=tgt_mask,
+                src_key_padding_mask=src_key_padding_mask,
+                tgt_key_padding_mask=tgt_key_padding_mask
+            )
         
         # 输出投影
         output = self.output_projection(output)
         
         # 转回 [batch_size, seq_len, vocab_size] 格式
-        output = output.transpose(0, 1)
+        if not self.batch_first:
+            output = output.transpose(0, 1)
+        
+        return output
+    
+    def _checkpointed_transformer(
+        self,
+        src_emb: torch.Tensor,
+        tgt_emb: torch.Tensor,
+        src_mask: Optional[torch.Tensor],
+        tgt_mask: Optional[torch.Tensor],
+        src_key_padding_mask: Optional[torch.Tensor],
+        tgt_key_padding_mask: Optional[torch.Tensor]
+    ) -> torch.Tensor:
+        """逐层带激活检查点运行编码器和解码器，结果与 self.transformer(...) 相同"""
+        memory = src_emb
+        for layer in self.transformer.encoder.layers:
+            memory = checkpoint(layer, memory, src_mask, src_key_padding_mask, use_reentrant=False)
+        if self.transformer.encoder.norm is not None:
+            memory = self.transformer.encoder.norm(memory)
+        
+        output = tgt_emb
+        for layer in self.transformer.decoder.layers:
+            # 参数顺序: tgt, memory, tgt_mask, memory_mask, tgt_key_padding_mask, memory_key_padding_mask
+            output = checkpoint(layer, output, memory, tgt_mask, None, tgt_key_padding_mask, None,
+                                use_reentrant=False)
+        if self.transformer.decoder.norm is not None:
+            output = self.transformer.decoder.norm(output)
         
         return output
     
@@ -232,19 +366,17 @@ class ReactionTransformer(nn.Module):
         Returns:
             编码器输出 [src_len+1, batch_size, d_model]
         """
-        # 转置为 [seq_len, batch_size] 格式
-        src = src.transpose(0, 1)
+        self._check_source_length(src.size(1))
         
-        # 词嵌入和位置编码
-        src_emb = self.src_embedding(src) * math.sqrt(self.d_model)
-        src_emb = self.pos_encoder(src_emb)
+        # 词嵌入和位置编码（模型内部布局）
+        src_emb = self._embed(src, self.src_embedding)
         
-        # 编码反应条件
-        condition_emb = self.condition_encoder(conditions)
-        condition_emb = condition_emb.unsqueeze(0)
+        # 编码反应条件（与模型权重精度保持一致，便于bf16/fp16推理）
+        condition_emb = self.condition_encoder(conditions.to(src_emb.dtype))
+        condition_emb = condition_emb.unsqueeze(self._seq_dim)
         
-        # 组合源序列和条件
-        src_emb = torch.cat([condition_emb, src_emb], dim=0)
+        # 组合源序列和条件（直接拼接为模型内部布局）
+        src_emb = torch.cat([condition_emb, src_emb], dim=self._seq_dim)
         
         # 调整掩码
         if src_key_padding_mask is not None:
@@ -252,10 +384,16 @@ class ReactionTransformer(nn.Module):
                                           dtype=torch.bool, device=src_key_padding_mask.device)
             src_key_padding_mask = torch.cat([condition_padding, src_key_padding_mask], dim=1)
         
-        # 编码
+        # 编码（batch优先布局下，推理时编码器走融合注意力快速路径，padding位置通过嵌套张量跳过）
         memory = self.transformer.encoder(src_emb, mask=src_mask, src_key_padding_mask=src_key_padding_mask)
         
-        return memory
+        # 输出统一为 [src_len+1, batch_size, d_model]
+        return memory.transpose(0, 1) if self.batch_first else memory
+    
+    def _check_source_length(self, src_len: int) -> None:
+        """编码器序列在反应物前还有一个条件向量，总长度不能超过max_len"""
+        if src_len + 1 > self.max_len:
+            raise ValueError(f"反应物序列长度 {src_len}（加上条件向量为 {src_len + 1}）超出模型最大长度 {self.max_len}")
     
     def decode(
         self,
@@ -276,12 +414,10 @@ class ReactionTransformer(nn.Module):
         Returns:
             解码器输出 [batch_size, tgt_len, vocab_size]
         """
-        # 转置为 [seq_len, batch_size] 格式
-        tgt = tgt.transpose(0, 1)
-        
         # 词嵌入和位置编码
-        tgt_emb = self.tgt_embedding(tgt) * math.sqrt(self.d_model)
-        tgt_emb = self.pos_encoder(tgt_emb)
+        tgt_emb = self._embed(tgt, self.tgt_embedding)
+        if self.batch_first:
+            memory = memory.transpose(0, 1)
         
         # 解码
         output = self.transformer.decoder(
@@ -295,9 +431,127 @@ class ReactionTransformer(nn.Module):
         output = self.output_projection(output)
         
         # 转回 [batch_size, seq_len, vocab_size] 格式
-        output = output.transpose(0, 1)
+        if not self.batch_first:
+            output = output.transpose(0, 1)
         
         return output
+    
+    def init_decoder_cache(
+        self,
+        memory: torch.Tensor,
+        memory_key_padding_mask: Optional[torch.Tensor] = None
+    ) -> DecoderCache:
+        """
+        创建增量解码缓存，预先计算每层交叉注意力中memory的key/value投影
+        Args:
+            memory: 编码器输出 [src_len+1, batch_size, d_model]
+            memory_key_padding_mask: 编码器输出padding掩码 [batch_size, src_len+1]
+        Returns:
+            解码缓存
+        """
+        memory = memory.transpose(0, 1)  # [batch_size, src_len+1, d_model]
+        cross_kv = []
+        
+        for layer in self.transformer.decoder.layers:
+            attn = layer.multihead_attn
+            _, w_k, w_v = attn.in_proj_weight.chunk(3)
+            b_k = b_v = None
+            if attn.in_proj_bias is not None:
+                _, b_k, b_v = attn.in_proj_bias.chunk(3)
+            
+            key = _split_heads(F.linear(memory, w_k, b_k), attn.num_heads)
+            value = _split_heads(F.linear(memory, w_v, b_v), attn.num_heads)
+            cross_kv.append((key, value))
+        
+        return DecoderCache(cross_kv, memory_key_padding_mask)
+    
+    def decode_step(self, tgt_token: torch.Tensor, cache: DecoderCache) -> torch.Tensor:
+        """
+        增量解码一步：只处理最新的token，复用缓存中的历史key/value（仅用于推理）
+        Args:
+            tgt_token: 最新的目标token [batch_size]
+            cache: 由 init_decoder_cache 创建的解码缓存，会被原地更新
+        Returns:
+            下一个token的logits [batch_size, vocab_size]
+        """
+        # 词嵌入和位置编码（按当前步数偏移）
+        x = self.tgt_embedding(tgt_token.unsqueeze(0)) * math.sqrt(self.d_model)
+        x = self.pos_encoder(x, offset=cache.step)
+        
+        logits = self.decode_embedded_step(x.transpose(0, 1), cache)
+        cache.step += 1
+        return logits
+    
+    def decode_embedded_step(self, x: torch.Tensor, cache: DecoderCache) -> torch.Tensor:
+        """
+        对已完成词嵌入和位置编码的最新token运行解码器各层（不更新 cache.step）
+        Args:
+            x: 最新token的嵌入 [batch_size, 1, d_model]
+            cache: 解码缓存，自注意力key/value会被原地更新
+        Returns:
+            下一个token的logits [batch_size, vocab_size]
+        """
+        # memory padding掩码转换为注意力掩码（True表示可以注意）
+        cross_mask = None
+        if cache.memory_key_padding_mask is not None:
+            cross_mask = ~cache.memory_key_padding_mask[:, None, None, :]
+        
+        for i, layer in enumerate(self.transformer.decoder.layers):
+            if layer.norm_first:
+                x = x + self._cached_self_attention(layer, layer.norm1(x), cache, i)
+                x = x + self._cached_cross_attention(layer, layer.norm2(x), cache, i, cross_mask)
+                x = x + layer.linear2(layer.activation(layer.linear1(layer.norm3(x))))
+            else:
+                x = layer.norm1(x + self._cached_self_attention(layer, x, cache, i))
+                x = layer.norm2(x + self._cached_cross_attention(layer, x, cache, i, cross_mask))
+                x = layer.norm3(x + layer.linear2(layer.activation(layer.linear1(x))))
+        
+        if self.transformer.decoder.norm is not None:
+            x = self.transformer.decoder.norm(x)
+        
+        # 输出投影
+        return self.output_projection(x[:, -1, :])
+    
+    @staticmethod
+    def _cached_self_attention(
+        layer: nn.TransformerDecoderLayer,
+        x: torch.Tensor,
+        cache: DecoderCache,
+        layer_idx: int
+    ) -> torch.Tensor:
+        """带缓存的解码器自注意力，新token可以注意到全部历史token，因此无需因果掩码"""
+        attn = layer.self_attn
+        query, key, value = F.linear(x, attn.in_proj_weight, attn.in_proj_bias).chunk(3, dim=-1)
+        query = _split_heads(query, attn.num_heads)
+        key = _split_heads(key, attn.num_heads)
+        value = _split_heads(value, attn.num_heads)
+        
+        past = cache.self_kv[layer_idx]
+        if past is not None:
+            key = torch.cat([past[0], key], dim=2)
+            value = torch.cat([past[1], value], dim=2)
+        cache.self_kv[layer_idx] = (key, value)
+        
+        output = F.scaled_dot_product_attention(query, key, value)
+        return attn.out_proj(_merge_heads(output))
+    
+    @staticmethod
+    def _cached_cross_attention(
+        layer: nn.TransformerDecoderLayer,
+        x: torch.Tensor,
+        cache: DecoderCache,
+        layer_idx: int,
+        attn_mask: Optional[torch.Tensor]
+    ) -> torch.Tensor:
+        """使用预先计算的memory key/value的交叉注意力"""
+        attn = layer.multihead_attn
+        w_q = attn.in_proj_weight[:attn.embed_dim]
+        b_q = attn.in_proj_bias[:attn.embed_dim] if attn.in_proj_bias is not None else None
+        query = _split_heads(F.linear(x, w_q, b_q), attn.num_heads)
+        
+        key, value = cache.cross_kv[layer_idx]
+        output = F.scaled_dot_product_attention(query, key, value, attn_mask=attn_mask)
+        return attn.out_proj(_merge_heads(output))
 
 
 def create_model(vocab_size: int, **kwargs) -> ReactionTransformer:
@@ -309,4 +563,45 @@ def create_model(vocab_size: int, **kwargs) -> ReactionTransformer:
     Returns:
         ReactionTransformer模型实例
     """
-    return ReactionTransformer(vocab_size=vocab_size, **kwargs) 
\ No newline at end of file
+    return ReactionTransformer(vocab_size=vocab_size, **kwargs) 
+
+
+def quantize_dynamic_model(model: ReactionTransformer) -> ReactionTransformer:
+    """
+    动态int8量化：将Transformer前馈层、output_projection和条件编码MLP中的Linear层
+    替换为int8权重的动态量化实现（激活在运行时按批次量化），仅用于CPU推理
+    注意力层的输出投影（NonDynamicallyQuantizableLinear）保持fp32
+    Args:
+        model: fp32模型
+    Returns:
+        量化后的模型
+    """
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+
+def load_checkpoint(path: str, map_location='cpu', allow_pickle: bool = False) -> dict:
+    """
+    加载checkpoint：使用weights_only模式（只反序列化张量和基本类型，不执行任意pickle代码），
+    新版PyTorch下同时使用mmap按需读取权重，缩短冷启动时间
+    Args:
+        path: checkpoint文件路径
+        map_location: 张量加载到的设备
+        allow_pickle: weights_only模式无法加载时（如旧版PyTorch保存的量化模型packed参数）
+                      是否回退到完整反序列化；会执行文件中的任意代码，只能用于可信的文件
+    Returns:
+        checkpoint字典
+    """
+    kwargs = {'map_location': map_location, 'weights_only': True}
+    if 'mmap' in inspect.signature(torch.load).parameters:
+        kwargs['mmap'] = True
+    try:
+        return torch.load(path, **kwargs)
+    except (pickle.UnpicklingError, RuntimeError) as e:
+        if not allow_pickle:
+            raise ValueError(
+                f"无法以weights_only模式加载checkpoint {path}: {e}\n"
+                "如果文件来源可信且包含张量以外的Python对象，请使用 allow_pickle=True 加载"
+            ) from e
+        warnings.warn(f"checkpoint {path} 无法以weights_only模式加载，按 allow_pickle=True 完整反序列化（会执行文件中的代码）")
+        return torch.load(path, map_location=map_location, weights_only=False)
@@ -1,27 +1,402 @@
 """
 推理脚本 - ReactionTransformer 消毒副产物预测
-包含模型加载、贪心解码和产物SMILES预测功能
+包含模型加载、批量解码（贪心/束搜索/采样）和产物SMILES预测功能
 """
 import torch
-import torch.nn.functional as F
 import os
-from typing import List, Tuple, Optional
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import torch.multiprocessing as mp
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple, Optional, Union
 
 # 导入自定义模块
-from utils import SMILESVocabulary, load_vocab, encode_conditions, create_padding_mask
-from model import ReactionTransformer
+from utils import SMILESVocabulary, load_vocab, encode_conditions, create_padding_mask, PRECISIONS
+from model import ReactionTransformer, load_checkpoint, quantize_dynamic_model
+from decoding import DecodingStrategy, GreedyDecoder, GenerationCancelled, SamplingDecoder
+from inference_metrics import CallStats, PredictorMetrics, stage_timer
+from torchscript_export import load_torchscript_model
+
+
+try:
+    from rdkit import Chem
+except ImportError:  # RDKit为可选依赖，未安装时只做基本规范化
+    Chem = None
+
+# 推理后端：PyTorch模块或 torchscript_export.py 导出的计算图
+BACKENDS = ('eager', 'torchscript')
+
+
+def canonicalize_smiles(smiles: str) -> str:
+    """
+    规范化SMILES（安装RDKit时使用其规范SMILES，否则去除首尾空白）
+    Args:
+        smiles: SMILES字符串
+    Returns:
+        规范化后的SMILES
+    """
+    smiles = smiles.strip()
+    if Chem is not None:
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is not None:
+            return Chem.MolToSmiles(mol)
+    return smiles
+
+
+def file_sha256(filepath: str) -> str:
+    """计算文件的SHA-256（用于标识模型checkpoint）"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """
+    基于SQLite的持久化预测缓存，可被多个进程（如多个Streamlit副本）共享
+    按最近访问时间进行LRU淘汰，并记录命中/未命中次数
+    
+    查询是只读的：命中/未命中计数和访问时间先记在进程内，定期批量写回数据库；
+    写入时按本进程跟踪的条数判断是否需要淘汰，超出容量后一次淘汰一批条目
+    """
+    
+    def __init__(
+        self,
+        path: str = "prediction_cache.sqlite",
+        max_entries: int = 100000,
+        ph_resolution: float = 0.1,
+        flush_interval: float = 5.0,
+        evict_fraction: float = 0.05
+    ):
+        """
+        初始化缓存
+        Args:
+            path: SQLite数据库文件路径
+            max_entries: 最大缓存条数，超出后淘汰最久未访问的条目
+            ph_resolution: pH分桶精度，落在同一桶内的pH共享缓存
+            flush_interval: 进程内命中统计和访问时间写回数据库的间隔（秒）
+            evict_fraction: 每次淘汰时额外腾出的容量比例，避免每次写入都触发淘汰
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ph_resolution = ph_resolution
+        self.flush_interval = flush_interval
+        self.evict_fraction = evict_fraction
+        self._lock = threading.Lock()
+        
+        # 尚未写回数据库的统计和访问时间
+        self._pending_hits = 0
+        self._pending_misses = 0
+        self._pending_access: Dict[str, float] = {}
+        self._last_flush = time.monotonic()
+        
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            # WAL模式允许多个进程同时读、单个进程写
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON predictions(last_access)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._conn.execute("INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0)")
+            # 其他进程也会写入，本进程的计数只是近似值，淘汰时重新统计
+            self._num_entries = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+    
+    def make_key(
+        self,
+        reactant_smiles: str,
+        pH: float,
+        disinfectant: str,
+        decoding: Dict,
+        model_hash: str
+    ) -> str:
+        """
+        生成缓存键
+        Args:
+            reactant_smiles: 规范化后的反应物SMILES（见 canonicalize_smiles）
+            pH: pH值
+            disinfectant: 消毒剂类型
+            decoding: 解码参数（策略及最大长度等）
+            model_hash: 模型checkpoint标识
+        Returns:
+            缓存键
+        """
+        ph_bucket = round(pH / self.ph_resolution)
+        payload = json.dumps(
+            [reactant_smiles, ph_bucket, disinfectant, decoding, model_hash],
+            sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key: str) -> Optional[List[Tuple[str, float]]]:
+        """
+        查询缓存，命中时记录访问时间（定期写回数据库）
+        Args:
+            key: 缓存键
+        Returns:
+            缓存的候选列表，未命中时返回None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._pending_misses += 1
+            else:
+                self._pending_hits += 1
+                self._pending_access[key] = time.time()
+            
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+        
+        if row is None:
+            return None
+        return [(smiles, score) for smiles, score in json.loads(row[0])]
+    
+    def put(self, key: str, candidates: List[Tuple[str, float]]) -> None:
+        """
+        写入缓存，超出容量时批量淘汰最久未访问的条目
+        Args:
+            key: 缓存键
+            candidates: 候选列表
+        """
+        with self._lock, self._conn:
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO predictions VALUES (?, ?, ?)",
+                (key, json.dumps(candidates), time.time())
+            ).rowcount
+            if not inserted:
+                self._conn.execute(
+                    "UPDATE predictions SET value = ?, last_access = ? WHERE key = ?",
+                    (json.dumps(candidates), time.time(), key)
+                )
+                return
+            
+            self._num_entries += 1
+            if self._num_entries > self.max_entries:
+                self._evict()
+    
+    def _evict(self) -> None:
+        """淘汰最久未访问的条目，使条数降到容量以下留出一批空间（调用方持有锁并处于事务中）"""
+        # 先写回本进程记录的访问时间，避免淘汰刚命中的条目
+        self._write_pending()
+        self._num_entries = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+        target = self.max_entries - int(self.max_entries * self.evict_fraction)
+        excess = self._num_entries - target
+        if self._num_entries > self.max_entries and excess > 0:
+            self._conn.execute(
+                "DELETE FROM predictions WHERE key IN ("
+                "SELECT key FROM predictions ORDER BY last_access LIMIT ?)",
+                (excess,)
+            )
+            self._num_entries -= excess
+    
+    def _write_pending(self) -> None:
+        """把进程内的统计和访问时间写入数据库（调用方持有锁并处于事务中）"""
+        if self._pending_hits or self._pending_misses:
+            self._conn.executemany(
+                "UPDATE stats SET value = value + ? WHERE name = ?",
+                [(self._pending_hits, 'hits'), (self._pending_misses, 'misses')]
+            )
+        if self._pending_access:
+            self._conn.executemany(
+                "UPDATE predictions SET last_access = MAX(last_access, ?) WHERE key = ?",
+                [(access, key) for key, access in self._pending_access.items()]
+            )
+        self._pending_hits = 0
+        self._pending_misses = 0
+        self._pending_access = {}
+        self._last_flush = time.monotonic()
+    
+    def _flush(self) -> None:
+        """在单个事务中写回进程内的统计（调用方持有锁）"""
+        if self._pending_hits or self._pending_misses or self._pending_access:
+            with self._conn:
+                self._write_pending()
+        else:
+            self._last_flush = time.monotonic()
+    
+    def flush(self) -> None:
+        """立即把本进程的命中统计和访问时间写回数据库"""
+        with self._lock:
+            self._flush()
+    
+    def stats(self) -> Dict[str, float]:
+        """
+        获取缓存统计（所有共享该文件的进程累计）
+        Returns:
+            包含 hits、misses、hit_rate、entries 的字典
+        """
+        with self._lock:
+            self._flush()
+            counters = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+            entries = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+            self._num_entries = entries
+        
+        total = counters['hits'] + counters['misses']
+        return {
+            'hits': counters['hits'],
+            'misses': counters['misses'],
+            'hit_rate': counters['hits'] / total if total else 0.0,
+            'entries': entries
+        }
+    
+    def clear(self) -> None:
+        """清空缓存和统计"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM predictions")
+            self._conn.execute("UPDATE stats SET value = 0")
+            self._pending_hits = 0
+            self._pending_misses = 0
+            self._pending_access = {}
+            self._num_entries = 0
+    
+    def close(self) -> None:
+        """写回未保存的统计后关闭数据库连接"""
+        with self._lock:
+            self._flush()
+            self._conn.close()
+
+
+class EncoderCache:
+    """
+    进程内编码器输出的LRU缓存，按占用字节数限制容量
+    以 (反应物token序列, 条件向量) 为键缓存每条输入的 memory；
+    条件向量作为编码器输入的第一个token参与每一层自注意力，不同条件的 memory 不能共享
+    """
+    
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2):
+        """
+        初始化缓存
+        Args:
+            max_bytes: 缓存张量的最大总字节数，超出后淘汰最久未访问的条目
+        """
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, torch.Tensor]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def __getstate__(self) -> Dict:
+        # 传给工作进程时只保留容量设置，每个工作进程维护自己的缓存
+        return {'max_bytes': self.max_bytes}
+    
+    def __setstate__(self, state: Dict) -> None:
+        self.__init__(state['max_bytes'])
+    
+    def get(self, key: tuple) -> Optional[torch.Tensor]:
+        """查询缓存，命中时移到最近访问位置"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key: tuple, value: torch.Tensor) -> None:
+        """写入缓存，超出字节上限时淘汰最久未访问的条目"""
+        size = value.numel() * value.element_size()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                old = self._entries.pop(key)
+                self.num_bytes -= old.numel() * old.element_size()
+            self._entries[key] = value
+            self.num_bytes += size
+            while self.num_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.num_bytes -= evicted.numel() * evicted.element_size()
+    
+    def stats(self) -> Dict[str, float]:
+        """
+        获取缓存统计
+        Returns:
+            包含 hits、misses、hit_rate、entries、bytes 的字典
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+                'bytes': self.num_bytes
+            }
+    
+    def clear(self) -> None:
+        """清空缓存和统计"""
+        with self._lock:
+            self._entries.clear()
+            self.num_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+# 工作进程中的预测器，只在子进程中由 _init_pool_worker 设置
+_POOL_PREDICTOR = None
+
+
+def _init_pool_worker(predictor: "ReactionPredictor", num_threads: int) -> None:
+    """
+    工作进程初始化：记录预测器并限制torch线程数，避免多个进程争抢CPU核
+    预测器随initargs以spawn方式传入（浮点模型权重位于共享内存，只传递句柄，不会复制N份）
+    """
+    global _POOL_PREDICTOR
+    _POOL_PREDICTOR = predictor
+    torch.set_num_threads(num_threads)
+
+
+def _decode_shard(args) -> Tuple[List[List[Tuple[str, float]]], Optional[CallStats]]:
+    """工作进程中解码一个分片，开启指标统计时一并返回本分片的统计"""
+    inputs, strategy, max_length, collect_stats = args
+    stats = CallStats(_POOL_PREDICTOR.device) if collect_stats else None
+    results = _POOL_PREDICTOR._decode_inputs(inputs, strategy, max_length, batch_size=len(inputs), stats=stats)
+    return results, stats
 
 
 class ReactionPredictor:
     """反应产物预测器"""
     
-    def __init__(self, model_path: str, vocab_path: str, device: Optional[str] = None):
+    def __init__(
+        self,
+        model_path: str,
+        vocab_path: str,
+        device: Optional[str] = None,
+        precision: Optional[str] = None,
+        quantized: bool = False,
+        cache: Optional[PredictionCache] = None,
+        encoder_cache: Optional[EncoderCache] = None,
+        backend: str = 'eager',
+        verbose: bool = True,
+        metrics: Optional[PredictorMetrics] = None,
+        fast_path: bool = False,
+        allow_pickle: bool = False
+    ):
         """
         初始化预测器
         Args:
             model_path: 模型权重文件路径
             vocab_path: 词汇表文件路径
             device: 计算设备
+            precision: 推理精度 'fp32'、'bf16' 或 'fp16'（仅CUDA），默认沿用训练时的精度
+            quantized: 是否使用动态int8量化模型（仅CPU）；由 quantize.py 导出的checkpoint总是按量化模型加载
+            cache: 持久化预测缓存（可选），确定性解码策略的结果会被缓存
+            encoder_cache: 编码器输出缓存（可选），重复的反应物/条件跳过编码器计算
+            backend: 'eager'（PyTorch模块）或 'torchscript'（model_path 为 torchscript_export.py 导出的文件，仅CPU）
+            verbose: 是否打印加载进度（Web应用等服务场景可关闭）
+            metrics: 推理指标（可选），记录每次调用的分阶段耗时、生成token数和缓存命中
+            fast_path: 以batch优先布局构建模型（权重不变，可加载 train.py 保存的任意checkpoint），
+                       编码器使用PyTorch融合注意力快速路径，并用嵌套张量跳过padding位置的计算；
+                       仅eager后端，不支持int8动态量化
+            allow_pickle: checkpoint无法以weights_only模式加载时是否完整反序列化（仅用于可信的文件，见 load_checkpoint）
         """
         # 设置设备
         if device is None:
@@ -29,29 +404,107 @@ class ReactionPredictor:
         else:
             self.device = torch.device(device)
         
-        print(f"使用设备: {self.device}")
+        self.verbose = verbose
+        self._log(f"使用设备: {self.device}")
         
         # 加载词汇表
-        print("正在加载词汇表...")
-        self.vocab = load_vocab(vocab_path)
+        self._log("正在加载词汇表...")
+        self.vocab = load_vocab(vocab_path, verbose=verbose)
         
         # 加载模型
-        print("正在加载模型...")
-        self._load_model(model_path)
+        self._log("正在加载模型...")
+        if backend not in BACKENDS:
+            raise ValueError(f"未知的推理后端: {backend}，可选: {BACKENDS}")
+        self.backend = backend
+        if fast_path and backend != 'eager':
+            raise ValueError("快速路径仅支持eager后端")
+        self.fast_path = fast_path
+        self.allow_pickle = allow_pickle
+        if backend == 'torchscript':
+            self._load_scripted_model(model_path, precision, quantized)
+        else:
+            self._load_model(model_path, precision, quantized)
+        
+        self.model_path = model_path
+        
+        # 预测缓存：模型标识在首次查询缓存时计算，未使用缓存时不读取整个checkpoint
+        self.cache = cache
+        self._model_hash: Optional[str] = None
+        self.encoder_cache = encoder_cache
+        self.metrics = metrics
+        
+        # 多进程推理的常驻进程池，首次使用时创建
+        self._pool = None
+        self._pool_config: Optional[Tuple[int, int]] = None
+        self._pool_lock = threading.Lock()
         
-        print("预测器初始化完成！")
+        self._log("预测器初始化完成！")
+    
+    def __getstate__(self) -> Dict:
+        """
+        传给工作进程的状态：不包含预测缓存、指标、锁和进程池（预测缓存统一由父进程读写，
+        编码器缓存在每个工作进程中重新创建）；
+        浮点模型的权重通过共享内存传递，TorchScript模型不能pickle、int8量化模型的packed参数
+        不能放入共享内存，这两种在工作进程中从文件重新加载
+        """
+        state = self.__dict__.copy()
+        for name in ('cache', 'metrics', '_pool', '_pool_config', '_pool_lock'):
+            state[name] = None
+        if self.backend == 'torchscript' or self.quantized:
+            state['model'] = None
+        return state
+    
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._pool_lock = threading.Lock()
+        if self.model is None:
+            self.verbose = False
+            if self.backend == 'torchscript':
+                self._load_scripted_model(self.model_path, self.precision)
+            else:
+                self._load_model(self.model_path, self.precision, self.quantized)
+    
+    @property
+    def model_hash(self) -> str:
+        """
+        模型标识，包含checkpoint内容与推理精度，模型更新后旧缓存自动失效
+        Returns:
+            checkpoint的SHA-256加上精度、量化方式和后端
+        """
+        if self._model_hash is None:
+            weights = 'int8' if self.quantized else 'float'
+            self._model_hash = f"{file_sha256(self.model_path)}:{self.precision}:{weights}:{self.backend}"
+        return self._model_hash
+    
+    def close(self) -> None:
+        """关闭多进程推理的常驻进程池"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+                self._pool_config = None
     
-    def _load_model(self, model_path: str):
+    def _log(self, message: str) -> None:
+        """verbose模式下打印加载信息"""
+        if self.verbose:
+            print(message)
+    
+    def _load_model(self, model_path: str, precision: Optional[str] = None, quantized: bool = False):
         """
         加载训练好的模型
         Args:
             model_path: 模型文件路径
+            precision: 推理精度，默认使用checkpoint中记录的训练精度
+            quantized: 是否使用动态int8量化模型
         """
         # 加载模型状态
-        checkpoint = torch.load(model_path, map_location=self.device)
+        checkpoint = load_checkpoint(model_path, map_location=self.device, allow_pickle=self.allow_pickle)
         
-        # 获取模型配置
+        # 获取模型配置（两种布局的参数相同，快速路径只改变内部布局）
         model_config = checkpoint['model_config']
+        if self.fast_path:
+            model_config = {**model_config, 'batch_first': True}
         vocab_size = checkpoint['vocab_size']
         
         # 创建模型实例
@@ -60,12 +513,167 @@ class ReactionPredictor:
             **model_config
         )
         
+        # 已量化的checkpoint需要先构建相同结构的量化模型再加载权重
+        checkpoint_quantized = checkpoint.get('quantization') == 'dynamic_int8'
+        self.quantized = quantized or checkpoint_quantized
+        if self.quantized and self.device.type != 'cpu':
+            raise ValueError("动态int8量化模型仅支持CPU推理")
+        if self.quantized and self.fast_path:
+            # 量化后的Linear没有普通的weight张量，无法走融合注意力快速路径
+            raise ValueError("快速路径不支持int8动态量化模型")
+        if checkpoint_quantized:
+            self.model.eval()
+            self.model = quantize_dynamic_model(self.model)
+        
         # 加载权重
         self.model.load_state_dict(checkpoint['model_state_dict'])
         self.model.to(self.device)
         self.model.eval()
         
-        print(f"模型加载完成，参数数量: {sum(p.numel() for p in self.model.parameters()):,}")
+        if self.quantized and not checkpoint_quantized:
+            self.model = quantize_dynamic_model(self.model)
+        
+        # 推理精度（旧checkpoint没有precision字段，均为fp32训练）
+        self.trained_precision = checkpoint.get('precision', 'fp32')
+        if self.quantized:
+            if precision not in (None, 'fp32'):
+                raise ValueError("量化模型只能与fp32激活一起使用")
+            precision = 'fp32'
+        if precision is None:
+            precision = self.trained_precision
+            if precision == 'fp16' and self.device.type != 'cuda':
+                precision = 'fp32'  # CPU不支持高效的fp16计算
+        if precision not in PRECISIONS:
+            raise ValueError(f"未知的精度设置: {precision}，可选: {PRECISIONS}")
+        if precision == 'fp16' and self.device.type != 'cuda':
+            raise ValueError("fp16推理仅支持CUDA设备，CPU请使用bf16")
+        
+        # 低精度推理直接转换权重，权重与激活内存减半
+        if precision == 'bf16':
+            self.model.to(torch.bfloat16)
+        elif precision == 'fp16':
+            self.model.to(torch.float16)
+        self.precision = precision
+        
+        self._log(f"模型加载完成，参数数量: {sum(p.numel() for p in self.model.parameters()):,}，"
+                  f"推理精度: {precision}{'（int8动态量化）' if self.quantized else ''}"
+                  f"{'，batch优先快速路径' if self.fast_path else ''}")
+    
+    def _load_scripted_model(self, model_path: str, precision: Optional[str] = None, quantized: bool = False):
+        """
+        加载TorchScript导出的模型
+        Args:
+            model_path: TorchScript文件路径
+            precision: 推理精度，TorchScript后端只支持fp32
+            quantized: TorchScript后端不支持动态量化
+        """
+        if self.device.type != 'cpu':
+            raise ValueError("TorchScript后端仅支持CPU推理")
+        if quantized or precision not in (None, 'fp32'):
+            raise ValueError("TorchScript后端只支持fp32推理")
+        
+        self.model = load_torchscript_model(model_path)
+        self.quantized = False
+        self.precision = 'fp32'
+        self.trained_precision = self.model.config.get('precision', 'fp32')
+        
+        self._log("TorchScript模型加载完成，推理精度: fp32")
+    
+    def _encode_batch(
+        self,
+        inputs: List[Tuple[str, float, str]],
+        stats: Optional[CallStats] = None
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        将一批输入填充后一次性送入编码器
+        Args:
+            inputs: 输入列表，每个元素为 (reactant_smiles, pH, disinfectant)
+            stats: 调用统计（可选）
+        Returns:
+            (memory [src_len+1, batch_size, d_model], memory_padding_mask [batch_size, src_len+1])
+        """
+        with stage_timer(stats, 'tokenize'):
+            # 批量编码并填充反应物序列
+            src = self.vocab.encode_batch([reactant for reactant, _, _ in inputs]).to(self.device)
+            
+            # 编码反应条件
+            conditions = [encode_conditions(pH, disinfectant) for _, pH, disinfectant in inputs]
+            conditions = torch.tensor(conditions, dtype=torch.float32, device=self.device)
+            
+            # 创建源序列padding掩码
+            src_padding_mask = create_padding_mask(src, self.vocab.get_pad_idx())
+        
+        with stage_timer(stats, 'encode'):
+            memory = self._run_encoder(src, conditions, src_padding_mask, stats)
+        
+        # 创建用于解码的memory掩码（因为在encode中添加了条件向量，所以长度+1）
+        memory_padding_mask = torch.zeros(src_padding_mask.size(0), src_padding_mask.size(1) + 1,
+                                          dtype=torch.bool, device=self.device)
+        memory_padding_mask[:, 1:] = src_padding_mask  # 第一个位置（条件向量）不掩盖
+        
+        return memory, memory_padding_mask
+    
+    def _run_encoder(
+        self,
+        src: torch.Tensor,
+        conditions: torch.Tensor,
+        src_padding_mask: torch.Tensor,
+        stats: Optional[CallStats] = None
+    ) -> torch.Tensor:
+        """
+        运行编码器；配置了编码器缓存时逐条查询，只对未命中的输入批量编码，再拼回填充后的批次
+        Returns:
+            [src_len+1, batch_size, d_model]，padding位置为0
+        """
+        if self.encoder_cache is None:
+            return self.model.encode(
+                src=src,
+                conditions=conditions,
+                src_key_padding_mask=src_padding_mask
+            )
+        
+        lengths = (~src_padding_mask).sum(dim=1).tolist()
+        keys = [
+            (tuple(src[i, :length].tolist()), tuple(condition))
+            for i, (length, condition) in enumerate(zip(lengths, conditions.tolist()))
+        ]
+        rows = [self.encoder_cache.get(key) for key in keys]
+        
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if stats is not None:
+            stats.encoder_cache_hits += len(rows) - len(missing)
+            stats.encoder_cache_misses += len(missing)
+        if missing:
+            index = torch.tensor(missing, device=src.device)
+            output = self.model.encode(
+                src=src[index], conditions=conditions[index], src_key_padding_mask=src_padding_mask[index]
+            )
+            for j, i in enumerate(missing):
+                # clone使缓存条目不引用整个批次的输出（条件向量占第一个位置）
+                rows[i] = output[:lengths[i] + 1, j].clone()
+                self.encoder_cache.put(keys[i], rows[i])
+        
+        memory = rows[0].new_zeros(src.size(1) + 1, len(rows), rows[0].size(-1))
+        for i, row in enumerate(rows):
+            memory[:row.size(0), i] = row
+        return memory
+    
+    def check_input_lengths(self, inputs: List[Tuple[str, float, str]], max_length: int) -> None:
+        """
+        检查生成长度和反应物序列长度是否在模型位置编码的范围内
+        Args:
+            inputs: 输入列表，每个元素为 (reactant_smiles, pH, disinfectant)
+            max_length: 最大生成长度
+        Raises:
+            ValueError: max_length 超出模型最大长度，或反应物序列（含<sos>/<eos>和条件向量）超出模型最大长度
+        """
+        max_len = self.model.max_len
+        if max_length > max_len:
+            raise ValueError(f"最大生成长度 {max_length} 超出模型最大长度 {max_len}")
+        for reactant, _, _ in inputs:
+            src_len = len(self.vocab.tokenize(reactant)) + 2
+            if src_len + 1 > max_len:
+                raise ValueError(f"反应物序列长度 {src_len}（加上条件向量为 {src_len + 1}）超出模型最大长度 {max_len}")
     
     def predict_product(
         self,
@@ -73,7 +681,8 @@ class ReactionPredictor:
         pH: float,
         disinfectant: str,
         max_length: int = 100,
-        temperature: float = 1.0
+        temperature: Optional[float] = None,
+        strategy: Optional[DecodingStrategy] = None
     ) -> str:
         """
         预测反应产物SMILES
@@ -82,95 +691,323 @@ class ReactionPredictor:
             pH: 反应pH值
             disinfectant: 消毒剂类型 ('chlorine', 'chloramine', 'ozone')
             max_length: 最大生成长度
-            temperature: 采样温度（越高越随机）
+            temperature: 采样温度；未指定strategy时，给定任意值都使用 SamplingDecoder(temperature=temperature)，
+                         None 表示贪心解码
+            strategy: 解码策略，默认贪心解码（指定后忽略temperature）
         Returns:
             预测的产物SMILES字符串
         """
-        with torch.no_grad():
-            # 1. 编码输入
-            src_tokens = self.vocab.encode_smiles(reactant_smiles, add_special_tokens=True)
-            src = torch.tensor([src_tokens], dtype=torch.long).to(self.device)
-            
-            # 编码反应条件
-            conditions = encode_conditions(pH, disinfectant)
-            conditions = torch.tensor([conditions], dtype=torch.float32).to(self.device)
-            
-            # 创建源序列padding掩码
-            src_padding_mask = create_padding_mask(src, self.vocab.get_pad_idx()).to(self.device)
-            
-            # 2. 编码源序列
-            memory = self.model.encode(
-                src=src,
-                conditions=conditions,
-                src_key_padding_mask=src_padding_mask
-            )
-            
-            # 创建用于解码的memory掩码（因为在encode中添加了条件向量，所以长度+1）
-            memory_padding_mask = torch.zeros(src_padding_mask.size(0), src_padding_mask.size(1) + 1, 
-                                            dtype=torch.bool, device=self.device)
-            memory_padding_mask[:, 1:] = src_padding_mask  # 第一个位置（条件向量）不掩盖
-            
-            # 3. 贪心解码
-            # 初始化目标序列（只包含SOS标记）
-            tgt = torch.tensor([[self.vocab.get_sos_idx()]], dtype=torch.long).to(self.device)
-            
-            # 生成序列
-            for _ in range(max_length):
-                # 创建因果掩码
-                tgt_len = tgt.size(1)
-                tgt_mask = torch.triu(torch.ones(tgt_len, tgt_len), diagonal=1).bool().to(self.device)
-                
-                # 解码当前序列
-                output = self.model.decode(
-                    tgt=tgt,
-                    memory=memory,
-                    tgt_mask=tgt_mask,
-                    memory_key_padding_mask=memory_padding_mask
-                )
-                
-                # 获取下一个词的概率分布
-                next_token_logits = output[0, -1, :] / temperature
-                probs = F.softmax(next_token_logits, dim=-1)
-                
-                # 贪心选择（选择概率最高的词）
-                next_token = torch.argmax(probs, dim=-1).unsqueeze(0).unsqueeze(0)
-                
-                # 检查是否生成了结束符
-                if next_token.item() == self.vocab.get_eos_idx():
-                    break
-                
-                # 将新token添加到序列中
-                tgt = torch.cat([tgt, next_token], dim=1)
-            
-            # 4. 解码为SMILES字符串
-            predicted_tokens = tgt[0].cpu().tolist()
-            predicted_smiles = self.vocab.decode_indices(predicted_tokens, remove_special_tokens=True)
-            
-            return predicted_smiles
+        if strategy is None and temperature is not None:
+            strategy = SamplingDecoder(temperature=temperature)
+        candidates = self.predict_candidates(
+            reactant_smiles, pH, disinfectant, strategy=strategy, max_length=max_length
+        )
+        return candidates[0][0]
+    
+    def predict_candidates(
+        self,
+        reactant_smiles: str,
+        pH: float,
+        disinfectant: str,
+        strategy: Optional[DecodingStrategy] = None,
+        max_length: int = 100
+    ) -> List[Tuple[str, float]]:
+        """
+        预测多个候选产物（n-best）
+        Args:
+            reactant_smiles: 反应物SMILES字符串
+            pH: 反应pH值
+            disinfectant: 消毒剂类型
+            strategy: 解码策略（如 BeamSearchDecoder），默认贪心解码
+            max_length: 最大生成长度
+        Returns:
+            [(产物SMILES, 对数概率)]，按得分从高到低排序
+        """
+        return self.predict_batch_candidates(
+            [(reactant_smiles, pH, disinfectant)], strategy=strategy, max_length=max_length
+        )[0]
     
     def predict_batch(
         self,
         inputs: List[Tuple[str, float, str]],
-        max_length: int = 100
+        max_length: int = 100,
+        batch_size: int = 64,
+        strategy: Optional[DecodingStrategy] = None,
+        num_workers: Optional[int] = None,
+        threads_per_worker: Optional[int] = None
     ) -> List[str]:
         """
         批量预测多个反应的产物
         Args:
             inputs: 输入列表，每个元素为 (reactant_smiles, pH, disinfectant)
             max_length: 最大生成长度
+            batch_size: 每次送入模型的最大序列数
+            strategy: 解码策略，默认贪心解码
+            num_workers: CPU工作进程数（仅CPU），大于1时启用多进程推理（进程池常驻，用完后调用 close() 关闭）
+            threads_per_worker: 每个工作进程的torch线程数，默认平分CPU核数
         Returns:
-            预测结果列表
+            预测结果列表（与输入顺序一致）
         """
-        results = []
+        candidates = self.predict_batch_candidates(
+            inputs, strategy=strategy, max_length=max_length, batch_size=batch_size,
+            num_workers=num_workers, threads_per_worker=threads_per_worker
+        )
+        return [items[0][0] for items in candidates]
+    
+    def predict_batch_candidates(
+        self,
+        inputs: List[Tuple[str, float, str]],
+        strategy: Optional[DecodingStrategy] = None,
+        max_length: int = 100,
+        batch_size: int = 64,
+        stop_event: Optional[threading.Event] = None,
+        num_workers: Optional[int] = None,
+        threads_per_worker: Optional[int] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        批量预测，每个输入返回多个候选产物
+        Args:
+            inputs: 输入列表，每个元素为 (reactant_smiles, pH, disinfectant)
+            strategy: 解码策略，默认贪心解码
+            max_length: 最大生成长度
+            batch_size: 每次送入模型的最大输入数
+            stop_event: 取消信号，设置后尽快停止解码并抛出 GenerationCancelled
+            num_workers: CPU工作进程数，大于1时按batch_size分片后由常驻进程池并行解码
+            threads_per_worker: 每个工作进程的torch线程数，默认平分CPU核数
+        Returns:
+            每个输入的 [(产物SMILES, 对数概率)] 列表
+        """
+        if strategy is None:
+            strategy = GreedyDecoder()
+        if self.cache is not None:
+            # 模型解码与缓存键使用同一个规范化SMILES，保证缓存结果与直接预测一致
+            inputs = [(canonicalize_smiles(reactant), pH, disinfectant) for reactant, pH, disinfectant in inputs]
+        # 超长输入在运行编码器之前拒绝，不会先浪费max_len步解码
+        self.check_input_lengths(inputs, max_length)
         
-        for reactant_smiles, pH, disinfectant in inputs:
-            predicted_smiles = self.predict_product(
-                reactant_smiles, pH, disinfectant, max_length
+        start_time = time.perf_counter()
+        stats = CallStats(self.device) if self.metrics is not None else None
+        results: List[Optional[List[Tuple[str, float]]]] = [None] * len(inputs)
+        
+        # 先查询缓存，只对未命中的输入运行模型
+        keys = None
+        if self.cache is not None and strategy.deterministic:
+            with stage_timer(stats, 'cache_lookup'):
+                decoding = {**strategy.describe(), 'max_length': max_length}
+                keys = [self.cache.make_key(reactant, pH, disinfectant, decoding, self.model_hash)
+                        for reactant, pH, disinfectant in inputs]
+                for i, key in enumerate(keys):
+                    results[i] = self.cache.get(key)
+        
+        pending = [i for i, result in enumerate(results) if result is None]
+        pending_inputs = [inputs[i] for i in pending]
+        if stats is not None and keys is not None:
+            stats.cache_hits = len(inputs) - len(pending)
+            stats.cache_misses = len(pending)
+        
+        if num_workers is not None and num_workers > 1 and len(pending) > batch_size:
+            predictions = self._decode_with_process_pool(
+                pending_inputs, strategy, max_length, batch_size, num_workers, threads_per_worker, stop_event,
+                stats
             )
-            results.append(predicted_smiles)
+        else:
+            predictions = self._decode_inputs(pending_inputs, strategy, max_length, batch_size, stop_event, stats)
+        
+        for i, candidates in zip(pending, predictions):
+            results[i] = candidates
+            if keys is not None:
+                self.cache.put(keys[i], candidates)
+        
+        if stats is not None:
+            self.metrics.observe(stats, len(inputs), time.perf_counter() - start_time)
+        
+        return results
+    
+    def predict_batch_with_errors(
+        self,
+        inputs: List[Tuple[str, float, str]],
+        strategy: Optional[DecodingStrategy] = None,
+        max_length: int = 100,
+        batch_size: int = 64,
+        num_workers: Optional[int] = None,
+        threads_per_worker: Optional[int] = None
+    ) -> List[Union[List[Tuple[str, float]], ValueError]]:
+        """
+        批量预测，模型拒绝的输入不影响同批次的其他输入
+        先按模型最大长度逐条校验，合法的输入一次批量预测；批量预测仍抛出ValueError时
+        二分定位出错的输入。内存不足、模型损坏等其他异常直接抛出
+        Args:
+            inputs: 输入列表，每个元素为 (reactant_smiles, pH, disinfectant)
+            strategy: 解码策略，默认贪心解码
+            max_length: 最大生成长度（超出模型最大长度时整批抛出ValueError）
+            batch_size: 每次送入模型的最大输入数
+            num_workers: CPU工作进程数（见 predict_batch）
+            threads_per_worker: 每个工作进程的torch线程数
+        Returns:
+            与输入顺序一致，每个元素为 [(产物SMILES, 对数概率)] 候选列表，或该输入的ValueError
+        """
+        self.check_input_lengths([], max_length)
+        
+        results: List[Optional[Union[List[Tuple[str, float]], ValueError]]] = [None] * len(inputs)
+        valid = []
+        for i, item in enumerate(inputs):
+            try:
+                self.check_input_lengths([item], max_length)
+                valid.append(i)
+            except ValueError as e:
+                results[i] = e
+        
+        def predict(indices: List[int]) -> None:
+            if not indices:
+                return
+            try:
+                candidates = self.predict_batch_candidates(
+                    [inputs[i] for i in indices], strategy=strategy, max_length=max_length,
+                    batch_size=batch_size, num_workers=num_workers, threads_per_worker=threads_per_worker
+                )
+            except ValueError as e:
+                if len(indices) == 1:
+                    results[indices[0]] = e
+                    return
+                middle = len(indices) // 2
+                predict(indices[:middle])
+                predict(indices[middle:])
+                return
+            for i, items in zip(indices, candidates):
+                results[i] = items
         
+        predict(valid)
         return results
     
+    def predict_sweep(
+        self,
+        reactant_smiles: str,
+        pH_grid: Sequence[float],
+        disinfectants: Sequence[str] = ('chlorine', 'chloramine', 'ozone'),
+        max_length: int = 100,
+        strategy: Optional[DecodingStrategy] = None
+    ):
+        """
+        扫描pH和消毒剂的所有组合，整个网格一次批量编码和解码
+        Args:
+            reactant_smiles: 反应物SMILES字符串
+            pH_grid: pH取值列表
+            disinfectants: 消毒剂类型列表
+            max_length: 最大生成长度
+            strategy: 解码策略，默认贪心解码
+        Returns:
+            pandas.DataFrame，每行一个 (条件, 候选产物)，
+            列为 reactant_smiles、pH、disinfectant、rank、product_smiles、log_prob
+        """
+        import pandas as pd
+        
+        inputs = [(reactant_smiles, float(pH), disinfectant) for disinfectant in disinfectants for pH in pH_grid]
+        candidates = self.predict_batch_candidates(
+            inputs, strategy=strategy, max_length=max_length, batch_size=max(len(inputs), 1)
+        )
+        
+        rows = [
+            {
+                'reactant_smiles': reactant,
+                'pH': pH,
+                'disinfectant': disinfectant,
+                'rank': rank,
+                'product_smiles': smiles,
+                'log_prob': score
+            }
+            for (reactant, pH, disinfectant), items in zip(inputs, candidates)
+            for rank, (smiles, score) in enumerate(items, start=1)
+        ]
+        return pd.DataFrame(rows, columns=['reactant_smiles', 'pH', 'disinfectant', 'rank', 'product_smiles', 'log_prob'])
+    
+    def _decode_inputs(
+        self,
+        inputs: List[Tuple[str, float, str]],
+        strategy: DecodingStrategy,
+        max_length: int,
+        batch_size: int,
+        stop_event: Optional[threading.Event] = None,
+        stats: Optional[CallStats] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """在当前进程中分批编码并解码（不经过缓存）"""
+        results = []
+        with torch.no_grad():
+            for start in range(0, len(inputs), batch_size):
+                memory, memory_padding_mask = self._encode_batch(inputs[start:start + batch_size], stats)
+                with stage_timer(stats, 'decode'):
+                    hypotheses = strategy.decode(
+                        self.model, memory, memory_padding_mask,
+                        sos_idx=self.vocab.get_sos_idx(),
+                        eos_idx=self.vocab.get_eos_idx(),
+                        max_length=max_length,
+                        stop_event=stop_event
+                    )
+                with stage_timer(stats, 'detokenize'):
+                    for items in hypotheses:
+                        products = self.vocab.decode_batch([token_ids for token_ids, _ in items])
+                        results.append([(smiles, score) for smiles, (_, score) in zip(products, items)])
+                if stats is not None:
+                    stats.record_hypotheses(hypotheses, max_length)
+        return results
+    
+    def _decode_with_process_pool(
+        self,
+        inputs: List[Tuple[str, float, str]],
+        strategy: DecodingStrategy,
+        max_length: int,
+        batch_size: int,
+        num_workers: int,
+        threads_per_worker: Optional[int] = None,
+        stop_event: Optional[threading.Event] = None,
+        stats: Optional[CallStats] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        用常驻的多进程池分片解码，结果与输入顺序一致
+        进程池以spawn方式创建：父进程运行过多线程推理后，fork出的子进程会继承失效的
+        OpenMP线程池状态，在子进程中设置多线程后死锁；
+        提供 stats 时合并各分片的统计（阶段耗时为各进程耗时之和）
+        """
+        if self.device.type != 'cpu':
+            raise ValueError("多进程推理仅支持CPU设备")
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+        
+        pool = self._get_pool(num_workers, threads_per_worker)
+        shards = [inputs[start:start + batch_size] for start in range(0, len(inputs), batch_size)]
+        results = []
+        # imap按提交顺序返回结果，各分片由空闲进程动态领取；
+        # 取消时不再等待剩余分片（进程池是常驻的，已提交的分片在后台完成后丢弃）
+        for shard_results, shard_stats in pool.imap(
+            _decode_shard, [(shard, strategy, max_length, stats is not None) for shard in shards]
+        ):
+            if stop_event is not None and stop_event.is_set():
+                raise GenerationCancelled()
+            results.extend(shard_results)
+            if stats is not None:
+                stats.merge(shard_stats)
+        return results
+    
+    def _get_pool(self, num_workers: int, threads_per_worker: int):
+        """获取常驻进程池，进程数或线程数变化时重建"""
+        with self._pool_lock:
+            if self._pool is not None and self._pool_config == (num_workers, threads_per_worker):
+                return self._pool
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+            if self.backend == 'eager' and not self.quantized:
+                # 权重移到共享内存，各工作进程共用一份
+                self.model.share_memory()
+            # torch.multiprocessing 的spawn上下文通过共享内存句柄传递张量
+            context = mp.get_context('spawn')
+            self._pool = context.Pool(
+                processes=num_workers,
+                initializer=_init_pool_worker,
+                initargs=(self, threads_per_worker)
+            )
+            self._pool_config = (num_workers, threads_per_worker)
+            return self._pool
+    
     def evaluate_on_examples(self):
         """在示例数据上评估模型性能"""
         # 一些测试例子
@@ -0,0 +1,100 @@
+"""
+数据预处理脚本 - 将反应数据一次性编码为扁平NumPy数组
+训练时通过内存映射读取，避免每个epoch重复的Python分词和JSON解析
+"""
+import argparse
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from utils import TOKENIZERS, SMILESVocabulary, encode_conditions, load_vocab, save_vocab
+
+# 预处理目录中的文件名
+SRC_TOKENS_FILE = "src_tokens.npy"
+SRC_OFFSETS_FILE = "src_offsets.npy"
+TGT_TOKENS_FILE = "tgt_tokens.npy"
+TGT_OFFSETS_FILE = "tgt_offsets.npy"
+CONDITIONS_FILE = "conditions.npy"
+VOCAB_FILE = "vocabulary.json"
+META_FILE = "meta.json"
+
+
+def _flatten(sequences):
+    """将索引序列列表拼接为扁平数组，并返回偏移量（第i条为 tokens[offsets[i]:offsets[i+1]]）"""
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(seq) for seq in sequences])
+    tokens = np.fromiter((idx for seq in sequences for idx in seq), dtype=np.int32, count=int(offsets[-1]))
+    return tokens, offsets
+
+
+def preprocess_data(
+    data_path: str,
+    output_dir: str,
+    vocab_path: Optional[str] = None,
+    tokenizer: str = 'char'
+) -> None:
+    """
+    编码数据集并写入预处理目录
+    Args:
+        data_path: JSON数据文件路径
+        output_dir: 输出目录
+        vocab_path: 已有词汇表路径（不提供时从数据构建）
+        tokenizer: 构建词汇表时的分词方式（'char' 或 'atom'）
+    """
+    with open(data_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    print(f"加载了 {len(data)} 条反应数据")
+
+    # 词汇表与token索引一一对应，需要随数据一起保存
+    if vocab_path is not None:
+        vocab = load_vocab(vocab_path)
+    else:
+        vocab = SMILESVocabulary(tokenizer=tokenizer)
+        vocab.build_vocab_from_data(data)
+
+    os.makedirs(output_dir, exist_ok=True)
+    save_vocab(vocab, os.path.join(output_dir, VOCAB_FILE))
+
+    src_tokens, src_offsets = _flatten(
+        [vocab.encode_smiles(item['reactant_smiles'], add_special_tokens=True) for item in data]
+    )
+    tgt_tokens, tgt_offsets = _flatten(
+        [vocab.encode_smiles(item['product_smiles'], add_special_tokens=True) for item in data]
+    )
+    conditions = np.array(
+        [encode_conditions(item['pH'], item['disinfectant']) for item in data], dtype=np.float32
+    ).reshape(len(data), -1)
+
+    np.save(os.path.join(output_dir, SRC_TOKENS_FILE), src_tokens)
+    np.save(os.path.join(output_dir, SRC_OFFSETS_FILE), src_offsets)
+    np.save(os.path.join(output_dir, TGT_TOKENS_FILE), tgt_tokens)
+    np.save(os.path.join(output_dir, TGT_OFFSETS_FILE), tgt_offsets)
+    np.save(os.path.join(output_dir, CONDITIONS_FILE), conditions)
+
+    with open(os.path.join(output_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            'num_examples': len(data),
+            'source': os.path.abspath(data_path),
+            'vocab_size': vocab.vocab_size,
+            'tokenizer': vocab.tokenizer
+        }, f, ensure_ascii=False, indent=2)
+
+    print(f"预处理数据已保存到: {output_dir}")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="将反应数据预处理为内存映射格式")
+    parser.add_argument("--data", default="data/sample_data.json", help="JSON数据文件路径")
+    parser.add_argument("--output", default="data/preprocessed", help="输出目录")
+    parser.add_argument("--vocab", default=None, help="已有词汇表路径（默认从数据构建）")
+    parser.add_argument("--tokenizer", default="char", choices=TOKENIZERS, help="构建词汇表时的分词方式")
+    args = parser.parse_args()
+
+    preprocess_data(args.data, args.output, args.vocab, args.tokenizer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+量化导出脚本 - 导出动态int8量化的 ReactionTransformer 推理模型
+并在留出数据集上与fp32模型对比准确率、一致率、速度和文件大小
+"""
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import torch
+
+from model import ReactionTransformer, load_checkpoint, quantize_dynamic_model
+from predict import ReactionPredictor
+
+
+def export_quantized_model(model_path: str, output_path: str) -> None:
+    """
+    将fp32 checkpoint导出为动态int8量化checkpoint
+    Args:
+        model_path: train.py 保存的fp32模型路径
+        output_path: 量化模型保存路径
+    """
+    checkpoint = load_checkpoint(model_path)
+
+    model = ReactionTransformer(vocab_size=checkpoint['vocab_size'], **checkpoint['model_config'])
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model.eval()
+
+    quantized_model = quantize_dynamic_model(model)
+
+    # 保留原checkpoint的元数据，替换权重并标记量化方式
+    quantized_checkpoint = dict(checkpoint)
+    quantized_checkpoint['model_state_dict'] = quantized_model.state_dict()
+    quantized_checkpoint['quantization'] = 'dynamic_int8'
+    torch.save(quantized_checkpoint, output_path)
+
+    print(f"量化模型已保存到: {output_path}")
+
+
+def _evaluate(predictor: ReactionPredictor, data: List[Dict], max_length: int, batch_size: int):
+    """批量预测并返回 (预测结果, 每条样本平均耗时ms)"""
+    inputs = [(item['reactant_smiles'], item['pH'], item['disinfectant']) for item in data]
+
+    start_time = time.perf_counter()
+    predictions = predictor.predict_batch(inputs, max_length=max_length, batch_size=batch_size)
+    elapsed = time.perf_counter() - start_time
+
+    return predictions, elapsed * 1000 / max(len(data), 1)
+
+
+def compare_models(
+    model_path: str,
+    quantized_path: str,
+    vocab_path: str,
+    data_path: str,
+    max_length: int = 100,
+    batch_size: int = 64,
+    report_path: Optional[str] = None
+) -> Dict:
+    """
+    在留出数据集上对比fp32与int8量化模型
+    Args:
+        model_path: fp32模型路径
+        quantized_path: 量化模型路径
+        vocab_path: 词汇表路径
+        data_path: 留出数据集（与训练数据相同的JSON格式）
+        max_length: 最大生成长度
+        batch_size: 批量预测大小
+        report_path: 报告保存路径（JSON），不提供时只返回结果
+    Returns:
+        对比报告字典
+    """
+    with open(data_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    fp32_predictor = ReactionPredictor(model_path, vocab_path, device='cpu', precision='fp32')
+    int8_predictor = ReactionPredictor(quantized_path, vocab_path, device='cpu')
+
+    fp32_predictions, fp32_latency = _evaluate(fp32_predictor, data, max_length, batch_size)
+    int8_predictions, int8_latency = _evaluate(int8_predictor, data, max_length, batch_size)
+
+    targets = [item['product_smiles'] for item in data]
+    num_examples = max(len(data), 1)
+
+    report = {
+        'num_examples': len(data),
+        'fp32': {
+            'exact_match': sum(p == t for p, t in zip(fp32_predictions, targets)) / num_examples,
+            'latency_ms_per_example': fp32_latency,
+            'file_size_mb': os.path.getsize(model_path) / 1024 ** 2
+        },
+        'int8': {
+            'exact_match': sum(p == t for p, t in zip(int8_predictions, targets)) / num_examples,
+            'latency_ms_per_example': int8_latency,
+            'file_size_mb': os.path.getsize(quantized_path) / 1024 ** 2
+        },
+        # 量化模型与fp32模型输出完全一致的比例
+        'agreement': sum(a == b for a, b in zip(fp32_predictions, int8_predictions)) / num_examples
+    }
+
+    print("\n" + "=" * 60)
+    print("fp32 vs int8 动态量化对比")
+    print("=" * 60)
+    print(f"样本数: {report['num_examples']}")
+    for name in ('fp32', 'int8'):
+        stats = report[name]
+        print(f"{name}: 准确率 {stats['exact_match']:.2%}, "
+              f"平均耗时 {stats['latency_ms_per_example']:.1f}ms/条, "
+              f"文件大小 {stats['file_size_mb']:.1f}MB")
+    print(f"预测一致率: {report['agreement']:.2%}")
+
+    if report_path is not None:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"对比报告已保存到: {report_path}")
+
+    return report
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="导出动态int8量化模型并与fp32模型对比")
+    parser.add_argument("--model", default="transformer_model.pth", help="fp32模型路径")
+    parser.add_argument("--vocab", default="vocabulary.json", help="词汇表路径")
+    parser.add_argument("--output", default="transformer_model_int8.pth", help="量化模型保存路径")
+    parser.add_argument("--eval-data", default=None, help="留出数据集路径（提供时生成对比报告）")
+    parser.add_argument("--report", default="quantization_report.json", help="对比报告保存路径")
+    parser.add_argument("--max-length", type=int, default=100, help="最大生成长度")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"错误: 模型文件 {args.model} 不存在!")
+        print("请先运行 train.py 训练模型。")
+        return
+
+    export_quantized_model(args.model, args.output)
+
+    if args.eval_data is not None:
+        compare_models(
+            args.model, args.output, args.vocab, args.eval_data,
+            max_length=args.max_length, report_path=args.report
+        )
+
+
+if __name__ == "__main__":
+    main()
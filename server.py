@@ -0,0 +1,397 @@
+"""
+推理服务 - 基于 ReactionPredictor 的HTTP/JSON预测服务
+并发请求进入队列后按最大批量和最长等待时间动态合并为微批次，每个批次只运行一次编码和解码
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from decoding import DecodingStrategy, get_decoding_strategy
+from inference_metrics import PredictorMetrics
+from predict import ReactionPredictor
+
+VALID_DISINFECTANTS = ('chlorine', 'chloramine', 'ozone')
+
+# 请求体来自不可信的客户端，限制单个请求的计算量
+MAX_INPUTS_PER_REQUEST = 256
+MAX_CANDIDATES = 20
+MAX_LENGTH = 200
+
+
+class BatcherBusyError(Exception):
+    """批处理队列已满"""
+
+
+class _PendingRequest:
+    """队列中等待处理的单条预测请求"""
+
+    def __init__(self, item: Tuple[str, float, str], strategy: DecodingStrategy, max_length: int):
+        self.item = item
+        self.strategy = strategy
+        self.max_length = max_length
+        self.future: Future = Future()
+        # 解码参数相同的请求才能合并到同一批次
+        self.group_key = json.dumps({**strategy.describe(), 'max_length': max_length}, sort_keys=True, default=str)
+
+
+class DynamicBatcher:
+    """动态批处理器：后台线程从队列中收集请求，凑满max_batch_size或等待max_wait_ms后统一预测"""
+
+    def __init__(
+        self,
+        predictor: ReactionPredictor,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10.0,
+        max_queue_size: int = 1024
+    ):
+        """
+        初始化批处理器
+        Args:
+            predictor: 预测器
+            max_batch_size: 每个微批次的最大请求数
+            max_wait_ms: 收到第一条请求后最多等待多少毫秒再开始预测
+            max_queue_size: 队列中最多等待的输入数，超出后拒绝新请求
+        """
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+
+        self._queue: "queue.Queue[_PendingRequest]" = queue.Queue(maxsize=max_queue_size)
+        # 多条输入的请求要么全部入队，要么全部拒绝
+        self._submit_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="dynamic-batcher", daemon=True)
+
+        # 统计信息
+        self._stats_lock = threading.Lock()
+        self.num_requests = 0
+        self.num_batches = 0
+
+    def start(self) -> None:
+        """启动后台批处理线程"""
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台批处理线程"""
+        self._stop_event.set()
+        self._thread.join()
+
+    def submit(self, item: Tuple[str, float, str], strategy: DecodingStrategy, max_length: int = 100) -> Future:
+        """
+        提交一条预测请求
+        Args:
+            item: (reactant_smiles, pH, disinfectant)
+            strategy: 解码策略
+            max_length: 最大生成长度
+        Returns:
+            Future，结果为 [(产物SMILES, 对数概率)] 候选列表
+        """
+        return self.submit_many([item], strategy, max_length)[0]
+
+    def submit_many(
+        self,
+        items: List[Tuple[str, float, str]],
+        strategy: DecodingStrategy,
+        max_length: int = 100
+    ) -> List[Future]:
+        """
+        提交同一请求中的多条输入，队列剩余容量不足时整体拒绝
+        Args:
+            items: 输入列表，每个元素为 (reactant_smiles, pH, disinfectant)
+            strategy: 解码策略
+            max_length: 最大生成长度
+        Returns:
+            与输入顺序一致的Future列表；超时后可以取消，尚未开始预测的输入会被跳过
+        """
+        requests = [_PendingRequest(item, strategy, max_length) for item in items]
+        with self._submit_lock:
+            # 后台线程只会从队列中取出请求，检查后剩余容量不会减少
+            if self._queue.qsize() + len(requests) > self.max_queue_size:
+                raise BatcherBusyError(f"排队中的输入已达上限 {self.max_queue_size}")
+            for request in requests:
+                self._queue.put_nowait(request)
+        return [request.future for request in requests]
+
+    def stats(self) -> Dict[str, float]:
+        """获取批处理统计"""
+        with self._stats_lock:
+            return {
+                'requests': self.num_requests,
+                'batches': self.num_batches,
+                'mean_batch_size': self.num_requests / self.num_batches if self.num_batches else 0.0,
+                'queue_size': self._queue.qsize()
+            }
+
+    def _collect_batch(self) -> List[_PendingRequest]:
+        """阻塞等待第一条请求，然后在等待窗口内尽量收集更多请求"""
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self) -> None:
+        """后台线程主循环"""
+        while not self._stop_event.is_set():
+            batch = self._collect_batch()
+            if not batch:
+                continue
+
+            # 按解码参数分组，每组一次批量预测；跳过已超时取消的请求
+            groups: Dict[str, List[_PendingRequest]] = {}
+            for request in batch:
+                if not request.future.set_running_or_notify_cancel():
+                    continue
+                groups.setdefault(request.group_key, []).append(request)
+
+            for requests in groups.values():
+                self._predict_group(requests)
+
+    def _predict_group(self, requests: List[_PendingRequest]) -> None:
+        """批量预测一组请求；模型拒绝的输入只让对应请求失败，不影响同批次的其他客户端"""
+        try:
+            results = self.predictor.predict_batch_with_errors(
+                [request.item for request in requests],
+                strategy=requests[0].strategy,
+                max_length=requests[0].max_length,
+                batch_size=self.max_batch_size
+            )
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            self._record_batch(len(requests))
+            return
+
+        for request, result in zip(requests, results):
+            if isinstance(result, ValueError):
+                request.future.set_exception(result)
+            else:
+                request.future.set_result(result)
+        self._record_batch(len(requests))
+
+    def _record_batch(self, num_requests: int) -> None:
+        with self._stats_lock:
+            self.num_requests += num_requests
+            self.num_batches += 1
+
+
+def parse_request(
+    payload: Dict,
+    predictor: Optional[ReactionPredictor] = None
+) -> Tuple[List[Tuple[str, float, str]], DecodingStrategy, int]:
+    """
+    解析并校验请求体
+    Args:
+        payload: 单条 {"reactant_smiles", "pH", "disinfectant"} 或 {"inputs": [...]}，
+                 可选 "strategy"（greedy/beam/top_k/top_p）、"num_candidates"、"temperature"、"max_length"
+        predictor: 预测器（可选），提供时按模型最大长度检查反应物长度和 max_length
+    Returns:
+        (输入列表, 解码策略, 最大生成长度)
+    """
+    entries = payload['inputs'] if 'inputs' in payload else [payload]
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("inputs必须是非空列表")
+    if len(entries) > MAX_INPUTS_PER_REQUEST:
+        raise ValueError(f"单个请求最多包含 {MAX_INPUTS_PER_REQUEST} 条输入")
+
+    items = []
+    for entry in entries:
+        reactant = str(entry['reactant_smiles']).strip()
+        pH = float(entry['pH'])
+        disinfectant = entry['disinfectant']
+        if not reactant:
+            raise ValueError("reactant_smiles不能为空")
+        if disinfectant not in VALID_DISINFECTANTS:
+            raise ValueError(f"消毒剂类型必须是 {', '.join(VALID_DISINFECTANTS)} 之一")
+        items.append((reactant, pH, disinfectant))
+
+    name = payload.get('strategy', 'greedy')
+    num_candidates = int(payload.get('num_candidates', 5))
+    if not 1 <= num_candidates <= MAX_CANDIDATES:
+        raise ValueError(f"num_candidates必须在 1 到 {MAX_CANDIDATES} 之间")
+    if name == 'beam':
+        strategy = get_decoding_strategy('beam', beam_size=num_candidates)
+    elif name == 'top_k':
+        strategy = get_decoding_strategy('top_k', num_samples=num_candidates,
+                                         temperature=float(payload.get('temperature', 1.0)),
+                                         top_k=int(payload.get('top_k', 10)))
+    elif name == 'top_p':
+        strategy = get_decoding_strategy('top_p', num_samples=num_candidates,
+                                         temperature=float(payload.get('temperature', 1.0)),
+                                         top_p=float(payload.get('top_p', 0.9)))
+    else:
+        strategy = get_decoding_strategy(name)
+
+    max_length = int(payload.get('max_length', 100))
+    if not 1 <= max_length <= MAX_LENGTH:
+        raise ValueError(f"max_length必须在 1 到 {MAX_LENGTH} 之间")
+    if predictor is not None:
+        predictor.check_input_lengths(items, max_length)
+
+    return items, strategy, max_length
+
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    """HTTP请求处理：POST /predict，GET /health，GET /stats，GET /metrics"""
+
+    server_version = "ReactionPredictorServer/1.0"
+
+    def _send_json(self, status: int, body: Dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self._send_json(200, self.server.batcher.stats())
+        elif self.path == '/metrics' and self.server.batcher.predictor.metrics is not None:
+            data = self.server.batcher.predictor.metrics.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {'error': f"未知路径: {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': f"未知路径: {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            items, strategy, max_length = parse_request(payload, self.server.batcher.predictor)
+        except (KeyError, TypeError, ValueError) as e:
+            self._send_json(400, {'error': f"请求格式错误: {e}"})
+            return
+
+        try:
+            futures = self.server.batcher.submit_many(items, strategy, max_length)
+        except BatcherBusyError as e:
+            self._send_json(503, {'error': f"服务繁忙，请稍后重试: {e}"})
+            return
+
+        # 整个请求共用一个截止时间，多条输入的总等待时间不超过 request_timeout
+        deadline = time.monotonic() + self.server.request_timeout
+        try:
+            results = [future.result(timeout=max(0.0, deadline - time.monotonic())) for future in futures]
+        except Exception as e:
+            for future in futures:
+                future.cancel()
+            self._send_json(500, {'error': f"预测出错: {e}"})
+            return
+
+        predictions = [
+            {
+                'reactant_smiles': reactant,
+                'pH': pH,
+                'disinfectant': disinfectant,
+                'product_smiles': candidates[0][0],
+                'candidates': [{'smiles': smiles, 'log_prob': score} for smiles, score in candidates]
+            }
+            for (reactant, pH, disinfectant), candidates in zip(items, results)
+        ]
+        self._send_json(200, {'predictions': predictions})
+
+    def log_message(self, format, *args):
+        # 高并发下逐条打印访问日志开销较大，默认关闭
+        pass
+
+
+def create_server(
+    predictor: ReactionPredictor,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    max_batch_size: int = 32,
+    max_wait_ms: float = 10.0,
+    request_timeout: float = 60.0,
+    max_queue_size: int = 1024
+) -> ThreadingHTTPServer:
+    """
+    创建（未启动的）推理服务
+    Args:
+        predictor: 预测器
+        host: 监听地址
+        port: 监听端口（0表示随机可用端口）
+        max_batch_size: 每个微批次的最大请求数
+        max_wait_ms: 合并请求的最长等待时间（毫秒）
+        request_timeout: 单个请求等待结果的超时时间（秒）
+        max_queue_size: 队列中最多等待的输入数，超出后返回503
+    Returns:
+        HTTP服务对象，batcher 属性为已启动的动态批处理器
+    """
+    server = ThreadingHTTPServer((host, port), PredictionRequestHandler)
+    server.daemon_threads = True
+    server.batcher = DynamicBatcher(
+        predictor, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, max_queue_size=max_queue_size
+    )
+    server.request_timeout = request_timeout
+    server.batcher.start()
+    return server
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="ReactionTransformer 动态批处理推理服务")
+    parser.add_argument("--model", default="transformer_model.pth", help="模型路径")
+    parser.add_argument("--vocab", default="vocabulary.json", help="词汇表路径")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="每个微批次的最大请求数")
+    parser.add_argument("--max-wait-ms", type=float, default=10.0, help="合并请求的最长等待时间（毫秒）")
+    parser.add_argument("--max-queue-size", type=int, default=1024, help="队列中最多等待的输入数，超出后返回503")
+    parser.add_argument("--device", default=None, help="计算设备")
+    parser.add_argument("--precision", default=None, help="推理精度（fp32/bf16）")
+    parser.add_argument("--quantized", action="store_true", help="使用动态int8量化模型")
+    parser.add_argument("--backend", default="eager", choices=["eager", "torchscript"],
+                        help="推理后端（torchscript需要 torchscript_export.py 导出的模型文件）")
+    parser.add_argument("--fast-path", action="store_true",
+                        help="batch优先布局的编码器快速路径（融合注意力+嵌套张量，仅eager后端）")
+    args = parser.parse_args()
+
+    predictor = ReactionPredictor(
+        args.model, args.vocab, device=args.device, precision=args.precision, quantized=args.quantized,
+        backend=args.backend, metrics=PredictorMetrics(), fast_path=args.fast_path
+    )
+    server = create_server(
+        predictor, args.host, args.port,
+        max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms, max_queue_size=args.max_queue_size
+    )
+
+    print(f"推理服务已启动: http://{args.host}:{server.server_address[1]}/predict")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.stop()
+        print("\n推理服务已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,840 @@
+#!/usr/bin/env python3
+"""
+推理路径测试
+使用随机初始化的小模型验证增量解码等推理优化与原始实现一致
+"""
+
+import asyncio
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pandas as pd
+import pytest
+import torch
+
+from async_predict import AsyncReactionPredictor, PredictorBusyError
+from batch_predict import run_batch_prediction
+from decoding import BeamSearchDecoder, GenerationCancelled, SamplingDecoder, top_k_filter, top_p_filter
+from inference_benchmark import compare_reports, run_benchmark
+from inference_metrics import STAGES, PredictorMetrics
+from model import ReactionTransformer
+import predict
+from predict import EncoderCache, PredictionCache, ReactionPredictor
+from load_test import run_load_test
+from quantize import compare_models, export_quantized_model
+from server import BatcherBusyError, DynamicBatcher, create_server, parse_request
+from torchscript_export import export_torchscript
+from utils import SMILESVocabulary, create_causal_mask, encode_conditions, save_vocab
+
+SMALL_CONFIG = {
+    'd_model': 32,
+    'nhead': 4,
+    'num_encoder_layers': 2,
+    'num_decoder_layers': 2,
+    'dim_feedforward': 64,
+    'dropout': 0.1,
+    'condition_dim': 4,
+    'max_len': 200
+}
+
+
+def build_predictor(tmp_path, seed=0):
+    """在临时目录中保存随机权重的小模型和词汇表，并创建预测器"""
+    with open("data/sample_data.json", "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    vocab = SMILESVocabulary()
+    vocab.build_vocab_from_data(data)
+    vocab_path = str(tmp_path / "vocabulary.json")
+    save_vocab(vocab, vocab_path)
+
+    torch.manual_seed(seed)
+    model = ReactionTransformer(vocab_size=vocab.vocab_size, **SMALL_CONFIG)
+    model_path = str(tmp_path / "transformer_model.pth")
+    torch.save({
+        'model_state_dict': model.state_dict(),
+        'vocab_size': vocab.vocab_size,
+        'model_config': SMALL_CONFIG
+    }, model_path)
+
+    return ReactionPredictor(model_path, vocab_path, device="cpu")
+
+
+def test_decode_step_matches_full_decode():
+    """增量解码的每一步输出应与完整前缀解码一致"""
+    torch.manual_seed(0)
+    model = ReactionTransformer(vocab_size=20, **SMALL_CONFIG).eval()
+
+    src = torch.randint(4, 20, (3, 7))
+    src[0, 5:] = 0
+    src_padding_mask = src == 0
+    conditions = torch.rand(3, 4)
+    tgt = torch.randint(4, 20, (3, 6))
+
+    with torch.no_grad():
+        memory = model.encode(src, conditions, src_key_padding_mask=src_padding_mask)
+        memory_padding_mask = torch.cat(
+            [torch.zeros(3, 1, dtype=torch.bool), src_padding_mask], dim=1
+        )
+        full = model.decode(
+            tgt, memory,
+            tgt_mask=create_causal_mask(tgt.size(1)),
+            memory_key_padding_mask=memory_padding_mask
+        )
+
+        cache = model.init_decoder_cache(memory, memory_padding_mask)
+        steps = [model.decode_step(tgt[:, i], cache) for i in range(tgt.size(1))]
+
+    assert torch.allclose(torch.stack(steps, dim=1), full, atol=1e-5)
+
+
+def test_preallocated_masks_and_length_guards():
+    """因果掩码和位置编码取自预分配buffer的视图，超出max_len（含条件向量）时给出明确错误"""
+    model = ReactionTransformer(vocab_size=20, **{**SMALL_CONFIG, 'max_len': 10})
+    model.eval()
+
+    mask = model.causal_mask(6)
+    assert torch.equal(mask, create_causal_mask(6))
+    assert mask.data_ptr() == model.causal_mask_buffer.data_ptr()
+    # 掩码不保存到checkpoint，旧checkpoint的权重键保持不变
+    assert 'causal_mask_buffer' not in model.state_dict()
+
+    src = torch.randint(4, 20, (2, 9))
+    conditions = torch.rand(2, 4)
+    memory = model.encode(src, conditions)
+    with pytest.raises(ValueError, match="条件向量"):
+        model.encode(torch.randint(4, 20, (2, 10)), conditions)
+    with pytest.raises(ValueError, match="超出模型最大长度"):
+        model.causal_mask(11)
+
+    cache = model.init_decoder_cache(memory)
+    tokens = torch.full((2,), 1, dtype=torch.long)
+    with torch.no_grad():
+        for _ in range(10):
+            model.decode_step(tokens, cache)
+        with pytest.raises(ValueError, match="位置编码"):
+            model.decode_step(tokens, cache)
+
+
+def test_predictor_rejects_over_length_inputs_before_encoding(tmp_path):
+    """max_length 或反应物长度超出模型max_len时在运行编码器之前抛出ValueError"""
+    predictor = build_predictor(tmp_path)
+    max_len = predictor.model.max_len
+    encode_calls = []
+    original_encode = predictor._encode_batch
+    predictor._encode_batch = lambda *args, **kwargs: encode_calls.append(1) or original_encode(*args, **kwargs)
+
+    with pytest.raises(ValueError, match="最大生成长度"):
+        predictor.predict_product("CCO", 7.0, "chlorine", max_length=max_len + 1)
+    with pytest.raises(ValueError, match="条件向量"):
+        predictor.predict_batch_candidates([("CCO", 7.0, "chlorine"), ("C" * (max_len - 2), 7.0, "ozone")])
+    assert encode_calls == []
+
+    # 恰好用满max_len的输入可以正常预测
+    assert isinstance(predictor.predict_product("C" * (max_len - 3), 7.0, "chlorine", max_length=5), str)
+
+
+def test_predict_batch_with_errors_isolates_rejected_inputs(tmp_path):
+    """超长输入预先剔除；批量预测时仍被拒绝的输入通过二分定位，其余输入照常返回"""
+    predictor = build_predictor(tmp_path, seed=5)
+    inputs = [("CCO", 7.0, "chlorine"), ("C" * 250, 7.0, "ozone"), ("c1ccccc1", 6.5, "ozone"),
+              ("CCN", 7.0, "chlorine"), ("CC(=O)O", 8.0, "chloramine")]
+    expected = predictor.predict_batch_candidates([inputs[i] for i in (0, 2, 4)], max_length=20)
+
+    predict_batch_candidates = predictor.predict_batch_candidates
+    calls = []
+
+    def rejecting(batch, **kwargs):
+        calls.append(len(batch))
+        if any(reactant == "CCN" for reactant, _, _ in batch):
+            raise ValueError("不支持的反应物")
+        return predict_batch_candidates(batch, **kwargs)
+
+    predictor.predict_batch_candidates = rejecting
+    results = predictor.predict_batch_with_errors(inputs, max_length=20)
+    assert isinstance(results[1], ValueError) and isinstance(results[3], ValueError)
+    assert [results[i] for i in (0, 2, 4)] == expected
+    # 4条合法输入：整批失败后二分为 [2, 2]，再将出错的一半拆为 [1, 1]
+    assert calls == [4, 2, 2, 1, 1]
+    with pytest.raises(ValueError, match="最大生成长度"):
+        predictor.predict_batch_with_errors(inputs, max_length=1000)
+
+
+def test_predict_product_returns_smiles(tmp_path):
+    """预测器应返回只包含词汇表字符的字符串"""
+    predictor = build_predictor(tmp_path)
+    predicted = predictor.predict_product("CCO", 7.0, "chlorine", max_length=20)
+
+    assert isinstance(predicted, str)
+    assert len(predicted) <= 20
+    assert all(char in predictor.vocab.char_to_idx for char in predicted)
+
+    # 未指定解码策略时，不给temperature为贪心解码，给定任意温度（包括1.0）都使用温度采样
+    greedy = predictor.predict_candidates("CCO", 7.0, "chlorine", max_length=20)[0][0]
+    assert predictor.predict_product("CCO", 7.0, "chlorine", max_length=20) == greedy
+    for temperature in (0.7, 1.0):
+        torch.manual_seed(3)
+        sampled = predictor.predict_product("CCO", 7.0, "chlorine", max_length=20, temperature=temperature)
+        torch.manual_seed(3)
+        assert sampled == predictor.predict_candidates(
+            "CCO", 7.0, "chlorine", max_length=20, strategy=SamplingDecoder(temperature=temperature)
+        )[0][0]
+    with pytest.raises(ValueError, match="temperature"):
+        predictor.predict_product("CCO", 7.0, "chlorine", max_length=20, temperature=0.0)
+
+
+def reference_greedy(predictor, reactant, pH, disinfectant, max_length):
+    """不使用缓存、逐条解码的参考实现"""
+    vocab = predictor.vocab
+    model = predictor.model
+    src = torch.tensor([vocab.encode_smiles(reactant)], dtype=torch.long)
+    conditions = torch.tensor([encode_conditions(pH, disinfectant)], dtype=torch.float32)
+
+    with torch.no_grad():
+        memory = model.encode(src, conditions)
+        tgt = torch.tensor([[vocab.get_sos_idx()]], dtype=torch.long)
+        for _ in range(max_length):
+            output = model.decode(tgt, memory, tgt_mask=create_causal_mask(tgt.size(1)))
+            next_token = output[:, -1, :].argmax(dim=-1, keepdim=True)
+            if next_token.item() == vocab.get_eos_idx():
+                break
+            tgt = torch.cat([tgt, next_token], dim=1)
+
+    return vocab.decode_indices(tgt[0].tolist())
+
+
+def test_predict_batch_matches_sequential_decode(tmp_path):
+    """批量解码（含padding与提前结束）应与逐条解码结果一致"""
+    predictor = build_predictor(tmp_path, seed=5)
+    inputs = [
+        ("CCO", 7.0, "chlorine"),
+        ("c1ccc(cc1)O", 6.5, "chlorine"),
+        ("CC(C)O", 7.5, "chloramine"),
+        ("Nc1ccccc1", 6.0, "ozone"),
+        ("CC(=O)O", 8.0, "ozone")
+    ]
+
+    expected = [reference_greedy(predictor, *item, max_length=30) for item in inputs]
+
+    assert predictor.predict_batch(inputs, max_length=30) == expected
+    assert predictor.predict_batch(inputs, max_length=30, batch_size=2) == expected
+
+
+def test_process_pool_matches_single_process(tmp_path):
+    """多进程推理按输入顺序返回，与单进程结果一致；进程池常驻，多个预测器互不影响"""
+    predictor = build_predictor(tmp_path, seed=5)
+    inputs = [("CCO", 7.0, "chlorine"), ("c1ccccc1", 6.5, "ozone"), ("CC(=O)O", 8.0, "chloramine"),
+              ("Nc1ccccc1", 5.5, "chlorine"), ("CC(C)O", 7.5, "ozone")]
+
+    # 父进程先运行多线程推理，再使用多线程工作进程（fork方式下工作进程会死锁）
+    original_threads = torch.get_num_threads()
+    torch.set_num_threads(4)
+    try:
+        expected = predictor.predict_batch(inputs, max_length=20, batch_size=2)
+        outputs = {}
+        worker = threading.Thread(target=lambda: outputs.update(pooled=predictor.predict_batch(
+            inputs, max_length=20, batch_size=2, num_workers=2, threads_per_worker=2
+        )), daemon=True)
+        worker.start()
+        worker.join(timeout=120)
+        assert not worker.is_alive(), "多进程推理超时"
+        assert outputs['pooled'] == expected
+    finally:
+        torch.set_num_threads(original_threads)
+
+    # 进程数和线程数不变时复用同一个进程池
+    pool = predictor._pool
+    assert predictor.predict_batch(inputs, max_length=20, batch_size=2, num_workers=2,
+                                   threads_per_worker=2) == expected
+    assert predictor._pool is pool
+
+    # 两个预测器在不同线程中同时使用进程池，各自的工作进程只使用自己的模型
+    other_dir = tmp_path / "other"
+    other_dir.mkdir()
+    other = build_predictor(other_dir, seed=11)
+    other_expected = other.predict_batch(inputs, max_length=20, batch_size=2)
+    assert other_expected != expected
+    outputs = {}
+
+    def run(name, model):
+        outputs[name] = [model.predict_batch(inputs, max_length=20, batch_size=2, num_workers=2,
+                                             threads_per_worker=1) for _ in range(3)]
+
+    threads = [threading.Thread(target=run, args=args) for args in (('a', predictor), ('b', other))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    predictor.close()
+    other.close()
+    assert outputs == {'a': [expected] * 3, 'b': [other_expected] * 3}
+
+
+def test_batch_prediction_resumes_after_interruption(tmp_path):
+    """中断后重新运行只处理剩余的行，输出与一次性运行完全一致"""
+    predictor = build_predictor(tmp_path, seed=5)
+    reactants = ["CCO", "c1ccccc1", "CC(=O)O", "Nc1ccccc1", "CC(C)O"]
+    input_path = str(tmp_path / "screen.csv")
+    with open(input_path, 'w', encoding='utf-8') as f:
+        f.write("reactant_smiles,pH,disinfectant\n")
+        for i, reactant in enumerate(reactants):
+            f.write(f"{reactant},{6.0 + i * 0.5},chlorine\n")
+
+    full_path = str(tmp_path / "full.csv")
+    assert run_batch_prediction(predictor, input_path, full_path, chunk_size=2, max_length=20) == 5
+
+    class FailingPredictor:
+        """第二块时模拟任务被中断"""
+        calls = 0
+
+        def predict_batch_with_errors(self, *args, **kwargs):
+            FailingPredictor.calls += 1
+            if FailingPredictor.calls == 2:
+                raise KeyboardInterrupt()
+            return predictor.predict_batch_with_errors(*args, **kwargs)
+
+    resumed_path = str(tmp_path / "resumed.csv")
+    try:
+        run_batch_prediction(FailingPredictor(), input_path, resumed_path, chunk_size=2, max_length=20)
+        assert False, "应模拟中断"
+    except KeyboardInterrupt:
+        pass
+    assert run_batch_prediction(predictor, input_path, resumed_path, chunk_size=2, max_length=20) == 3
+
+    with open(full_path, encoding='utf-8') as f_full, open(resumed_path, encoding='utf-8') as f_resumed:
+        assert f_resumed.read() == f_full.read()
+
+
+def test_batch_prediction_records_row_errors(tmp_path):
+    """模型拒绝的行写入空产物和错误信息，同一块的其他行和后续的块照常预测"""
+    predictor = build_predictor(tmp_path, seed=5)
+    reactants = ["CCO", "C" * 250, "c1ccccc1", "CC(=O)O"]
+    input_path = str(tmp_path / "screen.csv")
+    with open(input_path, 'w', encoding='utf-8') as f:
+        f.write("reactant_smiles,pH,disinfectant\n")
+        for reactant in reactants:
+            f.write(f"{reactant},7.0,chlorine\n")
+
+    # 出错的行在预测前校验剔除，每块仍只批量解码一次
+    calls = []
+    predict_batch_candidates = predictor.predict_batch_candidates
+    predictor.predict_batch_candidates = lambda inputs, **kwargs: calls.append(len(inputs)) or \
+        predict_batch_candidates(inputs, **kwargs)
+    output_path = str(tmp_path / "predictions.csv")
+    assert run_batch_prediction(predictor, input_path, output_path, chunk_size=2, max_length=20) == 4
+    assert calls == [1, 2]
+    with open(output_path + ".progress.json", encoding='utf-8') as f:
+        assert json.load(f)['rows_done'] == 4
+
+    results = pd.read_csv(output_path, keep_default_na=False)
+    assert "超出模型最大长度" in results['error'][1]
+    assert results['product_smiles'][1] == "" and results['log_prob'][1] == ""
+    expected = predictor.predict_batch([(reactants[i], 7.0, "chlorine") for i in (0, 2, 3)], max_length=20)
+    assert list(results['product_smiles'][[0, 2, 3]]) == expected
+    assert list(results['error'][[0, 2, 3]]) == ["", "", ""]
+
+    # 内存不足、模型损坏等非输入错误不记录为行错误，直接中断任务
+    def broken(inputs, **kwargs):
+        raise RuntimeError("模型损坏")
+    predictor.predict_batch_candidates = broken
+    with pytest.raises(RuntimeError):
+        run_batch_prediction(predictor, input_path, str(tmp_path / "broken.csv"), chunk_size=2, max_length=20)
+
+
+def test_torchscript_backend_matches_eager(tmp_path):
+    """TorchScript后端的贪心和束搜索结果与eager模型一致（批次大小和长度不同于导出时的示例输入）"""
+    predictor = build_predictor(tmp_path, seed=5)
+    script_path = str(tmp_path / "transformer_model_ts.pt")
+    export_torchscript(str(tmp_path / "transformer_model.pth"), script_path)
+    scripted = ReactionPredictor(script_path, str(tmp_path / "vocabulary.json"), device="cpu", backend="torchscript")
+
+    inputs = [("CCO", 7.0, "chlorine"), ("c1ccccc1", 6.5, "ozone"), ("CC(=O)O", 8.0, "chloramine"),
+              ("Nc1ccccc1O", 5.5, "chlorine")]
+    assert scripted.predict_batch(inputs, max_length=30) == predictor.predict_batch(inputs, max_length=30)
+
+    beam = BeamSearchDecoder(beam_size=3)
+    expected = predictor.predict_batch_candidates(inputs, strategy=beam, max_length=20)
+    actual = scripted.predict_batch_candidates(inputs, strategy=beam, max_length=20)
+    assert [[smiles for smiles, _ in items] for items in actual] == [[smiles for smiles, _ in items] for items in expected]
+    for items_actual, items_expected in zip(actual, expected):
+        for (_, score_actual), (_, score_expected) in zip(items_actual, items_expected):
+            assert abs(score_actual - score_expected) < 1e-4
+
+
+def test_fast_path_matches_seq_first(tmp_path):
+    """batch优先快速路径直接加载已有checkpoint，混合长度批次的预测结果与默认布局一致"""
+    predictor = build_predictor(tmp_path, seed=5)
+    model_path = str(tmp_path / "transformer_model.pth")
+    vocab_path = str(tmp_path / "vocabulary.json")
+    fast = ReactionPredictor(model_path, vocab_path, device="cpu", fast_path=True)
+    assert fast.model.batch_first and fast.model.transformer.encoder.use_nested_tensor
+
+    inputs = [("CCO", 7.0, "chlorine"), ("c1ccc(cc1)O", 6.0, "ozone"), ("Nc1ccccc1Cl", 8.0, "chloramine")]
+    expected = predictor.predict_batch_candidates(inputs, strategy=BeamSearchDecoder(beam_size=3), max_length=20)
+    actual = fast.predict_batch_candidates(inputs, strategy=BeamSearchDecoder(beam_size=3), max_length=20)
+    assert [[smiles for smiles, _ in items] for items in actual] == [[smiles for smiles, _ in items] for items in expected]
+    for items, expected_items in zip(actual, expected):
+        for (_, score), (_, expected_score) in zip(items, expected_items):
+            assert abs(score - expected_score) < 1e-4
+
+    with pytest.raises(ValueError):
+        ReactionPredictor(model_path, vocab_path, device="cpu", fast_path=True, quantized=True)
+
+
+def test_beam_search_batched_matches_single(tmp_path):
+    """束搜索按批次并行的结果应与逐条搜索一致，且beam=1等价于贪心解码"""
+    predictor = build_predictor(tmp_path, seed=5)
+    inputs = [("CCO", 7.0, "chlorine"), ("c1ccc(cc1)O", 6.5, "chlorine"), ("CC(=O)O", 8.0, "ozone")]
+    strategy = BeamSearchDecoder(beam_size=4)
+
+    batched = predictor.predict_batch_candidates(inputs, strategy=strategy, max_length=30)
+    for item, candidates in zip(inputs, batched):
+        single = predictor.predict_candidates(*item, strategy=strategy, max_length=30)
+        assert [smiles for smiles, _ in candidates] == [smiles for smiles, _ in single]
+        assert len(candidates) == 4
+
+    greedy = predictor.predict_batch(inputs, max_length=30)
+    assert predictor.predict_batch(inputs, max_length=30, strategy=BeamSearchDecoder(beam_size=1)) == greedy
+
+
+def test_sampling_filters():
+    """top-k/top-p过滤只保留指定的token"""
+    logits = torch.log(torch.tensor([[0.5, 0.3, 0.15, 0.05]]))
+
+    assert torch.isinf(top_k_filter(logits, 2)).tolist() == [[False, False, True, True]]
+    assert torch.isinf(top_p_filter(logits, 0.7)).tolist() == [[False, False, True, True]]
+    assert torch.isinf(top_p_filter(logits, 0.1)).tolist() == [[False, True, True, True]]
+
+
+def test_quantized_export_and_report(tmp_path):
+    """导出的int8量化模型可被预测器加载，对比报告包含两种模型的指标"""
+    build_predictor(tmp_path, seed=5)
+    model_path = str(tmp_path / "transformer_model.pth")
+    quantized_path = str(tmp_path / "transformer_model_int8.pth")
+    vocab_path = str(tmp_path / "vocabulary.json")
+
+    export_quantized_model(model_path, quantized_path)
+    quantized = ReactionPredictor(quantized_path, vocab_path, device="cpu")
+    assert quantized.quantized
+    assert isinstance(quantized.predict_product("CCO", 7.0, "chlorine", max_length=20), str)
+
+    # 加载时量化与导出的量化模型结果一致
+    on_the_fly = ReactionPredictor(model_path, vocab_path, device="cpu", quantized=True)
+    inputs = [("CCO", 7.0, "chlorine"), ("Nc1ccccc1", 6.0, "ozone")]
+    assert on_the_fly.predict_batch(inputs, max_length=20) == quantized.predict_batch(inputs, max_length=20)
+
+    report = compare_models(
+        model_path, quantized_path, vocab_path, "data/sample_data.json",
+        max_length=20, report_path=str(tmp_path / "report.json")
+    )
+    assert report['num_examples'] == 18
+    assert 0.0 <= report['agreement'] <= 1.0
+    assert set(report['int8']) == {'exact_match', 'latency_ms_per_example', 'file_size_mb'}
+
+
+class _TrainingNote:
+    """weights_only模式不允许反序列化的自定义对象"""
+
+
+def test_checkpoint_pickle_fallback_requires_opt_in(tmp_path):
+    """包含任意Python对象的checkpoint默认拒绝加载，显式allow_pickle=True时告警后加载"""
+    build_predictor(tmp_path, seed=5)
+    model_path = str(tmp_path / "transformer_model.pth")
+    vocab_path = str(tmp_path / "vocabulary.json")
+    checkpoint = torch.load(model_path)
+    checkpoint['note'] = _TrainingNote()
+    torch.save(checkpoint, model_path)
+
+    with pytest.raises(ValueError, match="allow_pickle"):
+        ReactionPredictor(model_path, vocab_path, device="cpu", verbose=False)
+    with pytest.warns(UserWarning, match="allow_pickle"):
+        predictor = ReactionPredictor(model_path, vocab_path, device="cpu", verbose=False, allow_pickle=True)
+    assert isinstance(predictor.predict_product("CCO", 7.0, "chlorine", max_length=10), str)
+
+
+def test_prediction_cache_hits_and_eviction(tmp_path):
+    """缓存命中时结果与直接预测一致，超出容量时按LRU淘汰"""
+    predictor = build_predictor(tmp_path, seed=5)
+    inputs = [("CCO", 7.0, "chlorine"), ("Nc1ccccc1", 6.0, "ozone")]
+    expected = predictor.predict_batch_candidates(inputs, max_length=20)
+
+    cache_path = str(tmp_path / "cache.sqlite")
+    predictor.cache = PredictionCache(cache_path, max_entries=2)
+    assert predictor.predict_batch_candidates(inputs, max_length=20) == expected
+    predictor.cache.close()
+    # 其他进程打开同一文件即可共享缓存；pH在同一分桶内视为相同条件
+    predictor.cache = PredictionCache(cache_path, max_entries=2)
+    assert predictor.predict_batch_candidates([(" CCO", 7.01, "chlorine")], max_length=20) == expected[:1]
+
+    stats = predictor.cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 2, 2)
+
+    # 不同解码参数使用不同的缓存键，写入第3条后淘汰最久未访问的条目
+    predictor.predict_batch_candidates(inputs[:1], max_length=10)
+    assert predictor.cache.stats()['entries'] == 2
+    predictor.predict_batch_candidates(inputs[1:], max_length=20)
+    assert predictor.cache.stats()['hits'] == 1
+
+
+def test_model_hash_computed_only_with_cache(tmp_path, monkeypatch):
+    """未使用预测缓存时不计算checkpoint哈希，使用时只计算一次"""
+    calls = []
+    original = predict.file_sha256
+    monkeypatch.setattr(predict, 'file_sha256', lambda path: calls.append(path) or original(path))
+    predictor = build_predictor(tmp_path, seed=5)
+    predictor.predict_batch_candidates([("CCO", 7.0, "chlorine")], max_length=10)
+    assert calls == []
+    
+    predictor.cache = PredictionCache(str(tmp_path / "cache.sqlite"))
+    predictor.predict_batch_candidates([("CCO", 7.0, "chlorine")], max_length=10)
+    predictor.predict_batch_candidates([("CCO", 7.0, "chlorine")], max_length=10)
+    assert calls == [predictor.model_path]
+    predictor.cache.close()
+
+
+def test_prediction_cache_defers_stats_and_decodes_canonical_smiles(tmp_path, monkeypatch):
+    """查询不写数据库，统计定期写回；模型解码的是与缓存键相同的规范化SMILES"""
+    predictor = build_predictor(tmp_path, seed=5)
+    expected = predictor.predict_batch_candidates([("CCO", 7.0, "chlorine")], max_length=20)
+    
+    monkeypatch.setattr(predict, 'canonicalize_smiles', lambda smiles: "CCO" if smiles.strip() == "OCC" else smiles)
+    cache_path = str(tmp_path / "cache.sqlite")
+    predictor.cache = PredictionCache(cache_path, flush_interval=3600)
+    assert predictor.predict_batch_candidates([("OCC", 7.0, "chlorine")], max_length=20) == expected
+    assert predictor.predict_batch_candidates([("CCO", 7.0, "chlorine")], max_length=20) == expected
+    
+    # 其他进程在写回之前看不到本进程的命中统计
+    other = PredictionCache(cache_path)
+    assert (other.stats()['hits'], other.stats()['misses'], other.stats()['entries']) == (0, 0, 1)
+    predictor.cache.flush()
+    assert (other.stats()['hits'], other.stats()['misses']) == (1, 1)
+    predictor.cache.close()
+    other.close()
+
+
+def test_predict_sweep_matches_batch(tmp_path):
+    """条件扫描的结果与逐条批量预测一致，每个条件一行"""
+    predictor = build_predictor(tmp_path, seed=5)
+    pH_grid = [5.0, 6.5, 8.0, 9.0]
+    disinfectants = ["chlorine", "ozone"]
+
+    table = predictor.predict_sweep("c1ccccc1", pH_grid, disinfectants, max_length=20)
+    assert len(table) == len(pH_grid) * len(disinfectants)
+    assert list(table['rank'].unique()) == [1]
+
+    expected = predictor.predict_batch(
+        [("c1ccccc1", pH, disinfectant) for disinfectant, pH in zip(table['disinfectant'], table['pH'])],
+        max_length=20
+    )
+    assert list(table['product_smiles']) == expected
+
+
+def test_encoder_cache_matches_uncached(tmp_path):
+    """编码器缓存不改变预测结果，重复输入命中缓存"""
+    predictor = build_predictor(tmp_path, seed=5)
+    inputs = [("CCO", pH, disinfectant) for pH in (6.0, 7.0, 8.0) for disinfectant in ("chlorine", "ozone")]
+    inputs.append(("c1ccccc1", 6.5, "chloramine"))
+    expected = predictor.predict_batch(inputs, max_length=20)
+
+    predictor.encoder_cache = EncoderCache()
+    assert predictor.predict_batch(inputs, max_length=20, batch_size=3) == expected
+    assert predictor.predict_batch(inputs, max_length=20) == expected
+    stats = predictor.encoder_cache.stats()
+    assert stats['hits'] == len(inputs)
+    assert stats['entries'] == len(inputs)
+
+    # 超出字节上限时淘汰最久未访问的条目
+    row_bytes = stats['bytes'] // len(inputs)
+    predictor.encoder_cache = EncoderCache(max_bytes=2 * row_bytes + row_bytes // 2)
+    predictor.predict_batch(inputs[:6], max_length=20)
+    assert predictor.encoder_cache.stats()['entries'] == 2
+
+
+def test_predictor_metrics_and_prometheus_export(tmp_path):
+    """开启指标后记录每次调用的阶段耗时、生成长度和缓存命中，并导出Prometheus文本"""
+    predictor = build_predictor(tmp_path, seed=5)
+    inputs = [("CCO", 7.0, "chlorine"), ("Nc1ccccc1", 6.0, "ozone"), ("CCO", 7.0, "chlorine")]
+    expected = predictor.predict_batch(inputs, max_length=20)
+    expected_short = predictor.predict_batch(inputs * 3, max_length=10)
+
+    predictor.metrics = PredictorMetrics()
+    predictor.cache = PredictionCache(str(tmp_path / "cache.sqlite"))
+    predictor.encoder_cache = EncoderCache()
+    assert predictor.predict_batch(inputs, max_length=20) == expected
+    assert predictor.predict_batch(inputs[:2], max_length=20) == expected[:2]
+    # 多进程推理时合并各工作进程的统计
+    assert predictor.predict_batch(inputs * 3, max_length=10, batch_size=2, num_workers=2) == expected_short
+    predictor.close()
+
+    counters = predictor.metrics.counters
+    assert counters['requests'] == 3 and counters['inputs'] == 3 + 2 + 9
+    assert (counters['cache_hits'], counters['cache_misses']) == (2, 3 + 9)
+    # 工作进程各自维护编码器缓存，命中数取决于分片的调度
+    assert counters['encoder_cache_hits'] + counters['encoder_cache_misses'] == 3 + 9
+    assert predictor.metrics.generated_tokens.count == predictor.metrics.steps_to_eos.count == 3 + 9
+    # 生成<eos>的输入多解码一步，截断的输入解码max_length步
+    assert (predictor.metrics.steps_to_eos.sum - predictor.metrics.generated_tokens.sum
+            == 3 + 9 - counters['truncated'])
+
+    first_call = predictor.metrics.recent[0]
+    assert first_call['encode_s'] > 0 and first_call['decode_s'] > 0
+    assert sum(first_call[f'{stage}_s'] for stage in STAGES) <= first_call['total_s']
+    assert predictor.metrics.summary()['latency_ms']['decode']['p50'] > 0
+
+    text = predictor.metrics.to_prometheus()
+    assert '# TYPE reaction_predictor_stage_seconds histogram' in text
+    assert 'reaction_predictor_stage_seconds_count{stage="encode"} 3' in text
+    assert 'reaction_predictor_request_seconds_bucket{le="+Inf"} 3' in text
+    assert 'reaction_predictor_cache_misses_total 12' in text
+
+
+def test_server_coalesces_concurrent_requests(tmp_path):
+    """并发请求被合并为微批次，返回结果与直接预测一致"""
+    predictor = build_predictor(tmp_path, seed=5)
+    predictor.metrics = PredictorMetrics()
+    server = create_server(predictor, port=0, max_batch_size=16, max_wait_ms=50)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    try:
+        results = run_load_test(url + "/predict", concurrency=8, num_requests=32, max_length=20)
+        assert results['errors'] == 0
+
+        stats = server.batcher.stats()
+        assert stats['requests'] == 32
+        assert stats['batches'] < 32
+
+        request = urllib.request.Request(
+            url + "/predict",
+            data=json.dumps({'reactant_smiles': "CCO", 'pH': 7.0, 'disinfectant': "chlorine",
+                             'max_length': 20}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request) as response:
+            body = json.loads(response.read())
+        assert body['predictions'][0]['product_smiles'] == predictor.predict_product(
+            "CCO", 7.0, "chlorine", max_length=20
+        )
+
+        with urllib.request.urlopen(url + "/metrics") as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert f"reaction_predictor_inputs_total {32 + 2}" in response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.batcher.stop()
+
+
+def test_server_isolates_invalid_inputs(tmp_path):
+    """超长或超限的请求返回400；同一微批次中出错的输入不影响其他请求"""
+    predictor = build_predictor(tmp_path, seed=5)
+    too_long = "C" * 250
+    with pytest.raises(ValueError, match="超出模型最大长度"):
+        parse_request({'reactant_smiles': too_long, 'pH': 7.0, 'disinfectant': "chlorine"}, predictor)
+    with pytest.raises(ValueError, match="max_length"):
+        parse_request({'reactant_smiles': "CCO", 'pH': 7.0, 'disinfectant': "chlorine", 'max_length': 10 ** 6})
+    with pytest.raises(ValueError, match="num_candidates"):
+        parse_request({'reactant_smiles': "CCO", 'pH': 7.0, 'disinfectant': "chlorine",
+                       'strategy': 'beam', 'num_candidates': 10 ** 6})
+
+    # 绕过请求校验直接提交，模拟批量预测中途出错
+    batcher = DynamicBatcher(predictor, max_batch_size=8, max_wait_ms=200)
+    batcher.start()
+    try:
+        _, strategy, _ = parse_request({'reactant_smiles': "CCO", 'pH': 7.0, 'disinfectant': "chlorine"})
+        good = batcher.submit(("CCO", 7.0, "chlorine"), strategy, max_length=20)
+        bad = batcher.submit((too_long, 7.0, "chlorine"), strategy, max_length=20)
+        assert good.result(timeout=30)[0][0] == predictor.predict_product("CCO", 7.0, "chlorine", max_length=20)
+        with pytest.raises(ValueError):
+            bad.result(timeout=30)
+    finally:
+        batcher.stop()
+
+    server = create_server(predictor, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{server.server_address[1]}/predict",
+            data=json.dumps({'inputs': [{'reactant_smiles': too_long, 'pH': 7.0, 'disinfectant': "chlorine"}]})
+            .encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(request)
+        assert error.value.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.batcher.stop()
+
+
+class _GatedPredictor:
+    """批量预测阻塞到放行为止，记录每次调用的输入数，用于测试服务的排队上限和超时"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.metrics = None
+        self.calls = []
+
+    def check_input_lengths(self, inputs, max_length):
+        pass
+
+    def predict_batch_with_errors(self, inputs, **kwargs):
+        self.calls.append(len(inputs))
+        self.started.set()
+        self.release.wait(timeout=30)
+        return [[("C", 0.0)] for _ in inputs]
+
+
+def test_server_queue_limit_and_deadline():
+    """队列满时返回503；多条输入共用一个截止时间，超时后未开始预测的输入被跳过"""
+    gated = _GatedPredictor()
+    server = create_server(gated, port=0, max_wait_ms=0, request_timeout=1.0, max_queue_size=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/predict"
+    entry = {'reactant_smiles': "CCO", 'pH': 7.0, 'disinfectant': "chlorine"}
+
+    def post(payload):
+        request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(request)
+        return error.value.code
+
+    try:
+        _, strategy, _ = parse_request(entry)
+        first = server.batcher.submit(("CCO", 7.0, "chlorine"), strategy, max_length=100)
+        assert gated.started.wait(timeout=10)
+
+        # 两条输入排队等待，总等待时间不超过一个request_timeout
+        start = time.monotonic()
+        assert post({'inputs': [entry, entry]}) == 500
+        assert time.monotonic() - start < 1.8
+
+        # 超时的输入仍占着队列，新请求被拒绝
+        assert post(entry) == 503
+        with pytest.raises(BatcherBusyError):
+            server.batcher.submit(("CCO", 7.0, "chlorine"), strategy, max_length=100)
+
+        gated.release.set()
+        assert first.result(timeout=10) == [("C", 0.0)]
+        while server.batcher.stats()['queue_size']:
+            time.sleep(0.01)
+        assert server.batcher.submit(("CCO", 7.0, "chlorine"), strategy, max_length=100).result(timeout=10)
+        assert gated.calls == [1, 1]
+    finally:
+        gated.release.set()
+        server.shutdown()
+        server.server_close()
+        server.batcher.stop()
+
+
+class _BlockingPredictor:
+    """一直阻塞到收到停止信号的预测器，用于测试背压和取消"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.cancelled = threading.Event()
+        self.finish = threading.Event()
+
+    def predict_batch_candidates(self, inputs, strategy=None, max_length=100, stop_event=None):
+        self.started.set()
+        if stop_event.wait(timeout=10):
+            self.cancelled.set()
+            # 收到停止信号后模拟解码还要运行一段时间
+            self.finish.wait(timeout=10)
+            raise GenerationCancelled()
+        return [[("C", 0.0)] for _ in inputs]
+
+
+def test_async_predictor(tmp_path):
+    """异步接口结果与同步一致，队列满时拒绝，取消时通知解码停止"""
+    predictor = build_predictor(tmp_path, seed=5)
+    inputs = [("CCO", 7.0, "chlorine"), ("c1ccccc1", 6.5, "ozone"), ("CC(=O)O", 8.0, "chloramine")]
+
+    async def run_parity():
+        async_predictor = AsyncReactionPredictor(predictor, max_workers=2)
+        single = await async_predictor.apredict("CCO", 7.0, "chlorine", max_length=20)
+        streamed = [item async for item in async_predictor.astream_batch(inputs, max_length=20, chunk_size=2)]
+        async_predictor.shutdown()
+        return single, streamed
+
+    single, streamed = asyncio.run(run_parity())
+    assert single == predictor.predict_product("CCO", 7.0, "chlorine", max_length=20)
+    assert [index for index, _ in streamed] == [0, 1, 2]
+    assert [candidates[0][0] for _, candidates in streamed] == predictor.predict_batch(inputs, max_length=20)
+
+    # 已设置停止信号时解码立即中止
+    stop_event = threading.Event()
+    stop_event.set()
+    try:
+        predictor.predict_batch_candidates(inputs, max_length=20, stop_event=stop_event)
+        assert False, "应抛出 GenerationCancelled"
+    except GenerationCancelled:
+        pass
+
+    blocking = _BlockingPredictor()
+
+    async def run_backpressure():
+        async_predictor = AsyncReactionPredictor(blocking, max_pending=1)
+        task = asyncio.create_task(async_predictor.apredict("CCO", 7.0, "chlorine"))
+        while not blocking.started.is_set():
+            await asyncio.sleep(0.01)
+        in_flight = async_predictor.pending
+        try:
+            await async_predictor.apredict("CCO", 7.0, "chlorine")
+            busy = False
+        except PredictorBusyError:
+            busy = True
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+        # 已取消但仍在运行的任务继续占用名额，直到解码真正结束
+        while not blocking.cancelled.is_set():
+            await asyncio.sleep(0.01)
+        still_running = async_predictor.pending
+        try:
+            await async_predictor.apredict("CCO", 7.0, "chlorine")
+            busy_while_cancelling = False
+        except PredictorBusyError:
+            busy_while_cancelling = True
+
+        blocking.finish.set()
+        while async_predictor.pending:
+            await asyncio.sleep(0.01)
+        async_predictor.shutdown()
+        return busy, in_flight, still_running, busy_while_cancelling
+
+    busy, in_flight, still_running, busy_while_cancelling = asyncio.run(run_backpressure())
+    assert busy and busy_while_cancelling
+    assert in_flight == 1 and still_running == 1
+    assert blocking.cancelled.is_set()
+
+
+def test_inference_benchmark_report():
+    """基准测试覆盖参数网格中的每个用例，报告可与自身对比"""
+    report = run_benchmark(
+        configs=('small',), input_lengths=(8, 16), batch_sizes=(1, 4), threads=(1,),
+        strategies=('greedy', 'beam'), max_length=5, runs=3, warmup=1
+    )
+
+    assert len(report['results']) == 2 * 2 * 2
+    assert {result['mode'] for result in report['results']} == {'predict_product', 'predict_batch'}
+    for result in report['results']:
+        assert 0 < result['p50_ms'] <= result['p95_ms'] <= result['p99_ms']
+        assert result['seq_per_s'] > 0
+    json.dumps(report)
+
+    comparison = compare_reports(report, report)
+    assert len(comparison) == len(report['results'])
+    assert all(item['p50_ms_change'] == 0.0 for item in comparison)
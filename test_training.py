@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+训练路径测试
+验证批采样器等训练数据管线组件
+"""
+
+import json
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+import preprocess
+from predict import ReactionPredictor
+from model import ReactionTransformer
+from train import MemmapReactionDataset, ReactionDataset, TokenBucketSampler, train_model
+from training_metrics import STAGES, TrainingMetrics
+from utils import (SMILESVocabulary, collate_fn, collate_tokenized_fn, create_causal_mask, load_vocab,
+                   pad_sequences, save_vocab)
+
+
+def test_token_bucket_sampler_respects_budget():
+    """每个样本恰好出现一次，且每个批次padding后的token数不超过预算"""
+    lengths = [(3 + i % 40, 5 + (i * 7) % 50) for i in range(500)]
+    sampler = TokenBucketSampler(lengths, max_tokens=400, seed=1)
+
+    for epoch in range(2):
+        sampler.set_epoch(epoch)
+        batches = list(sampler)
+        assert sorted(idx for batch in batches for idx in batch) == list(range(500))
+        for batch in batches:
+            max_src_len = max(lengths[idx][0] for idx in batch)
+            max_tgt_len = max(lengths[idx][1] for idx in batch)
+            assert len(batch) == 1 or len(batch) * (max_src_len + max_tgt_len) <= 400
+
+
+def test_train_model_with_token_budget(tmp_path):
+    """使用token预算组批完成一次完整的训练与保存"""
+    dataset = ReactionDataset("data/sample_data.json")
+    model_path = tmp_path / "model.pth"
+
+    train_model(
+        data_path="data/sample_data.json",
+        model_save_path=str(model_path),
+        vocab_save_path=str(tmp_path / "vocabulary.json"),
+        num_epochs=1,
+        max_tokens=120,
+        device="cpu"
+    )
+
+    assert len(dataset.get_lengths()) == len(dataset)
+    assert model_path.exists()
+
+
+def test_training_metrics_log_and_profiler_trace(tmp_path):
+    """每个训练步写入一行性能指标，并为指定的训练步导出profiler追踪文件"""
+    metrics_path = tmp_path / "metrics.jsonl"
+    profile_dir = tmp_path / "traces"
+    train_model(
+        data_path="data/sample_data.json",
+        model_save_path=str(tmp_path / "model.pth"),
+        vocab_save_path=str(tmp_path / "vocabulary.json"),
+        batch_size=4,
+        num_epochs=2,
+        device="cpu",
+        grad_accum_steps=2,
+        metrics_log_path=str(metrics_path),
+        profile_steps=(1, 2),
+        profile_dir=str(profile_dir)
+    )
+
+    records = [json.loads(line) for line in metrics_path.read_text(encoding='utf-8').splitlines()]
+    num_batches = -(-len(ReactionDataset("data/sample_data.json")) // 4)
+    assert [record['step'] for record in records] == list(range(2 * num_batches))
+    for record in records:
+        assert record['tokens'] > 0 and 0.0 <= record['padding_ratio'] < 1.0
+        assert record['forward_s'] > 0 and record['backward_s'] > 0 and record['collate_s'] > 0
+        assert record['data_wait_s'] + record['forward_s'] + record['backward_s'] <= record['step_time_s']
+        assert (record['optimizer_s'] > 0) == record['optimizer_step']
+        assert record['peak_memory_mb'] > 0
+    # 记录从第1步开始的2步，在第3步结束时导出
+    assert [path.name for path in profile_dir.glob("*.json")] == ["trace_rank0_step3.json"]
+
+    # 没有训练步的epoch汇总为0，而不是缺少字段
+    summary = TrainingMetrics(torch.device("cpu")).epoch_summary()
+    assert summary['padding_ratio'] == 0.0 and all(summary[f'{stage}_fraction'] == 0.0 for stage in STAGES)
+
+
+def test_memmap_dataset_matches_json_dataset(tmp_path):
+    """预处理数据集经collate后应与直接从JSON分词的结果完全一致"""
+    preprocess.preprocess_data("data/sample_data.json", str(tmp_path))
+    memmap_dataset = MemmapReactionDataset(str(tmp_path))
+    json_dataset = ReactionDataset("data/sample_data.json")
+    vocab = load_vocab(memmap_dataset.vocab_path)
+
+    assert len(memmap_dataset) == len(json_dataset)
+    assert memmap_dataset.get_lengths() == json_dataset.get_lengths()
+
+    indices = [0, 3, 7, 11]
+    expected = collate_fn([json_dataset[i] for i in indices], vocab)
+    actual = collate_tokenized_fn([memmap_dataset[i] for i in indices], vocab.get_pad_idx())
+    for key, value in expected.items():
+        assert torch.equal(actual[key], value)
+
+
+def test_vectorized_tokenizer_matches_per_character():
+    """查找表批量编码/解码应与逐字符实现一致（包括未知字符）"""
+    vocab = load_vocab("vocabulary.json")
+    smiles_list = ["CCO", "c1ccc(cc1)O", "", "CC(Br)=O", "Nc1ccccc1Cl"]
+
+    expected = pad_sequences([vocab.encode_smiles(smiles) for smiles in smiles_list], vocab.get_pad_idx())
+    encoded = vocab.encode_batch(smiles_list)
+    assert torch.equal(encoded, expected)
+
+    # 解码在<eos>处停止并忽略其后的token
+    encoded[0, 2] = vocab.get_eos_idx()
+    assert vocab.decode_batch(encoded) == [vocab.decode_indices(row) for row in encoded.tolist()]
+    assert vocab.decode_batch([[9, 9, 11], []]) == ["CCO", ""]
+
+
+def test_atom_tokenizer_vocab_roundtrip(tmp_path):
+    """原子级词汇表把多字符原子作为单个token，并在保存/加载后保持一致"""
+    data = [
+        {'reactant_smiles': "c1cc[nH]c1", 'product_smiles': "Clc1cc[nH]c1Br"},
+        {'reactant_smiles': "C%10CCCCC%10O", 'product_smiles': "ClC%10CCCCC%10O"}
+    ]
+    vocab = SMILESVocabulary(tokenizer='atom')
+    vocab.build_vocab_from_data(data)
+
+    assert vocab.tokenize("Clc1cc[nH]c1Br") == ['Cl', 'c', '1', 'c', 'c', '[nH]', 'c', '1', 'Br']
+    assert {'Cl', 'Br', '[nH]', '%10'} <= set(vocab.char_to_idx)
+
+    vocab_path = str(tmp_path / "vocabulary.json")
+    save_vocab(vocab, vocab_path)
+    loaded = load_vocab(vocab_path)
+    assert loaded.tokenizer == 'atom'
+
+    smiles_list = [item['product_smiles'] for item in data]
+    encoded = loaded.encode_batch(smiles_list)
+    assert encoded.size(1) == len(loaded.tokenize("ClC%10CCCCC%10O")) + 2
+    assert loaded.decode_batch(encoded) == smiles_list
+
+    # 旧版（无tokenizer字段）词汇表按字符级加载
+    assert load_vocab("vocabulary.json").tokenizer == 'char'
+
+
+def test_bf16_training_precision_is_persisted(tmp_path):
+    """bf16混合精度训练的精度设置写入checkpoint，预测器默认沿用该精度"""
+    model_path = str(tmp_path / "model.pth")
+    vocab_path = str(tmp_path / "vocabulary.json")
+    train_model(
+        data_path="data/sample_data.json",
+        model_save_path=model_path,
+        vocab_save_path=vocab_path,
+        batch_size=6,
+        num_epochs=1,
+        device="cpu",
+        precision="bf16"
+    )
+
+    predictor = ReactionPredictor(model_path, vocab_path, device="cpu")
+    assert predictor.precision == "bf16"
+    assert predictor.model.output_projection.weight.dtype == torch.bfloat16
+    assert isinstance(predictor.predict_product("CCO", 7.0, "chlorine", max_length=10), str)
+
+    assert ReactionPredictor(model_path, vocab_path, device="cpu", precision="fp32").precision == "fp32"
+
+
+def test_activation_checkpointing_and_grad_accumulation(tmp_path):
+    """激活检查点不改变前向输出和梯度；梯度累积+激活检查点可以正常训练"""
+    torch.manual_seed(0)
+    model = ReactionTransformer(vocab_size=20, d_model=32, nhead=4, num_encoder_layers=2,
+                                num_decoder_layers=2, dim_feedforward=64, dropout=0.0)
+    model.train()
+    src = torch.randint(4, 20, (3, 7))
+    tgt = torch.randint(4, 20, (3, 5))
+    conditions = torch.rand(3, 4)
+    src_padding_mask = torch.zeros(3, 7, dtype=torch.bool)
+    src_padding_mask[0, -2:] = True
+    kwargs = dict(src=src, tgt=tgt, conditions=conditions, tgt_mask=create_causal_mask(5),
+                  src_key_padding_mask=src_padding_mask)
+
+    outputs, grads = [], []
+    for enabled in (False, True):
+        model.zero_grad()
+        model.set_gradient_checkpointing(enabled)
+        output = model(**kwargs)
+        output.sum().backward()
+        outputs.append(output.detach())
+        grads.append([p.grad.clone() for p in model.parameters()])
+    assert torch.allclose(outputs[0], outputs[1], atol=1e-5)
+    for grad_plain, grad_checkpointed in zip(*grads):
+        assert torch.allclose(grad_plain, grad_checkpointed, atol=1e-5)
+
+    model_path = str(tmp_path / "model.pth")
+    train_model(
+        data_path="data/sample_data.json",
+        model_save_path=model_path,
+        vocab_save_path=str(tmp_path / "vocabulary.json"),
+        batch_size=2,
+        num_epochs=1,
+        device="cpu",
+        grad_accum_steps=4,
+        activation_checkpointing=True
+    )
+    predictor = ReactionPredictor(model_path, str(tmp_path / "vocabulary.json"), device="cpu")
+    assert isinstance(predictor.predict_product("CCO", 7.0, "chlorine", max_length=10), str)
+
+
+def _ddp_worker(rank, world_size, port, tmp_dir):
+    """分布式训练子进程：训练后保存本进程的参数，用于检查各进程权重保持一致"""
+    os.environ.update(MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port), RANK=str(rank), WORLD_SIZE=str(world_size))
+    torch.manual_seed(rank)  # 各进程初始化不同，依赖DDP广播0号进程的权重
+    model, _ = train_model(
+        data_path="data/sample_data.json",
+        model_save_path=os.path.join(tmp_dir, "model.pth"),
+        vocab_save_path=os.path.join(tmp_dir, "vocabulary.json"),
+        num_epochs=2,
+        device="cpu",
+        max_tokens=400,
+        distributed=True
+    )
+    torch.save(model.state_dict(), os.path.join(tmp_dir, f"rank{rank}.pth"))
+    dist.destroy_process_group()
+
+
+def test_distributed_training_keeps_replicas_in_sync(tmp_path):
+    """gloo后端两进程训练：数据分片不重叠，梯度同步后各进程权重一致，只有0号进程保存checkpoint"""
+    lengths = [(i % 7 + 3, i % 5 + 3) for i in range(50)]
+    shards = [TokenBucketSampler(lengths, max_tokens=60, num_replicas=2, rank=rank) for rank in range(2)]
+    assert len(shards[0]) == len(shards[1])
+    full = TokenBucketSampler(lengths, max_tokens=60)
+    assert sorted(idx for shard in shards for batch in shard for idx in batch) == \
+        sorted(idx for batch in full for idx in batch) + \
+        sorted(idx for batch in list(full)[:len(full) % 2] for idx in batch)
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    mp.spawn(_ddp_worker, args=(2, port, str(tmp_path)), nprocs=2, join=True)
+
+    states = [torch.load(tmp_path / f"rank{rank}.pth") for rank in range(2)]
+    for name, tensor in states[0].items():
+        assert torch.equal(tensor, states[1][name]), name
+
+    predictor = ReactionPredictor(str(tmp_path / "model.pth"), str(tmp_path / "vocabulary.json"), device="cpu")
+    assert isinstance(predictor.predict_product("CCO", 7.0, "chlorine", max_length=10), str)
@@ -0,0 +1,240 @@
+"""
+TorchScript导出脚本 - 将 ReactionTransformer 导出为编码器和单步解码器计算图
+解码器的自注意力/交叉注意力key/value作为显式输入输出，推理时不需要Python模型代码，
+ScriptedReactionModel 提供与 ReactionTransformer 相同的推理接口，可直接配合 decoding.py 中的解码策略使用
+用法: python torchscript_export.py --model transformer_model.pth --output transformer_model_ts.pt
+"""
+import argparse
+import json
+import math
+import os
+from typing import Dict, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+from model import DecoderCache, ReactionTransformer, load_checkpoint
+
+# 随计算图一起保存的元数据文件名
+CONFIG_FILE = "config.json"
+
+
+class _ExportModule(nn.Module):
+    """导出用的包装模块，三个方法分别被追踪为独立的计算图"""
+
+    def __init__(self, model: ReactionTransformer):
+        super().__init__()
+        self.model = model
+
+    def encode(
+        self,
+        src: torch.Tensor,
+        conditions: torch.Tensor,
+        src_key_padding_mask: torch.Tensor
+    ) -> torch.Tensor:
+        """编码器：[batch_size, src_len] -> memory [src_len+1, batch_size, d_model]"""
+        return self.model.encode(src, conditions, src_key_padding_mask=src_key_padding_mask)
+
+    def cross_kv(self, memory: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """预先计算交叉注意力的key/value，形状 [num_layers, batch_size, nhead, src_len+1, head_dim]"""
+        cache = self.model.init_decoder_cache(memory)
+        return torch.stack([k for k, _ in cache.cross_kv]), torch.stack([v for _, v in cache.cross_kv])
+
+    def decode_step(
+        self,
+        tgt_token: torch.Tensor,
+        step: torch.Tensor,
+        self_k: torch.Tensor,
+        self_v: torch.Tensor,
+        cross_k: torch.Tensor,
+        cross_v: torch.Tensor,
+        memory_key_padding_mask: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        单步解码
+        Args:
+            tgt_token: 最新的目标token [batch_size]
+            step: 当前位置（0维long张量），作为位置编码下标
+            self_k/self_v: 历史自注意力key/value [num_layers, batch_size, nhead, step, head_dim]
+            cross_k/cross_v: cross_kv 的输出
+            memory_key_padding_mask: 编码器输出padding掩码 [batch_size, src_len+1]
+        Returns:
+            (logits [batch_size, vocab_size], 追加当前token后的 self_k, self_v)
+        """
+        # 位置编码下标来自输入张量，不会在追踪时被固化为常数
+        x = self.model.tgt_embedding(tgt_token.unsqueeze(1)) * math.sqrt(self.model.d_model)
+        x = x + self.model.pos_encoder.pe.index_select(0, step.view(1)).transpose(0, 1)
+
+        cache = DecoderCache(list(zip(cross_k.unbind(0), cross_v.unbind(0))), memory_key_padding_mask)
+        cache.self_kv = list(zip(self_k.unbind(0), self_v.unbind(0)))
+        logits = self.model.decode_embedded_step(x, cache)
+
+        return logits, torch.stack([k for k, _ in cache.self_kv]), torch.stack([v for _, v in cache.self_kv])
+
+
+def export_torchscript(model_path: str, output_path: str) -> None:
+    """
+    将fp32 checkpoint导出为TorchScript计算图
+    Args:
+        model_path: train.py 保存的模型路径
+        output_path: TorchScript文件保存路径
+    """
+    checkpoint = load_checkpoint(model_path)
+    if checkpoint.get('quantization') is not None:
+        raise ValueError("量化checkpoint不支持导出，请使用fp32模型")
+
+    model_config = checkpoint['model_config']
+    model = ReactionTransformer(vocab_size=checkpoint['vocab_size'], **model_config)
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model.eval()
+
+    # 示例输入只决定计算图结构，批次大小和序列长度在推理时可变
+    batch_size, src_len, past_len = 2, 5, 3
+    num_layers = model_config.get('num_decoder_layers', 6)
+    nhead = model_config.get('nhead', 8)
+    head_dim = model.d_model // nhead
+
+    src = torch.randint(4, checkpoint['vocab_size'], (batch_size, src_len))
+    conditions = torch.rand(batch_size, model_config.get('condition_dim', 4))
+    src_key_padding_mask = torch.zeros(batch_size, src_len, dtype=torch.bool)
+    src_key_padding_mask[1, -1] = True
+
+    export_module = _ExportModule(model)
+    with torch.no_grad():
+        memory = model.encode(src, conditions, src_key_padding_mask=src_key_padding_mask)
+        memory_key_padding_mask = torch.cat(
+            [torch.zeros(batch_size, 1, dtype=torch.bool), src_key_padding_mask], dim=1
+        )
+        cross_k, cross_v = export_module.cross_kv(memory)
+        past = torch.randn(num_layers, batch_size, nhead, past_len, head_dim)
+
+        traced = torch.jit.trace_module(
+            export_module,
+            {
+                'encode': (src, conditions, src_key_padding_mask),
+                'cross_kv': (memory,),
+                'decode_step': (
+                    torch.randint(4, checkpoint['vocab_size'], (batch_size,)),
+                    torch.tensor(past_len), past, past, cross_k, cross_v, memory_key_padding_mask
+                )
+            },
+            check_trace=False
+        )
+
+    config = {
+        'model_config': model_config,
+        'vocab_size': checkpoint['vocab_size'],
+        'precision': checkpoint.get('precision', 'fp32'),
+        'num_decoder_layers': num_layers,
+        'nhead': nhead,
+        'head_dim': head_dim
+    }
+    torch.jit.save(traced, output_path, _extra_files={CONFIG_FILE: json.dumps(config)})
+
+    print(f"TorchScript模型已保存到: {output_path}")
+
+
+class ScriptedDecoderCache:
+    """TorchScript后端的增量解码缓存，各层key/value堆叠为单个张量"""
+
+    def __init__(
+        self,
+        cross_k: torch.Tensor,
+        cross_v: torch.Tensor,
+        memory_key_padding_mask: torch.Tensor
+    ):
+        self.cross_k = cross_k
+        self.cross_v = cross_v
+        self.memory_key_padding_mask = memory_key_padding_mask
+        num_layers, batch_size, nhead, _, head_dim = cross_k.shape
+        self.self_k = cross_k.new_zeros(num_layers, batch_size, nhead, 0, head_dim)
+        self.self_v = cross_v.new_zeros(num_layers, batch_size, nhead, 0, head_dim)
+        self.step = 0
+
+    def index_select(self, indices: torch.Tensor) -> None:
+        """按批次下标原地筛选/重排缓存（与 DecoderCache.index_select 相同）"""
+        self.cross_k = self.cross_k.index_select(1, indices)
+        self.cross_v = self.cross_v.index_select(1, indices)
+        self.self_k = self.self_k.index_select(1, indices)
+        self.self_v = self.self_v.index_select(1, indices)
+        self.memory_key_padding_mask = self.memory_key_padding_mask.index_select(0, indices)
+
+
+class ScriptedReactionModel:
+    """运行TorchScript计算图的推理模型，接口与 ReactionTransformer 的推理方法一致"""
+
+    def __init__(self, module: torch.jit.ScriptModule, config: Dict):
+        self.module = module
+        self.config = config
+        # 计算图中不包含长度检查，在调用前按导出时的max_len检查
+        self.max_len = config['model_config'].get('max_len', 200)
+
+    def encode(
+        self,
+        src: torch.Tensor,
+        conditions: torch.Tensor,
+        src_mask: Optional[torch.Tensor] = None,
+        src_key_padding_mask: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        if src_mask is not None:
+            raise ValueError("TorchScript后端不支持src_mask")
+        if src.size(1) + 1 > self.max_len:
+            raise ValueError(f"反应物序列长度 {src.size(1)}（加上条件向量为 {src.size(1) + 1}）"
+                             f"超出模型最大长度 {self.max_len}")
+        if src_key_padding_mask is None:
+            src_key_padding_mask = torch.zeros(src.shape, dtype=torch.bool, device=src.device)
+        return self.module.encode(src, conditions, src_key_padding_mask)
+
+    def init_decoder_cache(
+        self,
+        memory: torch.Tensor,
+        memory_key_padding_mask: Optional[torch.Tensor] = None
+    ) -> ScriptedDecoderCache:
+        if memory_key_padding_mask is None:
+            memory_key_padding_mask = torch.zeros(memory.size(1), memory.size(0), dtype=torch.bool,
+                                                  device=memory.device)
+        cross_k, cross_v = self.module.cross_kv(memory)
+        return ScriptedDecoderCache(cross_k, cross_v, memory_key_padding_mask)
+
+    def decode_step(self, tgt_token: torch.Tensor, cache: ScriptedDecoderCache) -> torch.Tensor:
+        if cache.step >= self.max_len:
+            raise ValueError(f"序列位置 {cache.step + 1} 超出位置编码的最大长度 {self.max_len}")
+        logits, cache.self_k, cache.self_v = self.module.decode_step(
+            tgt_token, torch.tensor(cache.step), cache.self_k, cache.self_v,
+            cache.cross_k, cache.cross_v, cache.memory_key_padding_mask
+        )
+        cache.step += 1
+        return logits
+
+
+def load_torchscript_model(path: str) -> ScriptedReactionModel:
+    """
+    加载 export_torchscript 导出的模型（仅CPU）
+    Args:
+        path: TorchScript文件路径
+    Returns:
+        ScriptedReactionModel
+    """
+    extra_files = {CONFIG_FILE: ""}
+    module = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+    module.eval()
+    return ScriptedReactionModel(module, json.loads(extra_files[CONFIG_FILE]))
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="导出 ReactionTransformer 的TorchScript推理计算图")
+    parser.add_argument("--model", default="transformer_model.pth", help="fp32模型路径")
+    parser.add_argument("--output", default="transformer_model_ts.pt", help="TorchScript文件保存路径")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"错误: 模型文件 {args.model} 不存在!")
+        print("请先运行 train.py 训练模型。")
+        return
+
+    export_torchscript(args.model, args.output)
+
+
+if __name__ == "__main__":
+    main()
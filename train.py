@@ -5,37 +5,232 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import Dataset, DataLoader, Sampler
+from torch.utils.data.distributed import DistributedSampler
+import argparse
 import json
 import os
+import numpy as np
+import random
+import time
+from contextlib import nullcontext
 from tqdm import tqdm
 from functools import partial
-from typing import Optional
+from typing import Iterator, List, Optional, Tuple
 
 # 导入自定义模块
-from utils import SMILESVocabulary, collate_fn, save_vocab, create_causal_mask
+from utils import (SMILESVocabulary, collate_fn, collate_tokenized_fn, save_vocab, load_vocab,
+                   autocast_context, TOKENIZERS)
 from model import ReactionTransformer
+from training_metrics import STAGES, TrainingMetrics, timed_collate
+import preprocess
 
 
 class ReactionDataset(Dataset):
     """反应数据集类"""
     
-    def __init__(self, data_path: str):
+    def __init__(self, data_path: str, verbose: bool = True):
         """
         初始化数据集
         Args:
             data_path: 数据文件路径
+            verbose: 是否打印加载信息（分布式训练时只在0号进程打印）
         """
         with open(data_path, 'r', encoding='utf-8') as f:
             self.data = json.load(f)
         
-        print(f"加载了 {len(self.data)} 条反应数据")
+        if verbose:
+            print(f"加载了 {len(self.data)} 条反应数据")
     
     def __len__(self):
         return len(self.data)
     
     def __getitem__(self, idx):
         return self.data[idx]
+    
+    def get_lengths(self, vocab: Optional[SMILESVocabulary] = None) -> List[Tuple[int, int]]:
+        """
+        获取每条数据编码后的长度（含<sos>/<eos>）
+        Args:
+            vocab: 词汇表（按其分词方式计算长度，不提供时按字符计算）
+        Returns:
+            [(反应物长度, 产物长度)] 列表
+        """
+        tokenize = vocab.tokenize if vocab is not None else list
+        return [(len(tokenize(item['reactant_smiles'])) + 2, len(tokenize(item['product_smiles'])) + 2)
+                for item in self.data]
+
+
+class MemmapReactionDataset(Dataset):
+    """
+    预处理数据集（由 preprocess.py 生成），通过内存映射读取已编码的token
+    各个DataLoader worker共享同一份页缓存，不需要重复分词
+    """
+    
+    def __init__(self, data_dir: str, verbose: bool = True):
+        """
+        初始化数据集
+        Args:
+            data_dir: 预处理输出目录
+            verbose: 是否打印加载信息（分布式训练时只在0号进程打印）
+        """
+        self.data_dir = data_dir
+        self.vocab_path = os.path.join(data_dir, preprocess.VOCAB_FILE)
+        
+        # 偏移量很小，直接读入内存
+        self.src_offsets = np.load(os.path.join(data_dir, preprocess.SRC_OFFSETS_FILE))
+        self.tgt_offsets = np.load(os.path.join(data_dir, preprocess.TGT_OFFSETS_FILE))
+        
+        # token和条件数组在每个进程中首次访问时再映射
+        self._arrays = None
+        
+        if verbose:
+            print(f"加载了 {len(self)} 条预处理反应数据")
+    
+    def _open(self):
+        """以只读方式内存映射数据数组"""
+        if self._arrays is None:
+            self._arrays = tuple(
+                np.load(os.path.join(self.data_dir, filename), mmap_mode='r')
+                for filename in (preprocess.SRC_TOKENS_FILE, preprocess.TGT_TOKENS_FILE,
+                                 preprocess.CONDITIONS_FILE)
+            )
+        return self._arrays
+    
+    def __getstate__(self):
+        # 内存映射不随对象传给worker进程，由各进程重新映射
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+    
+    def __len__(self):
+        return len(self.src_offsets) - 1
+    
+    def __getitem__(self, idx):
+        src_tokens, tgt_tokens, conditions = self._open()
+        return {
+            'src': src_tokens[self.src_offsets[idx]:self.src_offsets[idx + 1]],
+            'tgt': tgt_tokens[self.tgt_offsets[idx]:self.tgt_offsets[idx + 1]],
+            'conditions': conditions[idx]
+        }
+    
+    def get_lengths(self) -> List[Tuple[int, int]]:
+        """
+        获取每条数据编码后的长度（含<sos>/<eos>）
+        Returns:
+            [(反应物长度, 产物长度)] 列表
+        """
+        return list(zip(np.diff(self.src_offsets).tolist(), np.diff(self.tgt_offsets).tolist()))
+
+
+class TokenBucketSampler(Sampler):
+    """
+    按长度分桶、按token预算组批的批采样器
+    长度相近的样本放入同一批次以减少padding，每个批次的padding后token数不超过max_tokens，
+    每个epoch在桶内和批次级别打乱顺序
+    """
+    
+    def __init__(
+        self,
+        lengths: List[Tuple[int, int]],
+        max_tokens: int,
+        bucket_size: int = 100,
+        shuffle: bool = True,
+        seed: int = 0,
+        num_replicas: int = 1,
+        rank: int = 0
+    ):
+        """
+        初始化采样器
+        Args:
+            lengths: 每条数据的 (反应物长度, 产物长度)
+            max_tokens: 每个批次padding后的最大token数（反应物与产物之和）
+            bucket_size: 每个长度桶包含的批次数，桶内批次在组批前打乱
+            shuffle: 是否打乱
+            seed: 随机种子（与epoch共同决定顺序）
+            num_replicas: 分布式训练的进程数，所有进程生成相同的批次序列后轮流领取
+            rank: 当前进程编号
+        """
+        self.lengths = lengths
+        self.max_tokens = max_tokens
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self._batches = self._create_batches()
+    
+    def set_epoch(self, epoch: int) -> None:
+        """设置当前epoch，使每个epoch的打乱顺序不同"""
+        self.epoch = epoch
+        self._batches = self._create_batches()
+    
+    def _create_batches(self) -> List[List[int]]:
+        """按长度排序后贪心组批"""
+        rng = random.Random(self.seed + self.epoch)
+        indices = list(range(len(self.lengths)))
+        
+        if self.shuffle:
+            # 先打乱再稳定排序，使相同长度的样本在不同epoch中组合不同
+            rng.shuffle(indices)
+        indices.sort(key=lambda idx: (self.lengths[idx][0], self.lengths[idx][1]))
+        
+        batches = []
+        batch = []
+        max_src_len = max_tgt_len = 0
+        for idx in indices:
+            src_len, tgt_len = self.lengths[idx]
+            new_src_len = max(max_src_len, src_len)
+            new_tgt_len = max(max_tgt_len, tgt_len)
+            
+            # 加入该样本后超出预算则先结束当前批次
+            if batch and (len(batch) + 1) * (new_src_len + new_tgt_len) > self.max_tokens:
+                batches.append(batch)
+                batch = []
+                new_src_len, new_tgt_len = src_len, tgt_len
+            
+            batch.append(idx)
+            max_src_len, max_tgt_len = new_src_len, new_tgt_len
+        
+        if batch:
+            batches.append(batch)
+        
+        if self.shuffle:
+            # 在相邻长度的桶内打乱，再打乱桶的顺序
+            buckets = [batches[i:i + self.bucket_size] for i in range(0, len(batches), self.bucket_size)]
+            for bucket in buckets:
+                rng.shuffle(bucket)
+            rng.shuffle(buckets)
+            batches = [batch for bucket in buckets for batch in bucket]
+        
+        if self.num_replicas > 1:
+            # 各进程的批次数必须相同（否则梯度同步会互相等待），不足时从头补齐
+            num_padding = -len(batches) % self.num_replicas
+            batches = (batches + batches[:num_padding])[self.rank::self.num_replicas]
+        
+        return batches
+    
+    def __iter__(self) -> Iterator[List[int]]:
+        return iter(self._batches)
+    
+    def __len__(self) -> int:
+        return len(self._batches)
+
+
+def setup_distributed(backend: str = 'gloo') -> Tuple[int, int, int]:
+    """
+    初始化分布式进程组（由torchrun设置的 RANK、WORLD_SIZE、LOCAL_RANK、MASTER_ADDR、MASTER_PORT 环境变量）
+    Args:
+        backend: 通信后端，'gloo' 支持纯CPU环境，GPU集群可使用 'nccl'
+    Returns:
+        (rank, world_size, local_rank)
+    """
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+    return dist.get_rank(), dist.get_world_size(), int(os.environ.get('LOCAL_RANK', dist.get_rank()))
 
 
 def train_model(
@@ -45,50 +240,110 @@ def train_model(
     batch_size: int = 4,
     num_epochs: int = 100,
     learning_rate: float = 0.0001,
-    device: Optional[str] = None
+    device: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    tokenizer: str = 'char',
+    precision: str = 'fp32',
+    distributed: bool = False,
+    dist_backend: str = 'gloo',
+    grad_accum_steps: int = 1,
+    activation_checkpointing: bool = False,
+    metrics_log_path: Optional[str] = None,
+    profile_steps: Optional[Tuple[int, int]] = None,
+    profile_dir: str = "profiler_traces"
 ):
     """
     训练ReactionTransformer模型
     Args:
-        data_path: 训练数据路径
+        data_path: 训练数据路径（JSON文件，或 preprocess.py 生成的预处理目录）
         model_save_path: 模型保存路径
         vocab_save_path: 词汇表保存路径
         batch_size: 批量大小
         num_epochs: 训练轮数
         learning_rate: 学习率
         device: 计算设备
+        max_tokens: 按token预算组批（每批padding后的最大token数），设置后忽略batch_size
+        tokenizer: 词汇表分词方式，'char'（逐字符）或 'atom'（原子级，如Cl、Br、[nH]、%10为单个token）；
+                   使用预处理目录时以其中的词汇表为准
+        precision: 训练精度，'fp32'、'bf16'（CPU/GPU自动混合精度）或 'fp16'（仅CUDA，使用损失缩放）
+        distributed: 是否使用DistributedDataParallel多进程训练（通过torchrun启动），
+                     每个进程读取不同的数据分片，梯度在反向传播时自动all-reduce
+        dist_backend: 分布式通信后端（'gloo' 或 'nccl'）
+        grad_accum_steps: 梯度累积的micro-batch数，每累积这么多个批次更新一次参数
+                          （有效批量 = 批量大小 × grad_accum_steps × 进程数）
+        activation_checkpointing: 是否对编码器/解码器各层使用激活检查点，降低激活内存
+        metrics_log_path: 每个训练步的性能指标日志路径（JSONL：吞吐量、padding比例、
+                          数据等待/collate/前向/反向/优化器耗时、内存峰值），None表示不写日志
+        profile_steps: (起始步, 步数)，用torch.profiler采集这些训练步并导出Chrome追踪文件
+        profile_dir: 追踪文件保存目录
     """
     
+    # 分布式训练：只有0号进程打印日志和保存文件
+    rank, world_size, local_rank = setup_distributed(dist_backend) if distributed else (0, 1, 0)
+    is_main_process = rank == 0
+    log = print if is_main_process else (lambda *args, **kwargs: None)
+    
     # 设置设备
     if device is None:
-        device_obj = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        if torch.cuda.is_available():
+            device_obj = torch.device('cuda', local_rank) if distributed else torch.device('cuda')
+        else:
+            device_obj = torch.device('cpu')
     else:
         device_obj = torch.device(device)
-    print(f"使用设备: {device_obj}")
+    log(f"使用设备: {device_obj}" + (f"，分布式进程数: {world_size}" if distributed else ""))
     
     # 1. 加载数据
-    print("正在加载数据...")
-    dataset = ReactionDataset(data_path)
-    
-    # 2. 构建词汇表
-    print("正在构建词汇表...")
-    vocab = SMILESVocabulary()
-    vocab.build_vocab_from_data(dataset.data)
+    log("正在加载数据...")
+    if os.path.isdir(data_path):
+        # 预处理数据：词汇表随数据保存，无需重新构建
+        dataset = MemmapReactionDataset(data_path, verbose=is_main_process)
+        vocab = load_vocab(dataset.vocab_path, verbose=is_main_process)
+        collate_fn_with_vocab = partial(collate_tokenized_fn, pad_idx=vocab.get_pad_idx())
+    else:
+        dataset = ReactionDataset(data_path, verbose=is_main_process)
+        
+        # 2. 构建词汇表（各进程从相同数据构建，结果一致）
+        log("正在构建词汇表...")
+        vocab = SMILESVocabulary(tokenizer=tokenizer)
+        vocab.build_vocab_from_data(dataset.data)
+        collate_fn_with_vocab = partial(collate_fn, vocab=vocab)
     
     # 保存词汇表
-    save_vocab(vocab, vocab_save_path)
-    
-    # 3. 创建数据加载器
-    collate_fn_with_vocab = partial(collate_fn, vocab=vocab)
-    dataloader = DataLoader(
-        dataset, 
-        batch_size=batch_size, 
-        shuffle=True, 
-        collate_fn=collate_fn_with_vocab
-    )
+    if is_main_process:
+        save_vocab(vocab, vocab_save_path)
+    
+    # 3. 创建数据加载器（collate耗时随批次返回，用于性能统计）
+    collate_fn_with_vocab = partial(timed_collate, collate=collate_fn_with_vocab)
+    batch_sampler = None
+    sampler = None
+    if max_tokens is not None:
+        # 长度分桶 + token预算组批，减少padding浪费
+        lengths = dataset.get_lengths() if isinstance(dataset, MemmapReactionDataset) else dataset.get_lengths(vocab)
+        batch_sampler = TokenBucketSampler(lengths, max_tokens=max_tokens, num_replicas=world_size, rank=rank)
+        dataloader = DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=collate_fn_with_vocab
+        )
+    elif distributed:
+        sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=True)
+        dataloader = DataLoader(
+            dataset,
+            batch_size=batch_size,
+            sampler=sampler,
+            collate_fn=collate_fn_with_vocab
+        )
+    else:
+        dataloader = DataLoader(
+            dataset, 
+            batch_size=batch_size, 
+            shuffle=True, 
+            collate_fn=collate_fn_with_vocab
+        )
     
     # 4. 创建模型
-    print("正在创建模型...")
+    log("正在创建模型...")
     model = ReactionTransformer(
         vocab_size=vocab.vocab_size,
         d_model=256,
@@ -102,7 +357,23 @@ def train_model(
     )
     
     model = model.to(device_obj)
-    print(f"模型参数数量: {sum(p.numel() for p in model.parameters()):,}")
+    log(f"模型参数数量: {sum(p.numel() for p in model.parameters()):,}")
+    
+    if grad_accum_steps < 1:
+        raise ValueError("grad_accum_steps必须大于等于1")
+    if activation_checkpointing:
+        model.set_gradient_checkpointing(True)
+        log("已开启激活检查点")
+    
+    # DDP在构造时从0号进程广播初始权重，反向传播时all-reduce梯度；
+    # 模型唯一的buffer是固定的位置编码表，无需每步广播
+    raw_model = model
+    if distributed:
+        model = DistributedDataParallel(
+            model,
+            device_ids=[local_rank] if device_obj.type == 'cuda' else None,
+            broadcast_buffers=False
+        )
     
     # 5. 设置优化器和损失函数
     optimizer = optim.Adam(model.parameters(), lr=learning_rate)
@@ -111,18 +382,41 @@ def train_model(
     # 学习率调度器
     scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=30, gamma=0.5)
     
+    # 混合精度：bf16动态范围与fp32相同，无需损失缩放；fp16需要GradScaler防止梯度下溢
+    autocast_context(device_obj, precision)  # 提前校验精度设置
+    scaler = torch.cuda.amp.GradScaler() if precision == 'fp16' else None
+    
     # 6. 训练循环
-    print("开始训练...")
+    metrics = TrainingMetrics(device_obj, log_path=metrics_log_path, profile_steps=profile_steps,
+                              profile_dir=profile_dir, rank=rank)
+    log("开始训练...")
     model.train()
     
     for epoch in range(num_epochs):
         total_loss = 0.0
         num_batches = 0
+        num_samples = 0
+        num_tokens = 0
+        num_steps = 0
+        epoch_start = time.perf_counter()
+        optimizer.zero_grad()
+        
+        if batch_sampler is not None:
+            batch_sampler.set_epoch(epoch)
+        if sampler is not None:
+            sampler.set_epoch(epoch)
         
         # 使用进度条
-        pbar = tqdm(dataloader, desc=f"Epoch {epoch+1}/{num_epochs}")
+        pbar = tqdm(dataloader, desc=f"Epoch {epoch+1}/{num_epochs}", disable=not is_main_process)
         
-        for batch in pbar:
+        for batch_idx, batch in enumerate(pbar):
+            metrics.batch_ready(batch)
+            
+            # 每 grad_accum_steps 个micro-batch更新一次参数，最后一组可能不足
+            group_start = batch_idx - batch_idx % grad_accum_steps
+            group_size = min(grad_accum_steps, len(dataloader) - group_start)
+            is_update_step = batch_idx + 1 == group_start + group_size
+            
             # 移动数据到设备
             src = batch['src'].to(device_obj)
             tgt_input = batch['tgt_input'].to(device_obj)
@@ -131,44 +425,74 @@ def train_model(
             src_padding_mask = batch['src_padding_mask'].to(device_obj)
             tgt_padding_mask = batch['tgt_padding_mask'].to(device_obj)
             
-            # 创建因果掩码（防止解码器看到未来信息）
-            tgt_len = tgt_input.size(1)
-            tgt_mask = create_causal_mask(tgt_len).to(device_obj)
+            # 因果掩码（防止解码器看到未来信息），取自模型预分配的buffer
+            tgt_mask = raw_model.causal_mask(tgt_input.size(1))
             
-            # 前向传播
-            optimizer.zero_grad()
+            # 累积阶段跳过DDP的梯度all-reduce，只在更新参数的micro-batch同步一次
+            sync_context = model.no_sync() if distributed and not is_update_step else nullcontext()
             
-            output = model(
-                src=src,
-                tgt=tgt_input,
-                conditions=conditions,
-                tgt_mask=tgt_mask,
-                src_key_padding_mask=src_padding_mask,
-                tgt_key_padding_mask=tgt_padding_mask
-            )
-            
-            # 计算损失
-            output_flat = output.reshape(-1, vocab.vocab_size)
-            target_flat = tgt_output.reshape(-1)
-            loss = criterion(output_flat, target_flat)
-            
-            # 反向传播
-            loss.backward()
+            with sync_context:
+                with metrics.timer('forward'):
+                    # 前向传播
+                    with autocast_context(device_obj, precision):
+                        output = model(
+                            src=src,
+                            tgt=tgt_input,
+                            conditions=conditions,
+                            tgt_mask=tgt_mask,
+                            src_key_padding_mask=src_padding_mask,
+                            tgt_key_padding_mask=tgt_padding_mask
+                        )
+                    
+                    # 计算损失（在fp32下计算）
+                    output_flat = output.float().reshape(-1, vocab.vocab_size)
+                    target_flat = tgt_output.reshape(-1)
+                    loss = criterion(output_flat, target_flat)
+                
+                # 反向传播（按组内批次数缩放，累积后的梯度等于组内平均损失的梯度）
+                with metrics.timer('backward'):
+                    if scaler is not None:
+                        scaler.scale(loss / group_size).backward()
+                    else:
+                        (loss / group_size).backward()
             
-            # 梯度裁剪（防止梯度爆炸）
-            torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
+            if is_update_step:
+                with metrics.timer('optimizer'):
+                    if scaler is not None:
+                        scaler.unscale_(optimizer)
+                    
+                    # 梯度裁剪（防止梯度爆炸）
+                    torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
+                    
+                    if scaler is not None:
+                        scaler.step(optimizer)
+                        scaler.update()
+                    else:
+                        optimizer.step()
+                    optimizer.zero_grad()
+                num_steps += 1
             
-            optimizer.step()
-            
-            # 记录损失
-            total_loss += loss.item()
+            # 记录损失和本步性能指标
+            step_loss = loss.item()
+            total_loss += step_loss
             num_batches += 1
+            record = metrics.end_step(epoch, step_loss, batch, is_update_step)
+            num_samples += record['samples']
+            num_tokens += record['tokens']
             
             # 更新进度条
-            pbar.set_postfix({'loss': f'{loss.item():.4f}'})
+            elapsed = time.perf_counter() - epoch_start
+            pbar.set_postfix({'loss': f'{step_loss:.4f}', 'tok/s': f'{num_tokens / elapsed:.0f}'})
+        
+        epoch_time = time.perf_counter() - epoch_start
+        epoch_metrics = metrics.epoch_summary()
         
-        # 计算平均损失
+        # 计算平均损失（分布式训练时取所有进程的平均）
         avg_loss = total_loss / num_batches
+        if distributed:
+            loss_tensor = torch.tensor(avg_loss, device=device_obj)
+            dist.all_reduce(loss_tensor)
+            avg_loss = loss_tensor.item() / world_size
         
         # 更新学习率
         scheduler.step()
@@ -176,17 +500,25 @@ def train_model(
         
         # 每10个epoch打印一次详细信息
         if (epoch + 1) % 10 == 0:
-            print(f"\nEpoch {epoch+1}/{num_epochs}")
-            print(f"平均损失: {avg_loss:.4f}")
-            print(f"当前学习率: {current_lr:.6f}")
-            print("-" * 50)
+            log(f"\nEpoch {epoch+1}/{num_epochs}")
+            log(f"平均损失: {avg_loss:.4f}")
+            log(f"当前学习率: {current_lr:.6f}")
+            log(f"吞吐量: {num_samples * world_size / epoch_time:.1f} 样本/秒，"
+                f"{num_tokens * world_size / epoch_time:.0f} token/秒，"
+                f"参数更新 {num_steps} 次，有效批量约 {num_samples * world_size / max(num_steps, 1):.1f}")
+            log(f"padding比例: {epoch_metrics['padding_ratio']:.1%}，耗时占比: "
+                + "，".join(f"{stage} {epoch_metrics[stage + '_fraction']:.1%}"
+                           for stage in STAGES))
+            log("-" * 50)
+    
+    metrics.close()
     
     # 7. 保存模型
-    print("正在保存模型...")
+    log("正在保存模型...")
     
-    # 保存完整模型状态
+    # 保存完整模型状态（DDP包装前的模型，键名与单进程训练一致）
     model_state = {
-        'model_state_dict': model.state_dict(),
+        'model_state_dict': raw_model.state_dict(),
         'vocab_size': vocab.vocab_size,
         'model_config': {
             'd_model': 256,
@@ -199,27 +531,53 @@ def train_model(
             'max_len': 200
         },
         'epoch': num_epochs,
-        'loss': avg_loss
+        'loss': float(avg_loss),  # 只保存基本类型，推理时可以用weights_only方式快速加载
+        'precision': precision
     }
     
-    torch.save(model_state, model_save_path)
-    print(f"模型已保存到: {model_save_path}")
+    if is_main_process:
+        torch.save(model_state, model_save_path)
+        print(f"模型已保存到: {model_save_path}")
+    
+    if distributed:
+        # 等待0号进程保存完成后再退出
+        dist.barrier()
     
-    print("训练完成！")
-    return model, vocab
+    log("训练完成！")
+    return raw_model, vocab
 
 
 def main():
-    """主函数"""
-    print("=" * 60)
-    print("ReactionTransformer 消毒副产物路径预测模型训练")
-    print("=" * 60)
+    """主函数（多进程训练: torchrun --nproc_per_node 4 train.py）"""
+    parser = argparse.ArgumentParser(description="ReactionTransformer 模型训练")
+    parser.add_argument("--data", default="data/sample_data.json",
+                        help="训练数据（JSON文件，或 preprocess.py 生成的预处理目录）")
+    parser.add_argument("--tokenizer", default="char", choices=TOKENIZERS,
+                        help="词汇表分词方式（使用预处理目录时以其中的词汇表为准）")
+    parser.add_argument("--grad-accum-steps", type=int, default=1, help="梯度累积的micro-batch数")
+    parser.add_argument("--activation-checkpointing", action="store_true", help="对编码器/解码器各层使用激活检查点")
+    parser.add_argument("--max-tokens", type=int, default=None, help="按token预算组批（每批最大token数）")
+    parser.add_argument("--precision", default="fp32", help="训练精度（fp32/bf16/fp16）")
+    parser.add_argument("--metrics-log", default=None, help="每个训练步的性能指标日志路径（JSONL）")
+    parser.add_argument("--profile-steps", type=int, nargs=2, default=None, metavar=("START", "NUM"),
+                        help="用torch.profiler采集从START开始的NUM个训练步")
+    parser.add_argument("--profile-dir", default="profiler_traces", help="profiler追踪文件保存目录")
+    args = parser.parse_args()
+    
+    # torchrun 会为每个进程设置 WORLD_SIZE 和 RANK
+    distributed = int(os.environ.get('WORLD_SIZE', 1)) > 1
+    # 非0号进程不输出说明信息
+    log = print if int(os.environ.get('RANK', 0)) == 0 else (lambda *args, **kwargs: None)
+    
+    log("=" * 60)
+    log("ReactionTransformer 消毒副产物路径预测模型训练")
+    log("=" * 60)
     
     # 检查数据文件是否存在
-    data_path = "data/sample_data.json"
+    data_path = args.data
     if not os.path.exists(data_path):
-        print(f"错误: 数据文件 {data_path} 不存在!")
-        print("请确保已正确放置示例数据文件。")
+        log(f"错误: 数据文件 {data_path} 不存在!")
+        log("请通过 --data 指定JSON数据文件或 preprocess.py 生成的预处理目录。")
         return
     
     # 开始训练
@@ -231,21 +589,33 @@ def main():
             batch_size=2,  # 小批量适应小数据集
             num_epochs=50,  # 减少训练轮数
             learning_rate=0.0005,  # 调整学习率
-            device=None  # 自动选择设备
+            device=None,  # 自动选择设备
+            max_tokens=args.max_tokens,
+            tokenizer=args.tokenizer,
+            precision=args.precision,
+            distributed=distributed,
+            grad_accum_steps=args.grad_accum_steps,
+            activation_checkpointing=args.activation_checkpointing,
+            metrics_log_path=args.metrics_log,
+            profile_steps=tuple(args.profile_steps) if args.profile_steps else None,
+            profile_dir=args.profile_dir
         )
         
-        print("\n" + "=" * 60)
-        print("训练成功完成！")
-        print("生成的文件:")
-        print("- transformer_model.pth: 训练好的模型权重")
-        print("- vocabulary.json: 词汇表文件")
-        print("\n现在可以运行 predict.py 进行推理测试")
-        print("=" * 60)
+        log("\n" + "=" * 60)
+        log("训练成功完成！")
+        log("生成的文件:")
+        log("- transformer_model.pth: 训练好的模型权重")
+        log("- vocabulary.json: 词汇表文件")
+        log("\n现在可以运行 predict.py 进行推理测试")
+        log("=" * 60)
         
     except Exception as e:
         print(f"训练过程中出现错误: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        if distributed and dist.is_initialized():
+            dist.destroy_process_group()
 
 
 if __name__ == "__main__":
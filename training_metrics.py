@@ -0,0 +1,212 @@
+"""
+训练性能指标 - 记录每个训练步的吞吐量、padding比例、各阶段耗时和内存占用
+结果写入结构化的JSONL日志（每行一个训练步），并可选地用 torch.profiler 采集指定步的性能追踪
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import torch
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，不记录CPU内存峰值
+    resource = None
+
+# 每个训练步记录耗时的阶段
+STAGES = ('data_wait', 'collate', 'forward', 'backward', 'optimizer')
+
+# collate耗时随批次一起返回，DataLoader使用多个worker进程时同样有效
+COLLATE_TIME_KEY = 'collate_time_s'
+
+
+def timed_collate(batch: List, collate: Callable) -> Dict:
+    """
+    包装collate函数，将耗时记录在返回的批次字典中
+    Args:
+        batch: 样本列表
+        collate: 原collate函数
+    Returns:
+        collate结果，额外包含 COLLATE_TIME_KEY
+    """
+    start = time.perf_counter()
+    result = collate(batch)
+    result[COLLATE_TIME_KEY] = time.perf_counter() - start
+    return result
+
+
+def peak_memory_mb(device: torch.device) -> float:
+    """当前进程的内存峰值（CUDA为显存分配峰值，CPU为进程最大常驻内存）"""
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 1024 ** 2
+    if resource is not None:
+        # Linux下ru_maxrss单位为KB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return 0.0
+
+
+class TrainingMetrics:
+    """按训练步收集性能指标"""
+
+    def __init__(
+        self,
+        device: torch.device,
+        log_path: Optional[str] = None,
+        profile_steps: Optional[Tuple[int, int]] = None,
+        profile_dir: str = "profiler_traces",
+        rank: int = 0
+    ):
+        """
+        初始化指标收集器
+        Args:
+            device: 训练设备（CUDA下计时前会同步，保证耗时归属正确的阶段）
+            log_path: JSONL日志路径，None表示不写日志；多进程训练时每个进程写入 <log_path>.rank<N>
+            profile_steps: (起始步, 步数)，对这些训练步运行 torch.profiler 并导出Chrome追踪文件
+            profile_dir: 追踪文件保存目录
+            rank: 分布式训练的进程编号
+        """
+        self.device = device
+        self.rank = rank
+        self.global_step = 0
+        self._synchronize = device.type == 'cuda' and log_path is not None
+
+        self._log_file = None
+        if log_path is not None:
+            if rank > 0:
+                log_path = f"{log_path}.rank{rank}"
+            self._log_file = open(log_path, 'a', encoding='utf-8')
+
+        self._profiler = None
+        if profile_steps is not None:
+            start_step, num_steps = profile_steps
+            os.makedirs(profile_dir, exist_ok=True)
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if device.type == 'cuda':
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            # 预热占用起始步之前的一步，使记录恰好从 start_step 开始；从第0步开始时无法预热
+            warmup = 1 if start_step > 0 else 0
+            self._profiler = torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(skip_first=start_step - warmup, wait=0, warmup=warmup,
+                                                 active=num_steps, repeat=1),
+                on_trace_ready=lambda prof: prof.export_chrome_trace(
+                    os.path.join(profile_dir, f"trace_rank{rank}_step{prof.step_num}.json")
+                ),
+                record_shapes=True,
+                profile_memory=True
+            )
+            self._profiler.start()
+
+        self._reset_step()
+        self._epoch_totals: Dict[str, float] = {}
+        self._last_step_end = time.perf_counter()
+
+    def _reset_step(self) -> None:
+        self._timings = {stage: 0.0 for stage in STAGES}
+
+    def batch_ready(self, batch: Dict) -> None:
+        """
+        取到批次后调用：记录数据等待时间（上一步结束到取到批次）和collate耗时
+        DataLoader不使用worker进程时collate在主进程中执行，其耗时同时包含在数据等待时间内
+        """
+        self._timings['data_wait'] = time.perf_counter() - self._last_step_end
+        self._timings['collate'] = batch.pop(COLLATE_TIME_KEY, 0.0)
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """累计某个阶段的耗时（同一步内可多次进入）"""
+        if self._synchronize:
+            torch.cuda.synchronize(self.device)
+        start = time.perf_counter()
+        with torch.profiler.record_function(stage):
+            yield
+        if self._synchronize:
+            torch.cuda.synchronize(self.device)
+        self._timings[stage] += time.perf_counter() - start
+
+    def end_step(self, epoch: int, loss: float, batch: Dict, optimizer_step: bool) -> Dict:
+        """
+        结束一个训练步（micro-batch），写入日志
+        Args:
+            epoch: 当前epoch
+            loss: 本步损失
+            batch: 本步的批次（用于统计token数和padding比例）
+            optimizer_step: 本步是否更新了参数
+        Returns:
+            本步的指标记录
+        """
+        now = time.perf_counter()
+        step_time = now - self._last_step_end
+        self._last_step_end = now
+
+        padded_tokens = batch['src_padding_mask'].numel() + batch['tgt_padding_mask'].numel()
+        real_tokens = int((~batch['src_padding_mask']).sum() + (~batch['tgt_padding_mask']).sum())
+
+        record = {
+            'step': self.global_step,
+            'epoch': epoch,
+            'rank': self.rank,
+            'loss': loss,
+            'optimizer_step': optimizer_step,
+            'samples': batch['src'].size(0),
+            'tokens': real_tokens,
+            'padding_ratio': 1.0 - real_tokens / max(padded_tokens, 1),
+            'step_time_s': step_time,
+            'tokens_per_s': real_tokens / step_time if step_time > 0 else 0.0,
+            **{f'{stage}_s': value for stage, value in self._timings.items()},
+            'peak_memory_mb': peak_memory_mb(self.device)
+        }
+
+        if self._log_file is not None:
+            self._log_file.write(json.dumps(record) + '\n')
+
+        for key in ('samples', 'tokens', 'step_time_s') + tuple(f'{stage}_s' for stage in STAGES):
+            self._epoch_totals[key] = self._epoch_totals.get(key, 0.0) + record[key]
+        self._epoch_totals['padded_tokens'] = self._epoch_totals.get('padded_tokens', 0.0) + padded_tokens
+
+        if self._profiler is not None:
+            self._profiler.step()
+        self.global_step += 1
+        self._reset_step()
+        return record
+
+    def epoch_summary(self) -> Dict[str, float]:
+        """
+        汇总并清空本epoch的统计
+        Returns:
+            吞吐量、padding比例和各阶段耗时占比
+        """
+        totals = self._epoch_totals
+        self._epoch_totals = {}
+        step_time = totals.get('step_time_s', 0.0)
+        if step_time <= 0:
+            # 本epoch没有训练步时各项指标为0，调用方无需区分
+            summary = {
+                'samples_per_s': 0.0,
+                'tokens_per_s': 0.0,
+                'padding_ratio': 0.0,
+                **{f'{stage}_fraction': 0.0 for stage in STAGES}
+            }
+        else:
+            summary = {
+                'samples_per_s': totals['samples'] / step_time,
+                'tokens_per_s': totals['tokens'] / step_time,
+                'padding_ratio': 1.0 - totals['tokens'] / max(totals['padded_tokens'], 1),
+                **{f'{stage}_fraction': totals[f'{stage}_s'] / step_time for stage in STAGES}
+            }
+        if self._log_file is not None:
+            self._log_file.flush()
+        # 新epoch开始前的验证/日志时间不计入下一步的数据等待
+        self._last_step_end = time.perf_counter()
+        return summary
+
+    def close(self) -> None:
+        """停止profiler并关闭日志文件"""
+        if self._profiler is not None:
+            self._profiler.stop()
+            self._profiler = None
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
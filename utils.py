@@ -6,12 +6,33 @@ import torch
 import torch.nn as nn
 from typing import List, Dict, Tuple, Optional
 import json
+import re
+import contextlib
+import numpy as np
+
+# 原子级SMILES分词正则：方括号原子、双字符元素（Br/Cl）、两位数环闭合（%10）作为单个token，
+# 末尾的 '.' 兜底匹配其余任意字符，保证分词结果拼接后与原字符串一致
+SMILES_ATOM_PATTERN = re.compile(
+    r"(\[[^\]]+]|Br?|Cl?|N|O|S|P|F|I|b|c|n|o|s|p|\(|\)|\.|=|#|-|\+|\\|\/|:|~|@|\?|>|\*|\$|%[0-9]{2}|[0-9]|.)"
+)
+
+# 支持的分词方式
+TOKENIZERS = ('char', 'atom')
 
 
 class SMILESVocabulary:
-    """SMILES词汇表类，用于管理字符级词汇表"""
+    """SMILES词汇表类，支持字符级（char）和原子级（atom）词汇表"""
     
-    def __init__(self):
+    def __init__(self, tokenizer: str = 'char'):
+        """
+        初始化词汇表
+        Args:
+            tokenizer: 分词方式，'char' 逐字符，'atom' 按原子/环闭合等化学单元
+        """
+        if tokenizer not in TOKENIZERS:
+            raise ValueError(f"未知的分词方式: {tokenizer}，可选: {TOKENIZERS}")
+        self.tokenizer = tokenizer
+        
         # 特殊词汇
         self.special_tokens = ['<pad>', '<sos>', '<eos>', '<unk>']
         self.pad_token = '<pad>'
@@ -24,34 +45,47 @@ class SMILESVocabulary:
         self.idx_to_char = {}
         self.vocab_size = 0
         
+        # 向量化编码/解码使用的查找表（延迟构建）
+        self._lookup_tables = None
+        
     def build_vocab_from_data(self, data: List[Dict]) -> None:
         """
         从数据集中构建词汇表
         Args:
             data: 包含SMILES字符串的数据列表
         """
-        # 收集所有唯一字符
-        all_chars = set()
+        # 收集所有唯一词汇
+        all_tokens = set()
         
-        # 从反应物和产物SMILES中提取字符
+        # 从反应物和产物SMILES中提取词汇
         for item in data:
-            reactant_smiles = item['reactant_smiles']
-            product_smiles = item['product_smiles']
-            
-            # 添加字符到集合中
-            all_chars.update(reactant_smiles)
-            all_chars.update(product_smiles)
+            all_tokens.update(self.tokenize(item['reactant_smiles']))
+            all_tokens.update(self.tokenize(item['product_smiles']))
         
         # 构建词汇表（特殊词汇优先）
-        vocab_chars = self.special_tokens + sorted(list(all_chars))
+        vocab_chars = self.special_tokens + sorted(list(all_tokens))
         
-        # 建立字符到索引的映射
+        # 建立词汇到索引的映射
         self.char_to_idx = {char: idx for idx, char in enumerate(vocab_chars)}
         self.idx_to_char = {idx: char for char, idx in self.char_to_idx.items()}
         self.vocab_size = len(vocab_chars)
         
         print(f"词汇表大小: {self.vocab_size}")
-        print(f"包含字符: {sorted(list(all_chars))}")
+        print(f"包含词汇: {sorted(list(all_tokens))}")
+        
+        self._lookup_tables = None
+    
+    def tokenize(self, smiles: str) -> List[str]:
+        """
+        将SMILES字符串切分为词汇
+        Args:
+            smiles: SMILES字符串
+        Returns:
+            词汇列表
+        """
+        if self.tokenizer == 'atom':
+            return SMILES_ATOM_PATTERN.findall(smiles)
+        return list(smiles)
     
     def encode_smiles(self, smiles: str, add_special_tokens: bool = True) -> List[int]:
         """
@@ -67,8 +101,8 @@ class SMILESVocabulary:
         if add_special_tokens:
             tokens.append(self.char_to_idx[self.sos_token])
         
-        # 逐字符编码
-        for char in smiles:
+        # 逐词汇编码
+        for char in self.tokenize(smiles):
             if char in self.char_to_idx:
                 tokens.append(self.char_to_idx[char])
             else:
@@ -104,6 +138,114 @@ class SMILESVocabulary:
         
         return ''.join(chars)
     
+    def _get_lookup_tables(self) -> Dict[str, np.ndarray]:
+        """
+        构建向量化编码/解码使用的查找表
+        Returns:
+            字典，包含:
+            byte_to_idx [256]: ASCII字节 -> 索引（仅字符级词汇表可用于编码）
+            idx_to_byte [vocab_size]: 索引 -> ASCII字节（特殊标记为0）
+            idx_to_token [vocab_size]: 索引 -> 词汇字符串（特殊标记为空串）
+            byte_level: 是否可以按字节查表（字符级分词且所有词汇都是单个ASCII字符）
+        """
+        if self._lookup_tables is None:
+            byte_to_idx = np.full(256, self.char_to_idx[self.unk_token], dtype=np.int64)
+            idx_to_byte = np.zeros(self.vocab_size, dtype=np.uint8)
+            idx_to_token = np.full(self.vocab_size, '', dtype=object)
+            byte_level = self.tokenizer == 'char'
+            
+            for char, idx in self.char_to_idx.items():
+                if char in self.special_tokens:
+                    continue
+                idx_to_token[idx] = char
+                if len(char) != 1 or ord(char) > 127:
+                    byte_level = False
+                    continue
+                byte_to_idx[ord(char)] = idx
+                idx_to_byte[idx] = ord(char)
+            
+            self._lookup_tables = {
+                'byte_to_idx': byte_to_idx,
+                'idx_to_byte': idx_to_byte,
+                'idx_to_token': idx_to_token,
+                'byte_level': byte_level
+            }
+        
+        return self._lookup_tables
+    
+    def encode_batch(self, smiles_list: List[str], add_special_tokens: bool = True) -> torch.Tensor:
+        """
+        批量编码SMILES字符串为填充后的索引矩阵（查找表向量化实现，结果与逐条 encode_smiles 一致）
+        Args:
+            smiles_list: SMILES字符串列表
+            add_special_tokens: 是否添加特殊标记
+        Returns:
+            填充后的索引张量 [batch_size, max_len]
+        """
+        tables = self._get_lookup_tables()
+        joined = ''.join(smiles_list)
+        
+        if not tables['byte_level'] or not joined.isascii():
+            # 原子级分词或非ASCII输入无法按字节查表，退回逐条编码
+            sequences = [self.encode_smiles(smiles, add_special_tokens) for smiles in smiles_list]
+            return pad_sequences(sequences, self.get_pad_idx())
+        
+        encoded = joined.encode('ascii')
+        batch_size = len(smiles_list)
+        lengths = np.fromiter((len(smiles) for smiles in smiles_list), dtype=np.int64, count=batch_size)
+        start = 1 if add_special_tokens else 0
+        extra = 2 if add_special_tokens else 0
+        
+        padded = np.full((batch_size, int(lengths.max(initial=0)) + extra), self.get_pad_idx(), dtype=np.int64)
+        
+        # 每个字符在填充矩阵中的行列位置
+        rows = np.repeat(np.arange(batch_size), lengths)
+        offsets = np.cumsum(lengths) - lengths
+        cols = np.arange(len(encoded)) - np.repeat(offsets, lengths) + start
+        padded[rows, cols] = tables['byte_to_idx'][np.frombuffer(encoded, dtype=np.uint8)]
+        
+        if add_special_tokens:
+            padded[:, 0] = self.get_sos_idx()
+            padded[np.arange(batch_size), lengths + 1] = self.get_eos_idx()
+        
+        return torch.from_numpy(padded)
+    
+    def decode_batch(self, indices) -> List[str]:
+        """
+        批量解码索引矩阵为SMILES字符串（移除特殊标记，遇到结束符停止，结果与 decode_indices 一致）
+        Args:
+            indices: 索引矩阵 [batch_size, seq_len]（张量或数组），或不等长的索引列表
+        Returns:
+            解码后的SMILES字符串列表
+        """
+        if isinstance(indices, list):
+            return [self.decode_batch(np.asarray([seq], dtype=np.int64))[0] if seq else ''
+                    for seq in indices]
+        
+        if isinstance(indices, torch.Tensor):
+            indices = indices.cpu().numpy()
+        indices = np.asarray(indices, dtype=np.int64)
+        
+        tables = self._get_lookup_tables()
+        seq_len = indices.shape[1]
+        
+        # 每行第一个结束符的位置（没有结束符则为整行）
+        is_eos = indices == self.get_eos_idx()
+        end = np.where(is_eos.any(axis=1), is_eos.argmax(axis=1), seq_len)
+        
+        # 越界索引、特殊标记以及结束符之后的位置都需要移除
+        valid = (indices >= 0) & (indices < self.vocab_size)
+        valid &= np.arange(seq_len)[None, :] < end[:, None]
+        clipped = np.clip(indices, 0, self.vocab_size - 1)
+        
+        if tables['byte_level']:
+            chars = np.where(valid, tables['idx_to_byte'][clipped], 0).astype(np.uint8)
+            return [row[row != 0].tobytes().decode('ascii') for row in chars]
+        
+        # 多字符词汇：按行拼接词汇字符串
+        tokens = np.where(valid, tables['idx_to_token'][clipped], '')
+        return [''.join(row) for row in tokens]
+    
     def get_pad_idx(self) -> int:
         """获取padding标记的索引"""
         return self.char_to_idx[self.pad_token]
@@ -144,6 +286,30 @@ def encode_conditions(pH: float, disinfectant: str) -> List[float]:
     return conditions
 
 
+# 支持的数值精度
+PRECISIONS = ('fp32', 'bf16', 'fp16')
+
+
+def autocast_context(device: torch.device, precision: str = 'fp32'):
+    """
+    根据精度设置创建自动混合精度上下文
+    Args:
+        device: 计算设备
+        precision: 'fp32'（不启用）、'bf16' 或 'fp16'（仅CUDA）
+    Returns:
+        上下文管理器
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"未知的精度设置: {precision}，可选: {PRECISIONS}")
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    if precision == 'fp16' and device.type != 'cuda':
+        raise ValueError("fp16混合精度仅支持CUDA设备，CPU请使用bf16")
+    
+    dtype = torch.bfloat16 if precision == 'bf16' else torch.float16
+    return torch.autocast(device_type=device.type, dtype=dtype)
+
+
 def create_padding_mask(seq: torch.Tensor, pad_idx: int) -> torch.Tensor:
     """
     创建padding掩码
@@ -168,6 +334,22 @@ def create_causal_mask(size: int) -> torch.Tensor:
     return mask.bool()
 
 
+def pad_sequences(sequences: List[List[int]], pad_idx: int) -> torch.Tensor:
+    """
+    将不等长的索引序列填充为矩阵
+    Args:
+        sequences: 索引序列列表
+        pad_idx: padding标记的索引
+    Returns:
+        填充后的张量 [batch_size, max_len]
+    """
+    max_len = max(len(seq) for seq in sequences)
+    padded = torch.full((len(sequences), max_len), pad_idx, dtype=torch.long)
+    for i, seq in enumerate(sequences):
+        padded[i, :len(seq)] = torch.tensor(seq, dtype=torch.long)
+    return padded
+
+
 def collate_fn(batch: List[Dict], vocab: SMILESVocabulary) -> Dict[str, torch.Tensor]:
     """
     DataLoader的collate函数，用于批量处理数据
@@ -182,40 +364,65 @@ def collate_fn(batch: List[Dict], vocab: SMILESVocabulary) -> Dict[str, torch.Te
     product_smiles = [item['product_smiles'] for item in batch]
     conditions = [encode_conditions(item['pH'], item['disinfectant']) for item in batch]
     
-    # 编码SMILES
-    src_sequences = [vocab.encode_smiles(smiles, add_special_tokens=True) for smiles in reactant_smiles]
-    tgt_sequences = [vocab.encode_smiles(smiles, add_special_tokens=True) for smiles in product_smiles]
-    
-    # 找到最大长度
-    max_src_len = max(len(seq) for seq in src_sequences)
-    max_tgt_len = max(len(seq) for seq in tgt_sequences)
-    
-    # 填充序列
+    # 批量编码SMILES（直接得到填充后的张量）
     pad_idx = vocab.get_pad_idx()
+    src = vocab.encode_batch(reactant_smiles, add_special_tokens=True)
+    tgt = vocab.encode_batch(product_smiles, add_special_tokens=True)
     
-    src_padded = []
-    tgt_input_padded = []  # 用于输入（右移一位）
-    tgt_output_padded = []  # 用于目标（原始序列）
+    # 目标输入序列（去掉结束符，长度为 max_tgt_len-1）
+    tgt_input = tgt[:, :-1].clone()
+    tgt_input[tgt_input == vocab.get_eos_idx()] = pad_idx
     
-    for src_seq, tgt_seq in zip(src_sequences, tgt_sequences):
-        # 源序列填充
-        src_padded.append(src_seq + [pad_idx] * (max_src_len - len(src_seq)))
-        
-        # 目标输入序列（去掉最后一个token）
-        tgt_input = tgt_seq[:-1] + [pad_idx] * (max_tgt_len - len(tgt_seq))
-        tgt_input_padded.append(tgt_input)
-        
-        # 目标输出序列（去掉第一个token）
-        tgt_output = tgt_seq[1:] + [pad_idx] * (max_tgt_len - len(tgt_seq))
-        tgt_output_padded.append(tgt_output)
+    # 目标输出序列（去掉第一个token）
+    tgt_output = tgt[:, 1:]
     
     return {
-        'src': torch.tensor(src_padded, dtype=torch.long),
-        'tgt_input': torch.tensor(tgt_input_padded, dtype=torch.long),
-        'tgt_output': torch.tensor(tgt_output_padded, dtype=torch.long),
+        'src': src,
+        'tgt_input': tgt_input,
+        'tgt_output': tgt_output,
         'conditions': torch.tensor(conditions, dtype=torch.float32),
-        'src_padding_mask': create_padding_mask(torch.tensor(src_padded), pad_idx),
-        'tgt_padding_mask': create_padding_mask(torch.tensor(tgt_input_padded), pad_idx)
+        'src_padding_mask': create_padding_mask(src, pad_idx),
+        'tgt_padding_mask': create_padding_mask(tgt_input, pad_idx)
+    }
+
+
+def collate_tokenized_fn(batch: List[Dict], pad_idx: int) -> Dict[str, torch.Tensor]:
+    """
+    预处理（已编码）数据的collate函数，输出格式与 collate_fn 相同
+    Args:
+        batch: 批量数据，每项包含 'src'、'tgt' 索引数组和 'conditions' 条件向量
+        pad_idx: padding标记的索引
+    Returns:
+        处理后的批量数据字典
+    """
+    batch_size = len(batch)
+    max_src_len = max(len(item['src']) for item in batch)
+    max_tgt_len = max(len(item['tgt']) for item in batch) - 1
+    
+    # 先在NumPy中填充（内存映射切片为只读），最后一次性转换为张量
+    src = np.full((batch_size, max_src_len), pad_idx, dtype=np.int64)
+    tgt_input = np.full((batch_size, max_tgt_len), pad_idx, dtype=np.int64)
+    tgt_output = np.full((batch_size, max_tgt_len), pad_idx, dtype=np.int64)
+    
+    for i, item in enumerate(batch):
+        src_seq, tgt_seq = item['src'], item['tgt']
+        src[i, :len(src_seq)] = src_seq
+        # 目标输入去掉最后一个token，目标输出去掉第一个token
+        tgt_input[i, :len(tgt_seq) - 1] = tgt_seq[:-1]
+        tgt_output[i, :len(tgt_seq) - 1] = tgt_seq[1:]
+    
+    src = torch.from_numpy(src)
+    tgt_input = torch.from_numpy(tgt_input)
+    tgt_output = torch.from_numpy(tgt_output)
+    conditions = torch.from_numpy(np.stack([item['conditions'] for item in batch]).astype(np.float32))
+    
+    return {
+        'src': src,
+        'tgt_input': tgt_input,
+        'tgt_output': tgt_output,
+        'conditions': conditions,
+        'src_padding_mask': create_padding_mask(src, pad_idx),
+        'tgt_padding_mask': create_padding_mask(tgt_input, pad_idx)
     }
 
 
@@ -230,7 +437,8 @@ def save_vocab(vocab: SMILESVocabulary, filepath: str) -> None:
         'char_to_idx': vocab.char_to_idx,
         'idx_to_char': vocab.idx_to_char,
         'vocab_size': vocab.vocab_size,
-        'special_tokens': vocab.special_tokens
+        'special_tokens': vocab.special_tokens,
+        'tokenizer': vocab.tokenizer
     }
     
     with open(filepath, 'w', encoding='utf-8') as f:
@@ -239,22 +447,25 @@ def save_vocab(vocab: SMILESVocabulary, filepath: str) -> None:
     print(f"词汇表已保存到: {filepath}")
 
 
-def load_vocab(filepath: str) -> SMILESVocabulary:
+def load_vocab(filepath: str, verbose: bool = True) -> SMILESVocabulary:
     """
     从文件加载词汇表
     Args:
         filepath: 词汇表文件路径
+        verbose: 是否打印加载信息
     Returns:
         词汇表对象
     """
     with open(filepath, 'r', encoding='utf-8') as f:
         vocab_data = json.load(f)
     
-    vocab = SMILESVocabulary()
+    # 旧版词汇表文件没有tokenizer字段，均为字符级
+    vocab = SMILESVocabulary(tokenizer=vocab_data.get('tokenizer', 'char'))
     vocab.char_to_idx = vocab_data['char_to_idx']
     vocab.idx_to_char = {int(k): v for k, v in vocab_data['idx_to_char'].items()}
     vocab.vocab_size = vocab_data['vocab_size']
     vocab.special_tokens = vocab_data['special_tokens']
     
-    print(f"词汇表已从 {filepath} 加载完成")
+    if verbose:
+        print(f"词汇表已从 {filepath} 加载完成")
     return vocab 
\ No newline at end of file